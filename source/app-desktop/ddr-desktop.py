@@ -1,4 +1,5 @@
 import argparse
+import html
 import importlib.util
 import json
 import os
@@ -32,9 +33,20 @@ bootstrap = ENGINE_MODULE.bootstrap
 start_server_thread = ENGINE_MODULE.start_server_thread
 stop_server = ENGINE_MODULE.stop_server
 format_timestamp = ENGINE_MODULE.format_timestamp
-APP_CONFIG = getattr(ENGINE_MODULE, "APP_CONFIG", {}) if hasattr(ENGINE_MODULE, "APP_CONFIG") else {}
+APP_CONFIG = ENGINE_MODULE.get_app_config()
 
 WINDOW_STATE_FILENAME = "window-state.json"
+SPLASH_HTML = (
+    "<html><body style=\"margin:0;background:#111;color:#888;font-family:sans-serif;"
+    "display:flex;align-items:center;justify-content:center;height:100vh\">"
+    "Diffusion Darkroom</body></html>"
+)
+STARTUP_ERROR_HTML = (
+    "<html><body style=\"margin:0;background:#111;color:#ccc;font-family:sans-serif;"
+    "display:flex;align-items:center;justify-content:center;height:100vh\">"
+    "<div style=\"max-width:80%\"><h3>Diffusion Darkroom could not start</h3><pre style=\"white-space:pre-wrap\">{error}</pre>"
+    "</div></body></html>"
+)
 
 
 def get_desktop_config_value(key, fallback):
@@ -123,7 +135,9 @@ def read_window_bounds(window):
     return result
 
 
-class DesktopBridge:
+class DesktopBridge(ENGINE_MODULE.DesktopBridgeApi):
+    """js_api for the window: engine data calls (from DesktopBridgeApi) plus window controls."""
+
     def set_title(self, title):
         try:
             if webview.windows:
@@ -148,18 +162,32 @@ def parse_args():
 
 def main():
     args = parse_args()
-    httpd = None
-    server_thread = None
+    server = {"httpd": None, "thread": None, "error": None}
 
-    try:
-        httpd, _, url = bootstrap(mode="desktop", port=args.port)
-        server_thread = start_server_thread(httpd)
-        print(f"{format_timestamp()}DARKROOM: Launching desktop window at {url}", file=sys.stderr)
+    def start_engine(window):
+        # Runs once the window is on screen, in pywebview's start thread; the splash shows
+        # until the server is up. An exception here would never reach main(), so it is
+        # logged and shown in the window, and main() raises it once the window closes.
+        try:
+            httpd, _, url = bootstrap(mode="desktop", port=args.port)
+            server["httpd"] = httpd
+            server["thread"] = start_server_thread(httpd)
+        except Exception as exc:
+            server["error"] = exc
+            print(f"{format_timestamp()} ERROR: Desktop engine failed to start: {type(exc).__name__} - {exc}", file=sys.stderr)
+            try:
+                window.load_html(STARTUP_ERROR_HTML.format(error=html.escape(f"{type(exc).__name__}: {exc}")))
+            except Exception:
+                window.destroy()
+            return
+        print(f"{format_timestamp()}DARKROOM: Loading desktop window at {url}", file=sys.stderr)
+        window.load_url(url)
 
+    try:
         bridge = DesktopBridge()
         state = load_window_state()
         window_kwargs = {
-            "url": url,
+            "html": SPLASH_HTML,
             "width": int(state.get("width", args.width)),
             "height": int(state.get("height", args.height)),
             "min_size": (1000, 700),
@@ -199,7 +227,9 @@ def main():
         except Exception:
             pass
 
-        webview.start()
+        webview.start(start_engine, window)
+        if server["error"]:
+            raise server["error"]
 
     except KeyboardInterrupt:
         print(f"\n{format_timestamp()}DARKROOM: Desktop launcher interrupted.", file=sys.stderr)
@@ -207,11 +237,11 @@ def main():
         print(f"{format_timestamp()} ERROR: Desktop launcher failed: {type(exc).__name__} - {exc}", file=sys.stderr)
         raise
     finally:
-        if httpd:
-            stop_server(httpd)
+        if server["httpd"]:
+            stop_server(server["httpd"])
             print(f"{format_timestamp()}DARKROOM: Desktop server stopped.", file=sys.stderr)
-        if server_thread and server_thread.is_alive():
-            server_thread.join(timeout=2)
+        if server["thread"] and server["thread"].is_alive():
+            server["thread"].join(timeout=2)
 
 
 if __name__ == "__main__":
@@ -1,24 +1,84 @@
 import os
+import posixpath
 import json
 import sys
 import re
 import argparse
+import csv
+import io
 import http.server
+import http.cookies
 import socketserver
-import webbrowser
+import ipaddress
+import secrets
+import hmac
 import shutil
+import functools
 import threading
+import queue
 import time
-import subprocess
+
+STARTUP_T0 = time.perf_counter()
+
+import struct
+import math
+import zlib
+import hashlib
+import gzip
+import zipfile
+from array import array
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs, unquote
 
-try:
-    import tkinter as tk
-    from tkinter import filedialog
-except Exception:
-    tk = None
-    filedialog = None
+# Heavy or optional modules (tkinter, Pillow, webbrowser, multiprocessing, ...)
+# are imported on first use to keep startup fast.
+PIL_IMAGE = None
+PIL_IMAGE_CHECKED = False
+
+
+def get_pil_image():
+    """Pillow's Image module, or None when Pillow is not installed."""
+    global PIL_IMAGE, PIL_IMAGE_CHECKED
+    if not PIL_IMAGE_CHECKED:
+        try:
+            from PIL import Image as pil_image
+            PIL_IMAGE = pil_image
+        except Exception:
+            PIL_IMAGE = None
+        PIL_IMAGE_CHECKED = True
+    return PIL_IMAGE
+
+
+NUMPY = None
+NUMPY_CHECKED = False
+
+
+def get_numpy():
+    """numpy, or None when it is not installed (callers fall back to array/loops)."""
+    global NUMPY, NUMPY_CHECKED
+    if not NUMPY_CHECKED:
+        try:
+            import numpy
+            NUMPY = numpy
+        except Exception:
+            NUMPY = None
+        NUMPY_CHECKED = True
+    return NUMPY
+
+
+# Startup profile: (phase, seconds since the engine started importing)
+STARTUP_PROFILE = []
+
+
+def mark_startup(phase):
+    STARTUP_PROFILE.append((phase, time.perf_counter() - STARTUP_T0))
+
+
+def report_startup_profile():
+    if not get_app_config().get('web', {}).get('debugMode'):
+        return
+    phases = ', '.join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in STARTUP_PROFILE)
+    print(f"{format_timestamp()}DARKROOM: Startup profile: {phases}", file=sys.stderr)
 
 # Action name mapping for better display
 ACTION_NAME_MAP = {
@@ -66,6 +126,62 @@ def format_log_message(action, details):
         return f"{format_timestamp()}{prefix}{action_name}"
 
 
+# Client action logs are formatted and written by a background thread so
+# request handlers never block on stderr.
+ACTION_LOG_QUEUE = queue.Queue(maxsize=10000)
+ACTION_LOG_LOCK = threading.Lock()
+ACTION_LOG_THREAD = None
+ACTION_LOG_DROPPED = 0
+MAX_ACTION_LOG_BATCH = 500
+
+
+def action_log_writer_loop():
+    while True:
+        item = ACTION_LOG_QUEUE.get()
+        try:
+            if item is None:
+                return
+            action, details = item
+            print(format_log_message(action, details), file=sys.stderr)
+        except Exception:
+            pass
+        finally:
+            ACTION_LOG_QUEUE.task_done()
+
+
+def ensure_action_log_writer():
+    global ACTION_LOG_THREAD
+    if ACTION_LOG_THREAD is not None and ACTION_LOG_THREAD.is_alive():
+        return
+    with ACTION_LOG_LOCK:
+        if ACTION_LOG_THREAD is None or not ACTION_LOG_THREAD.is_alive():
+            ACTION_LOG_THREAD = threading.Thread(target=action_log_writer_loop, name='ddr-action-log', daemon=True)
+            ACTION_LOG_THREAD.start()
+
+
+def enqueue_action_log(action, details):
+    """Queue a client action for logging; drops (and counts) entries if the writer falls behind."""
+    global ACTION_LOG_DROPPED
+    if not isinstance(action, str) or not action:
+        action = 'unknown'
+    if not isinstance(details, dict):
+        details = {'value': details} if details not in (None, '') else {}
+    ensure_action_log_writer()
+    try:
+        ACTION_LOG_QUEUE.put_nowait((action, details))
+        return True
+    except queue.Full:
+        with ACTION_LOG_LOCK:
+            ACTION_LOG_DROPPED += 1
+        return False
+
+
+def flush_action_logs(timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while ACTION_LOG_QUEUE.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
 def get_app_dir():
     if getattr(sys, 'frozen', False):
         return os.path.dirname(os.path.abspath(sys.executable))
@@ -75,8 +191,17 @@ def get_app_dir():
 APP_DIR = get_app_dir()
 RUNTIME_CONFIG_PATH = os.path.join(APP_DIR, 'ddr-runtime.json')
 CURRENT_BASE_DIR = None
-WEB_TEMPLATE_PATH = None
-APP_CONFIG = None
+# Extra library roots served next to the primary base folder, keyed by alias.
+# Their images are namespaced as "@alias/relative/path" in listings and URLs.
+LIBRARY_ROOT_PREFIX = '@'
+EXTRA_LIBRARY_ROOTS = {}
+# Per-root scan results ("shards"); the primary base folder uses the '' key.
+LIBRARY_SHARDS = {}
+LIBRARY_LOCK = threading.RLock()
+LIBRARY_VERSION = 0
+LIBRARY_SCAN_STATE = {'scanning': False}
+_WEB_TEMPLATE_PATH = None
+_APP_CONFIG = None
 
 DEFAULT_APP_CONFIG = {
     "web": {
@@ -97,12 +222,66 @@ DEFAULT_APP_CONFIG = {
         "paging": {
             "options": [50, 100, 250, 500],
             "default": 100,
+            "continuous": False,
         },
         "zoom": {
             "default": 2.5,
         },
+        "desktopBridge": True,
+        "clientCache": {
+            "enabled": True,
+            "quotaMB": 64,
+        },
+        "memoryCache": {
+            "rawMetadata": 16,
+            "metadataFields": 48,
+            "searchIndex": 64,
+            "dimensions": 8,
+            "dates": 4,
+        },
+        "requestScheduler": {
+            "maxConcurrent": 6,
+            "minConcurrent": 2,
+            "targetLatencyMs": 300,
+        },
+        "prefetch": {
+            "enabled": True,
+            "lightboxAhead": 3,
+            "lightboxBehind": 1,
+            "nextPageImages": 12,
+            "budgetMB": 256,
+            "horizonMs": 3000,
+        },
         "debugMode": False,
     },
+    "server": {
+        "slowRequestMs": 500,
+        "maxConcurrentRequests": 8,
+        "bind": "",
+        "multiClient": False,
+        "editorAddresses": [],
+        "editorToken": "",
+        "startupScan": True,
+    },
+    "index": {
+        "thumbnails": True,
+        "thumbnailSize": 512,
+        "checkpointEvery": 500,
+        "fileIds": "inode",
+        "verifyIntegrity": True,
+        "verifyReadJobs": 2,
+    },
+    "state": {
+        "store": True,
+        "syncToFiles": False,
+    },
+    "tiles": {
+        "enabled": True,
+        "minSize": 4096,
+        "tileSize": 512,
+        "quality": 85,
+        "maxPixels": 1073741824,
+    },
     "desktop": {
         "title": "Diffusion Darkroom",
         "width": 1600,
@@ -200,9 +379,48 @@ def resolve_web_template_path():
     return os.path.join(APP_DIR, 'ddr.html')
 
 
-WEB_TEMPLATE_PATH = resolve_web_template_path()
-WEB_ASSET_DIR = os.path.dirname(WEB_TEMPLATE_PATH)
-APP_CONFIG = load_app_config()
+def get_web_template_path():
+    global _WEB_TEMPLATE_PATH
+    if _WEB_TEMPLATE_PATH is None:
+        _WEB_TEMPLATE_PATH = resolve_web_template_path()
+    return _WEB_TEMPLATE_PATH
+
+
+def get_web_asset_dir():
+    return os.path.dirname(get_web_template_path())
+
+
+def get_app_config():
+    global _APP_CONFIG
+    if _APP_CONFIG is None:
+        _APP_CONFIG = load_app_config()
+        mark_startup('config')
+    return _APP_CONFIG
+
+
+# Server settings that grant editor rights; never sent to clients
+CLIENT_HIDDEN_SERVER_KEYS = ('editorToken', 'editorAddresses')
+
+
+def get_client_app_config():
+    """The app config as served to pages (/app-config, /app-config.js), without server secrets."""
+    app_config = dict(get_app_config())
+    if isinstance(app_config.get('server'), dict):
+        app_config['server'] = {
+            key: value for key, value in app_config['server'].items() if key not in CLIENT_HIDDEN_SERVER_KEYS
+        }
+    return app_config
+
+
+def __getattr__(name):
+    # Lazy module attributes for callers that still read these as globals.
+    if name == 'APP_CONFIG':
+        return get_app_config()
+    if name == 'WEB_TEMPLATE_PATH':
+        return get_web_template_path()
+    if name == 'WEB_ASSET_DIR':
+        return get_web_asset_dir()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def load_runtime_config():
@@ -232,25 +450,37 @@ def set_active_base_dir(path, persist=True):
     global CURRENT_BASE_DIR
     if not path:
         CURRENT_BASE_DIR = None
+        with LIBRARY_LOCK:
+            LIBRARY_SHARDS.pop('', None)
         if persist:
             cfg = load_runtime_config()
-            cfg.pop('base_dir', None)
-            save_runtime_config(cfg)
+            if cfg.pop('base_dir', None) is not None:
+                save_runtime_config(cfg)
         return None
 
     normalized = os.path.abspath(path)
     if not os.path.isdir(normalized):
         raise ValueError(f"Selected folder does not exist: {normalized}")
 
+    if normalized != CURRENT_BASE_DIR:
+        with LIBRARY_LOCK:
+            LIBRARY_SHARDS.pop('', None)
     CURRENT_BASE_DIR = normalized
     if persist:
         cfg = load_runtime_config()
-        cfg['base_dir'] = normalized
-        save_runtime_config(cfg)
+        if cfg.get('base_dir') != normalized:
+            cfg['base_dir'] = normalized
+            save_runtime_config(cfg)
     return CURRENT_BASE_DIR
 
 
 def pick_base_dir_dialog(initial_dir=None):
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+    except Exception:
+        tk = None
+        filedialog = None
     if tk is not None and filedialog is not None:
         root = tk.Tk()
         root.withdraw()
@@ -279,6 +509,7 @@ def pick_base_dir_dialog(initial_dir=None):
             "}"
         )
         try:
+            import subprocess
             result = subprocess.run(
                 ["powershell", "-NoProfile", "-Command", ps_script],
                 capture_output=True,
@@ -302,43 +533,934 @@ def is_path_within(base_dir, candidate_path):
     except Exception:
         return False
 
+
+def make_library_root_alias(path, existing):
+    base = re.sub(r'[^A-Za-z0-9_-]+', '-', os.path.basename(os.path.normpath(path))).strip('-') or 'root'
+    alias = base
+    suffix = 2
+    while alias in existing:
+        alias = f"{base}-{suffix}"
+        suffix += 1
+    return alias
+
+
+def get_reserved_library_aliases(base_dir):
+    """Aliases that would shadow a top-level "@name" folder of the primary root (e.g. Synology's @eaDir)."""
+    reserved = set()
+    if not base_dir:
+        return reserved
+    try:
+        with os.scandir(base_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith(LIBRARY_ROOT_PREFIX) and entry.is_dir():
+                    reserved.add(entry.name[len(LIBRARY_ROOT_PREFIX):])
+    except OSError:
+        pass
+    return reserved
+
+
+def get_library_roots():
+    """Return [(alias, path)] for every served root; the primary base folder has alias ''."""
+    roots = []
+    base_dir = get_active_base_dir()
+    if base_dir:
+        roots.append(('', base_dir))
+    with LIBRARY_LOCK:
+        roots.extend(sorted(EXTRA_LIBRARY_ROOTS.items()))
+    return roots
+
+
+def save_library_roots():
+    cfg = load_runtime_config()
+    with LIBRARY_LOCK:
+        cfg['library_roots'] = [{'alias': alias, 'path': path} for alias, path in sorted(EXTRA_LIBRARY_ROOTS.items())]
+    save_runtime_config(cfg)
+
+
+def add_library_root(path, alias=None, persist=True):
+    normalized = os.path.abspath(path)
+    if not os.path.isdir(normalized):
+        raise ValueError(f"Selected folder does not exist: {normalized}")
+    base_dir = get_active_base_dir()
+    reserved = get_reserved_library_aliases(base_dir)
+    with LIBRARY_LOCK:
+        known_paths = {os.path.normcase(p) for p in EXTRA_LIBRARY_ROOTS.values()}
+        if base_dir:
+            known_paths.add(os.path.normcase(base_dir))
+        if os.path.normcase(normalized) in known_paths:
+            raise ValueError(f"Folder is already a library root: {normalized}")
+        if alias:
+            alias = re.sub(r'[^A-Za-z0-9_-]+', '-', alias).strip('-')
+            if alias in reserved:
+                raise ValueError(f"Alias {LIBRARY_ROOT_PREFIX}{alias} is already a folder in the base folder")
+        if not alias or alias in EXTRA_LIBRARY_ROOTS:
+            alias = make_library_root_alias(normalized, reserved.union(EXTRA_LIBRARY_ROOTS))
+        EXTRA_LIBRARY_ROOTS[alias] = normalized
+    if persist:
+        save_library_roots()
+    scan_library_shard(alias, normalized)
+    return alias
+
+
+def remove_library_root(alias, persist=True):
+    with LIBRARY_LOCK:
+        removed = EXTRA_LIBRARY_ROOTS.pop(alias, None)
+        LIBRARY_SHARDS.pop(alias, None)
+    if removed and persist:
+        save_library_roots()
+    return removed
+
+
+def restore_library_roots():
+    with LIBRARY_LOCK:
+        EXTRA_LIBRARY_ROOTS.clear()
+        LIBRARY_SHARDS.clear()
+    reserved = get_reserved_library_aliases(get_active_base_dir())
+    for entry in load_runtime_config().get('library_roots', []):
+        if not isinstance(entry, dict) or not entry.get('path'):
+            continue
+        if not os.path.isdir(entry['path']):
+            print(f"{format_timestamp()} WARNING: Library root not found, skipping: {entry['path']}", file=sys.stderr)
+            continue
+        with LIBRARY_LOCK:
+            alias = entry.get('alias')
+            if not alias or alias in EXTRA_LIBRARY_ROOTS or alias in reserved:
+                alias = make_library_root_alias(entry['path'], reserved.union(EXTRA_LIBRARY_ROOTS))
+            EXTRA_LIBRARY_ROOTS[alias] = os.path.abspath(entry['path'])
+
+
+def split_library_path(library_path):
+    """Split a listing path into (alias, root_dir, path relative to that root).
+
+    "@x/..." names an extra root only when x is a registered alias; any other path, including
+    one under a primary-root folder that happens to start with "@", belongs to the primary root.
+    """
+    relative_path = (library_path or '').replace('\\', '/').lstrip('/')
+    if relative_path.startswith(LIBRARY_ROOT_PREFIX):
+        alias, _, alias_path = relative_path[len(LIBRARY_ROOT_PREFIX):].partition('/')
+        with LIBRARY_LOCK:
+            root_dir = EXTRA_LIBRARY_ROOTS.get(alias)
+        if root_dir:
+            return alias, root_dir, alias_path
+    return '', get_active_base_dir() or APP_DIR, relative_path
+
+
+def resolve_library_path(relative_path):
+    """Resolve a listing path (optionally "@alias/...") to (root_dir, absolute_path).
+
+    absolute_path is None when the path escapes its root or the alias is unknown.
+    """
+    _, root_dir, relative_path = split_library_path(relative_path)
+    if not root_dir:
+        return None, None
+    candidate = os.path.normpath(os.path.join(root_dir, relative_path.replace('/', os.sep)))
+    if not is_path_within(root_dir, candidate):
+        return root_dir, None
+    return root_dir, candidate
+
+
+# In-process metrics (exposed at /metrics in Prometheus text format)
+METRICS_LOCK = threading.Lock()
+METRICS_STARTED_AT = time.time()
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+REQUEST_COUNTS = {}
+REQUEST_LATENCY = {}
+RESPONSE_BYTES = {}
+CACHE_COUNTS = {}
+SCAN_METRICS = {
+    'count': 0,
+    'duration_sum': 0.0,
+    'files_sum': 0,
+    'last_duration': 0.0,
+    'last_files': 0,
+}
+ACTIVE_CONNECTIONS = 0
+API_ROUTE_LABELS = {
+    '/app-config',
+    '/app-config.js',
+    '/rescan-images',
+    '/current-base-folder',
+    '/metrics',
+    '/log-action',
+    '/log-actions',
+    '/move-file',
+    '/delete-file',
+    '/image-state',
+    '/image-state/sync',
+    '/select-base-folder',
+    '/update-embedded-list',
+    '/library-roots',
+    '/library-listing',
+    '/add-library-root',
+    '/remove-library-root',
+    '/metadata-lookup',
+    '/thumbnail',
+    '/tiles-info',
+    '/tile',
+    '/export',
+    '/session',
+    '/download.zip',
+    '/query',
+    '/folders',
+    '/corrupt-files',
+    '/debug/profile',
+}
+
+
+def metrics_route_label(path):
+    """Map a request path to a low-cardinality route label."""
+    request_path = unquote(urlparse(path or '/').path or '/')
+    if request_path in ('/', '/ddr.html', '/darkroom.html'):
+        return '/ddr.html'
+    if request_path in API_ROUTE_LABELS:
+        return request_path
+    ext = os.path.splitext(request_path)[1].lower()
+    if ext in METRICS_IMAGE_EXTS:
+        return 'static:image'
+    return 'static:other'
+
+
+def record_request_metrics(method, route, status, duration, sent_bytes):
+    bucket_index = len(LATENCY_BUCKETS)
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if duration <= bound:
+            bucket_index = index
+            break
+    with METRICS_LOCK:
+        count_key = (route, method, status)
+        REQUEST_COUNTS[count_key] = REQUEST_COUNTS.get(count_key, 0) + 1
+        latency = REQUEST_LATENCY.get(route)
+        if latency is None:
+            latency = REQUEST_LATENCY[route] = {
+                'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                'sum': 0.0,
+                'count': 0,
+            }
+        latency['buckets'][bucket_index] += 1
+        latency['sum'] += duration
+        latency['count'] += 1
+        RESPONSE_BYTES[route] = RESPONSE_BYTES.get(route, 0) + sent_bytes
+
+
+def record_cache_lookup(cache_name, hit):
+    with METRICS_LOCK:
+        counts = CACHE_COUNTS.get(cache_name)
+        if counts is None:
+            counts = CACHE_COUNTS[cache_name] = [0, 0]
+        counts[0 if hit else 1] += 1
+
+
+def record_scan_metrics(duration, file_count):
+    with METRICS_LOCK:
+        SCAN_METRICS['count'] += 1
+        SCAN_METRICS['duration_sum'] += duration
+        SCAN_METRICS['files_sum'] += file_count
+        SCAN_METRICS['last_duration'] = duration
+        SCAN_METRICS['last_files'] = file_count
+
+
+# Request priority gate: connections get their own thread, but at most
+# server.maxConcurrentRequests handlers run at once. The client's scheduler sends an
+# X-DDR-Priority hint and waiting requests are admitted highest class first, so visible
+# work overtakes background indexing. Unhinted requests (the page itself, images the
+# browser loads for <img> tags) count as visible.
+REQUEST_PRIORITIES = ('visible', 'neighbor', 'page', 'background')
+REQUEST_GATE = threading.Condition()
+REQUEST_GATE_STATE = {'active': 0, 'waiting': [0] * len(REQUEST_PRIORITIES)}
+
+
+def get_request_priority(headers):
+    hint = (headers.get('X-DDR-Priority') or '').strip().lower() if headers is not None else ''
+    return REQUEST_PRIORITIES.index(hint) if hint in REQUEST_PRIORITIES else 0
+
+
+def acquire_request_slot(priority):
+    limit = max(1, int((get_app_config().get('server', {}) or {}).get('maxConcurrentRequests', 8)))
+    waiting = REQUEST_GATE_STATE['waiting']
+    with REQUEST_GATE:
+        waiting[priority] += 1
+        try:
+            while REQUEST_GATE_STATE['active'] >= limit or any(waiting[:priority]):
+                REQUEST_GATE.wait()
+        finally:
+            waiting[priority] -= 1
+        REQUEST_GATE_STATE['active'] += 1
+
+
+def release_request_slot():
+    with REQUEST_GATE:
+        REQUEST_GATE_STATE['active'] -= 1
+        REQUEST_GATE.notify_all()
+
+
+# Multi-client serving: several browsers on the LAN share one server process, so they share
+# its in-memory listing, metadata index and caches. Each browser gets a ddr_client cookie
+# keying its saved view (page, filters, sort). With server.multiClient on, only loopback
+# clients, server.editorAddresses and holders of server.editorToken may change files;
+# everyone else browses read-only. With it off every client is an editor, as before.
+CLIENT_SESSION_COOKIE = 'ddr_client'
+CLIENT_SESSION_LIMIT = 256
+CLIENT_VIEW_MAX_BYTES = 16384
+CLIENT_SESSIONS = {}
+CLIENT_SESSIONS_LOCK = threading.Lock()
+EDITOR_ONLY_ROUTES = frozenset({
+    '/move-file',
+    '/delete-file',
+    '/image-state',
+    '/image-state/sync',
+    '/select-base-folder',
+    '/add-library-root',
+    '/remove-library-root',
+    '/update-embedded-list',
+})
+
+
+def get_server_settings():
+    server_config = get_app_config().get('server', {}) or {}
+    editor_addresses = server_config.get('editorAddresses') or []
+    return {
+        'bind': str(server_config.get('bind') or ''),
+        'multiClient': bool(server_config.get('multiClient', False)),
+        'editorAddresses': [str(address) for address in editor_addresses] if isinstance(editor_addresses, list) else [],
+        'editorToken': str(server_config.get('editorToken') or ''),
+        'startupScan': bool(server_config.get('startupScan', True)),
+    }
+
+
+def is_loopback_address(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    if getattr(ip, 'ipv4_mapped', None):
+        ip = ip.ipv4_mapped
+    return ip.is_loopback
+
+
+def is_editor_token(token):
+    expected = get_server_settings()['editorToken']
+    return bool(expected and token) and hmac.compare_digest(str(token), expected)
+
+
+def touch_client_session(client_id, address):
+    """Return (session, created) for a cookie value, starting a new session when it is unknown."""
+    now = time.time()
+    with CLIENT_SESSIONS_LOCK:
+        session = CLIENT_SESSIONS.pop(client_id, None) if client_id else None
+        created = session is None
+        if created:
+            client_id = secrets.token_urlsafe(12)
+            session = {'id': client_id, 'role': None, 'view': None, 'firstSeen': now}
+            while len(CLIENT_SESSIONS) >= CLIENT_SESSION_LIMIT:
+                CLIENT_SESSIONS.pop(next(iter(CLIENT_SESSIONS)))
+        session['address'] = address
+        session['lastSeen'] = now
+        # Most recently seen last, so the oldest session is evicted first
+        CLIENT_SESSIONS[client_id] = session
+        return session, created
+
+
+def get_client_session(client_id):
+    with CLIENT_SESSIONS_LOCK:
+        return CLIENT_SESSIONS.get(client_id) if client_id else None
+
+
+def get_client_role(address, session=None):
+    settings = get_server_settings()
+    if not settings['multiClient']:
+        return 'editor'
+    if is_loopback_address(address) or address in settings['editorAddresses']:
+        return 'editor'
+    if session and session.get('role') == 'editor':
+        return 'editor'
+    return 'viewer'
+
+
+def get_lan_address():
+    """Best guess at this machine's LAN address (no packets are sent)."""
+    import socket
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(('10.255.255.255', 1))
+            return probe.getsockname()[0]
+    except OSError:
+        return None
+
+
+def adjust_active_connections(delta):
+    global ACTIVE_CONNECTIONS
+    with METRICS_LOCK:
+        ACTIVE_CONNECTIONS += delta
+
+
+def render_metrics():
+    with METRICS_LOCK:
+        request_counts = dict(REQUEST_COUNTS)
+        request_latency = {
+            route: {'buckets': list(data['buckets']), 'sum': data['sum'], 'count': data['count']}
+            for route, data in REQUEST_LATENCY.items()
+        }
+        response_bytes = dict(RESPONSE_BYTES)
+        cache_counts = {name: list(counts) for name, counts in CACHE_COUNTS.items()}
+        scan = dict(SCAN_METRICS)
+        active_connections = ACTIVE_CONNECTIONS
+    with REQUEST_GATE:
+        gate_waiting = list(REQUEST_GATE_STATE['waiting'])
+    with CLIENT_SESSIONS_LOCK:
+        client_sessions = len(CLIENT_SESSIONS)
+    with METRICS_LOCK:
+        hot_functions = {name: list(totals) for name, totals in HOT_FUNCTION_TIMES.items()}
+
+    lines = [
+        '# HELP ddr_uptime_seconds Seconds since the server process started.',
+        '# TYPE ddr_uptime_seconds gauge',
+        f'ddr_uptime_seconds {time.time() - METRICS_STARTED_AT:.3f}',
+        '# HELP ddr_http_active_connections Connections currently being handled.',
+        '# TYPE ddr_http_active_connections gauge',
+        f'ddr_http_active_connections {active_connections}',
+        '# HELP ddr_client_sessions Browser sessions seen by this server (bounded).',
+        '# TYPE ddr_client_sessions gauge',
+        f'ddr_client_sessions {client_sessions}',
+        '# HELP ddr_action_log_queue_depth Client action log lines waiting to be written.',
+        '# TYPE ddr_action_log_queue_depth gauge',
+        f'ddr_action_log_queue_depth {ACTION_LOG_QUEUE.qsize()}',
+        '# HELP ddr_action_log_dropped_total Client action log lines dropped because the queue was full.',
+        '# TYPE ddr_action_log_dropped_total counter',
+        f'ddr_action_log_dropped_total {ACTION_LOG_DROPPED}',
+        '# HELP ddr_http_requests_total HTTP requests handled, by route, method and status.',
+        '# TYPE ddr_http_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(request_counts.items()):
+        lines.append(f'ddr_http_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+
+    lines.append('# HELP ddr_http_request_duration_seconds Request latency by route.')
+    lines.append('# TYPE ddr_http_request_duration_seconds histogram')
+    for route, data in sorted(request_latency.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, data['buckets']):
+            cumulative += bucket_count
+            lines.append(f'ddr_http_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+        lines.append(f'ddr_http_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {data["count"]}')
+        lines.append(f'ddr_http_request_duration_seconds_sum{{route="{route}"}} {data["sum"]:.6f}')
+        lines.append(f'ddr_http_request_duration_seconds_count{{route="{route}"}} {data["count"]}')
+
+    lines.append('# HELP ddr_http_response_bytes_total Bytes written to clients, by route.')
+    lines.append('# TYPE ddr_http_response_bytes_total counter')
+    for route, sent_bytes in sorted(response_bytes.items()):
+        lines.append(f'ddr_http_response_bytes_total{{route="{route}"}} {sent_bytes}')
+
+    lines.append('# HELP ddr_cache_requests_total Cache lookups, by cache and result.')
+    lines.append('# TYPE ddr_cache_requests_total counter')
+    for name, (hits, misses) in sorted(cache_counts.items()):
+        lines.append(f'ddr_cache_requests_total{{cache="{name}",result="hit"}} {hits}')
+        lines.append(f'ddr_cache_requests_total{{cache="{name}",result="miss"}} {misses}')
+    lines.append('# HELP ddr_cache_hit_ratio Fraction of cache lookups that were hits.')
+    lines.append('# TYPE ddr_cache_hit_ratio gauge')
+    for name, (hits, misses) in sorted(cache_counts.items()):
+        total = hits + misses
+        lines.append(f'ddr_cache_hit_ratio{{cache="{name}"}} {(hits / total) if total else 0:.4f}')
+
+    lines.append('# HELP ddr_http_requests_waiting Requests waiting for a handler slot, by priority class.')
+    lines.append('# TYPE ddr_http_requests_waiting gauge')
+    for priority, count in zip(REQUEST_PRIORITIES, gate_waiting):
+        lines.append(f'ddr_http_requests_waiting{{priority="{priority}"}} {count}')
+
+    if hot_functions:
+        lines.append('# HELP ddr_hot_function_calls_total Calls of timed hot functions (debugMode only).')
+        lines.append('# TYPE ddr_hot_function_calls_total counter')
+        for name, (calls, _) in sorted(hot_functions.items()):
+            lines.append(f'ddr_hot_function_calls_total{{function="{name}"}} {calls}')
+        lines.append('# HELP ddr_hot_function_seconds_total Time spent in timed hot functions (debugMode only).')
+        lines.append('# TYPE ddr_hot_function_seconds_total counter')
+        for name, (_, seconds) in sorted(hot_functions.items()):
+            lines.append(f'ddr_hot_function_seconds_total{{function="{name}"}} {seconds:.6f}')
+
+    lines.append('# HELP ddr_startup_phase_seconds Seconds from process start until each startup phase finished.')
+    lines.append('# TYPE ddr_startup_phase_seconds gauge')
+    for phase, seconds in list(STARTUP_PROFILE):
+        lines.append(f'ddr_startup_phase_seconds{{phase="{phase}"}} {seconds:.6f}')
+
+    last_rate = (scan['last_files'] / scan['last_duration']) if scan['last_duration'] > 0 else 0
+    lines.extend([
+        '# HELP ddr_scan_total Image folder scans completed.',
+        '# TYPE ddr_scan_total counter',
+        f'ddr_scan_total {scan["count"]}',
+        '# HELP ddr_scan_duration_seconds_total Total time spent scanning image folders.',
+        '# TYPE ddr_scan_duration_seconds_total counter',
+        f'ddr_scan_duration_seconds_total {scan["duration_sum"]:.6f}',
+        '# HELP ddr_scan_files_total Image files found across all scans.',
+        '# TYPE ddr_scan_files_total counter',
+        f'ddr_scan_files_total {scan["files_sum"]}',
+        '# HELP ddr_scan_last_duration_seconds Duration of the most recent scan.',
+        '# TYPE ddr_scan_last_duration_seconds gauge',
+        f'ddr_scan_last_duration_seconds {scan["last_duration"]:.6f}',
+        '# HELP ddr_scan_last_files Image files found by the most recent scan.',
+        '# TYPE ddr_scan_last_files gauge',
+        f'ddr_scan_last_files {scan["last_files"]}',
+        '# HELP ddr_scan_last_files_per_second Throughput of the most recent scan.',
+        '# TYPE ddr_scan_last_files_per_second gauge',
+        f'ddr_scan_last_files_per_second {last_rate:.2f}',
+    ])
+    return '\n'.join(lines) + '\n'
+
+
+class CountingWriter:
+    """Wraps the handler's wfile so bytes sent per request can be counted."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_written = 0
+
+    def write(self, data):
+        written = self.raw.write(data)
+        self.bytes_written += len(data)
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+# Hot-function timing (debugMode): a few functions are wrapped so each request collects the
+# time spent in them; the totals go out as a Server-Timing header, in the slow-request log
+# line and in /metrics. With timing off the wrapper costs one global check per call.
+HOT_TIMING_ENABLED = False
+HOT_FUNCTION_TIMES = {}
+REQUEST_TIMINGS = threading.local()
+
+
+def record_hot_timing(name, seconds):
+    with METRICS_LOCK:
+        totals = HOT_FUNCTION_TIMES.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+    timings = getattr(REQUEST_TIMINGS, 'timings', None)
+    if timings is not None:
+        totals = timings.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+def time_hot_function(name, function):
+    """Wrap a function so its duration is recorded under name while hot timing is on."""
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        if not HOT_TIMING_ENABLED:
+            return function(*args, **kwargs)
+        started_at = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record_hot_timing(name, time.perf_counter() - started_at)
+    return timed
+
+
+def format_server_timing(timings):
+    return ', '.join(f"{name};dur={seconds * 1000:.2f};desc=\"{calls}x\"" for name, (calls, seconds) in timings.items())
+
+
+# On-demand sampling profiler (/debug/profile, debugMode only): every interval the stacks
+# of all other threads are read with sys._current_frames() and counted, so nothing is
+# instrumented and the server runs at full speed between samples. Threads parked in a
+# wait (idle handler threads, the accept loop) are left out unless idle=1.
+PROFILE_MAX_SECONDS = 60
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_IDLE_FUNCTIONS = frozenset({
+    'select', 'poll', 'wait', 'accept', 'readinto', 'recv_into', 'sleep', 'get', '_wait_for_tstate_lock',
+})
+PROFILE_LOCK = threading.Lock()
+
+
+def sample_thread_stacks(seconds, interval=PROFILE_INTERVAL, include_idle=False):
+    """({(thread name, frames root first): samples}, sampling rounds) over all threads but the caller."""
+    own_ident = threading.get_ident()
+    stacks = {}
+    rounds = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        # Handler threads are numbered; merge them by dropping the number
+        names = {thread.ident: re.sub(r'-\d+', '', thread.name) for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            if not include_idle and frame.f_code.co_name in PROFILE_IDLE_FUNCTIONS:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            key = (names.get(ident, str(ident)), tuple(reversed(frames)))
+            stacks[key] = stacks.get(key, 0) + 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def format_collapsed_stacks(stacks):
+    """Folded stacks ("thread;outer;inner count"), the input format of flamegraph tools."""
+    lines = [f"{';'.join((thread,) + frames)} {count}"
+             for (thread, frames), count in sorted(stacks.items(), key=lambda item: -item[1])]
+    return '\n'.join(lines) + '\n'
+
+
+def format_profile_stats(stacks, rounds, seconds, interval):
+    """pstats-like table of sampled functions: own samples (leaf) and cumulative samples."""
+    own = {}
+    cumulative = {}
+    total = sum(stacks.values())
+    for (_, frames), count in stacks.items():
+        if frames:
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+        for function in set(frames):
+            cumulative[function] = cumulative.get(function, 0) + count
+    lines = [
+        f"{total} samples in {rounds} rounds over {seconds:g}s (every {interval * 1000:g} ms)",
+        '',
+        f"{'ownsamples':>10}  {'own%':>6}  {'cumsamples':>10}  {'cum%':>6}  function",
+    ]
+    for function, count in sorted(cumulative.items(), key=lambda item: (-item[1], item[0]))[:PROFILE_TOP_FUNCTIONS]:
+        own_count = own.get(function, 0)
+        lines.append(
+            f"{own_count:>10}  {own_count * 100 / max(total, 1):>5.1f}%  "
+            f"{count:>10}  {count * 100 / max(total, 1):>5.1f}%  {function}"
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def run_profile(seconds, report_format='collapsed', include_idle=False):
+    """Text report of a sampling run, or None while another run is in progress."""
+    seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+    if not PROFILE_LOCK.acquire(blocking=False):
+        return None
+    try:
+        stacks, rounds = sample_thread_stacks(seconds, include_idle=include_idle)
+    finally:
+        PROFILE_LOCK.release()
+    print(f"{format_timestamp()}DARKROOM: Profiled {seconds:g}s: {sum(stacks.values())} samples", file=sys.stderr)
+    if report_format == 'stats':
+        return format_profile_stats(stacks, rounds, seconds, PROFILE_INTERVAL)
+    return format_collapsed_stacks(stacks)
+
+
+# Static route table: app assets (files next to ddr.html, in the app folder and in a frozen
+# build's bundle) are listed once into a URL -> file map, so a request costs one dict lookup
+# instead of an exists() probe per asset folder. Earlier folders win, as the old probe order did.
+STATIC_ROUTES = None
+STATIC_ROUTES_LOCK = threading.Lock()
+# Config files sit next to the app assets but hold settings and secrets; /app-config serves
+# the client-safe part
+STATIC_ROUTE_EXCLUDED_NAMES = {'config.json', os.path.basename(RUNTIME_CONFIG_PATH)}
+
+
+def get_static_asset_dirs():
+    asset_dirs = [
+        get_web_asset_dir(),
+        APP_DIR,
+        os.path.join(APP_DIR, 'app-web'),
+        os.path.join(APP_DIR, 'web-app'),
+    ]
+    meipass = getattr(sys, '_MEIPASS', None)
+    if meipass:
+        asset_dirs.extend([
+            meipass,
+            os.path.join(meipass, 'app-web'),
+            os.path.join(meipass, 'web-app'),
+        ])
+    return asset_dirs
+
+
+def build_static_routes():
+    routes = {}
+    for asset_dir in get_static_asset_dirs():
+        try:
+            entries = list(os.scandir(asset_dir))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.name.lower() not in STATIC_ROUTE_EXCLUDED_NAMES:
+                    routes.setdefault('/' + entry.name, os.path.normpath(entry.path))
+            except OSError:
+                continue
+    return routes
+
+
+def get_static_routes():
+    global STATIC_ROUTES
+    if STATIC_ROUTES is None:
+        with STATIC_ROUTES_LOCK:
+            if STATIC_ROUTES is None:
+                STATIC_ROUTES = build_static_routes()
+    return STATIC_ROUTES
+
+
+def get_shard_dir_rows(shard):
+    """({rel_dir: dir id}, row starts, rows grouped by dir id) for a shard's columnar listing.
+
+    Built once per shard outside the library lock, like its folder totals; a rescan stores a
+    new shard. The rows are a counting sort of the dir column, so no per-file path strings.
+    """
+    with LIBRARY_LOCK:
+        dir_rows = shard.get('dirRows')
+    if dir_rows is not None:
+        return dir_rows
+    listing = shard['listing']
+    dir_ids = {rel_dir: dir_id for dir_id, rel_dir in enumerate(listing['dirs'])}
+    starts = [0] * (len(listing['dirs']) + 1)
+    for dir_id in listing['dir']:
+        starts[dir_id + 1] += 1
+    for dir_id in range(len(listing['dirs'])):
+        starts[dir_id + 1] += starts[dir_id]
+    next_slot = starts[:-1]
+    rows = array('I', bytes(4 * len(listing['dir'])))
+    for row, dir_id in enumerate(listing['dir']):
+        rows[next_slot[dir_id]] = row
+        next_slot[dir_id] += 1
+    dir_rows = (dir_ids, array('I', starts), rows)
+    with LIBRARY_LOCK:
+        shard['dirRows'] = dir_rows
+        shard['dirNames'] = {}
+    return dir_rows
+
+
+def is_indexed_library_path(alias, relative_path):
+    """Whether the root's scan listing has this file; None until the root has been scanned."""
+    with LIBRARY_LOCK:
+        shard = LIBRARY_SHARDS.get(alias)
+    if not shard:
+        return None
+    dir_ids, starts, rows = get_shard_dir_rows(shard)
+    rel_dir, _, name = relative_path.rpartition('/')
+    dir_id = dir_ids.get(rel_dir)
+    if dir_id is None:
+        return False
+    with LIBRARY_LOCK:
+        names = shard['dirNames'].get(dir_id)
+    if names is None:
+        # One folder's names, built when an image in it is first requested
+        listing_names = shard['listing']['name']
+        names = frozenset(listing_names[row] for row in rows[starts[dir_id]:starts[dir_id + 1]])
+        with LIBRARY_LOCK:
+            shard['dirNames'][dir_id] = names
+    return name in names
+
+
+def resolve_request_path(request_path):
+    """Map a URL path to a file: the page, a static asset, or a library image (no filesystem calls)."""
+    if request_path in ('/', '/ddr.html', '/darkroom.html'):
+        return get_web_template_path()
+
+    if not request_path.startswith('/' + LIBRARY_ROOT_PREFIX):
+        asset_path = get_static_routes().get(request_path)
+        if asset_path:
+            return asset_path
+
+    alias, root_dir, relative_path = split_library_path(request_path)
+    if not root_dir:
+        return os.path.join(APP_DIR, '__invalid_path__')
+    candidate = os.path.normpath(os.path.join(root_dir, relative_path.replace('/', os.sep)))
+    # Files in the scan index are known to be inside their root; anything else (moved or
+    # new since the scan) gets the containment check and is left to the open() to find.
+    if not is_indexed_library_path(alias, relative_path) and not is_path_within(root_dir, candidate):
+        return os.path.join(root_dir, '__invalid_path__')
+    return candidate
+
+
+resolve_request_path = time_hot_function('translate_path', resolve_request_path)
+
+
+def encode_json_body(payload):
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+encode_json_body = time_hot_function('json', encode_json_body)
+
+
 # Custom handler to support file moving and image rescanning
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def translate_path(self, path):
-        parsed = urlparse(path)
-        request_path = unquote(parsed.path or '/')
-
-        if request_path in ('/', '/ddr.html', '/darkroom.html'):
-            return WEB_TEMPLATE_PATH
-
-        relative_path = request_path.lstrip('/').replace('/', os.sep)
-
-        # Serve static app assets from app folder if present.
-        asset_candidates = [
-            os.path.join(WEB_ASSET_DIR, relative_path),
-            os.path.join(APP_DIR, relative_path),
-            os.path.join(APP_DIR, 'app-web', relative_path),
-            os.path.join(APP_DIR, 'web-app', relative_path),
-        ]
-        meipass = getattr(sys, '_MEIPASS', None)
-        if meipass:
-            asset_candidates.extend([
-                os.path.join(meipass, relative_path),
-                os.path.join(meipass, 'app-web', relative_path),
-                os.path.join(meipass, 'web-app', relative_path),
-            ])
-        for candidate in asset_candidates:
-            if os.path.exists(candidate):
-                return os.path.normpath(candidate)
-
-        base_dir = get_active_base_dir() or APP_DIR
-        candidate = os.path.normpath(os.path.join(base_dir, relative_path))
-        if not is_path_within(base_dir, candidate):
-            return os.path.join(base_dir, '__invalid_path__')
-        return candidate
+        return resolve_request_path(unquote(urlparse(path).path or '/'))
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def handle(self):
+        adjust_active_connections(1)
+        try:
+            super().handle()
+        finally:
+            adjust_active_connections(-1)
+
+    def send_response(self, code, message=None):
+        self._metrics_status = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        timings = getattr(REQUEST_TIMINGS, 'timings', None)
+        if timings:
+            self.send_header('Server-Timing', format_server_timing(timings))
+        super().end_headers()
+
+    def end_json_response(self, payload):
+        """Finish headers and write a JSON body, gzipped when the client accepts it and it is large."""
+        body = encode_json_body(payload)
+        accept_encoding = (self.headers.get('Accept-Encoding') or '') if self.headers is not None else ''
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in accept_encoding:
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def record_request(self, started_at, bytes_before):
+        if not self.command:
+            return
+        duration = time.perf_counter() - started_at
+        route = metrics_route_label(self.path)
+        status = getattr(self, '_metrics_status', None) or 0
+        sent_bytes = self.wfile.bytes_written - bytes_before
+        record_request_metrics(self.command, route, status, duration, sent_bytes)
+        if route == 'static:image' and self.headers is not None and self.headers.get('If-Modified-Since'):
+            record_cache_lookup('http-conditional', status == 304)
+
+        app_config = get_app_config()
+        if app_config.get('web', {}).get('debugMode'):
+            threshold_ms = (app_config.get('server', {}) or {}).get('slowRequestMs', 500)
+            if duration * 1000 >= threshold_ms:
+                timings = getattr(REQUEST_TIMINGS, 'timings', None)
+                breakdown = ', '.join(f"{name} {seconds * 1000:.1f} ms" for name, (_, seconds) in timings.items()) if timings else ''
+                print(
+                    f"{format_timestamp()}DARKROOM: Slow request: {self.command} {self.path} -> {status} "
+                    f"in {duration * 1000:.1f} ms ({sent_bytes} bytes)" + (f" [{breakdown}]" if breakdown else ''),
+                    file=sys.stderr,
+                )
+
+    def get_request_client_id(self):
+        cookies = http.cookies.SimpleCookie()
+        try:
+            cookies.load(self.headers.get('Cookie') or '')
+        except http.cookies.CookieError:
+            return None
+        morsel = cookies.get(CLIENT_SESSION_COOKIE)
+        return morsel.value if morsel else None
+
+    def get_request_role(self):
+        return get_client_role(self.client_address[0], get_client_session(self.get_request_client_id()))
+
+    def send_client_session(self, token=''):
+        """Open (or reuse) this browser's session and send it; a valid editor token upgrades it."""
+        address = self.client_address[0]
+        session, created = touch_client_session(self.get_request_client_id(), address)
+        if token:
+            if is_editor_token(token):
+                session['role'] = 'editor'
+            else:
+                print(f"{format_timestamp()} WARNING: Rejected editor token from {address}", file=sys.stderr)
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        if created:
+            self.send_header(
+                'Set-Cookie',
+                f"{CLIENT_SESSION_COOKIE}={session['id']}; Path=/; Max-Age=31536000; SameSite=Lax; HttpOnly",
+            )
+        self.end_json_response({
+            'multiClient': get_server_settings()['multiClient'],
+            'role': get_client_role(address, session),
+            'clientId': session['id'],
+            'view': session['view'],
+        })
+
+    def leave_request_gate(self):
+        """Hand the priority-gate slot back before a long transfer so it does not hold up other requests."""
+        if self._holds_request_slot:
+            self._holds_request_slot = False
+            release_request_slot()
+
+    def begin_chunked_response(self, content_type, extra_headers=None):
+        """Send a 200 with chunked, uncached headers; the body then goes through a ChunkedResponseWriter.
+
+        Chunked transfer encoding needs HTTP/1.1; close afterwards like every other (HTTP/1.0)
+        response, so the handler thread does not sit on an idle keep-alive connection once the
+        priority-gate slot is released.
+        """
+        self.protocol_version = 'HTTP/1.1'
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def copyfile(self, source, outputfile):
+        """Static file body: send_head has opened the file and sent the headers by now, and a
+        large PNG to a slow client can take seconds, so the slot goes back before the copy."""
+        self.leave_request_gate()
+        super().copyfile(source, outputfile)
+
+    def send_download_zip(self, library_paths, name=None):
+        files = []
+        for library_path in library_paths:
+            if not isinstance(library_path, str):
+                continue
+            _, file_abs = resolve_library_path(library_path)
+            if file_abs:
+                files.append((library_path, file_abs))
+        if not files:
+            self.send_response(404)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': 'No files to download'}).encode())
+            return
+
+        self.leave_request_gate()
+        filename = get_download_zip_name(name)
+        started = time.perf_counter()
+        try:
+            self.begin_chunked_response('application/zip', {'Content-Disposition': f'attachment; filename="{filename}"'})
+            writer = ChunkedResponseWriter(self.wfile, chunk_size=DOWNLOAD_ZIP_COPY_BYTES)
+            entries, total_bytes = write_download_zip(writer, files)
+            writer.close()
+            elapsed = time.perf_counter() - started
+            print(
+                f"{format_timestamp()}DARKROOM: ZIP download {filename}: {entries} files, "
+                f"{total_bytes / (1024 * 1024):.1f} MB in {elapsed:.1f}s "
+                f"({total_bytes / (1024 * 1024) / max(elapsed, 1e-6):.0f} MB/s)",
+                file=sys.stderr,
+            )
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+            print(f"{format_timestamp()}DARKROOM: ZIP download {filename} cancelled by client", file=sys.stderr)
+        except Exception as e:
+            # Headers are already sent; the truncated chunk stream tells the client it failed.
+            print(f"{format_timestamp()} ERROR: ZIP download failed: {type(e).__name__} - {str(e)}", file=sys.stderr)
+
+    def can_open_server_dialog(self):
+        """Folder pickers open on the server's screen, so remote clients must name the folder."""
+        return not get_server_settings()['multiClient'] or is_loopback_address(self.client_address[0])
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        # Headers are in: wait for a slot in this request's priority class
+        acquire_request_slot(get_request_priority(self.headers))
+        self._holds_request_slot = True
+        return True
 
     def handle_one_request(self):
         """Override to gracefully handle connection errors"""
+        started_at = time.perf_counter()
+        bytes_before = self.wfile.bytes_written
+        self.command = None
+        self._metrics_status = None
+        self._holds_request_slot = False
+        REQUEST_TIMINGS.timings = {} if HOT_TIMING_ENABLED else None
         try:
             super().handle_one_request()
         except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError) as e:
@@ -354,6 +1476,12 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             print(f"{format_timestamp()} ERROR: Unexpected error in request handler: {type(e).__name__} - {str(e)}", file=sys.stderr)
             import traceback
             traceback.print_exc(file=sys.stderr)
+        finally:
+            if self._holds_request_slot:
+                self._holds_request_slot = False
+                release_request_slot()
+            self.record_request(started_at, bytes_before)
+            REQUEST_TIMINGS.timings = None
     
     def do_GET(self):
         # Parse path to handle query strings
@@ -369,14 +1497,14 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_header('Pragma', 'no-cache')
                 self.send_header('Expires', '0')
                 self.end_headers()
-                self.wfile.write(json.dumps(APP_CONFIG).encode('utf-8'))
+                self.wfile.write(json.dumps(get_client_app_config()).encode('utf-8'))
             except Exception as e:
                 print(f"{format_timestamp()} ERROR: Failed to serve app config JSON: {e}", file=sys.stderr)
                 self.send_response(500)
                 self.end_headers()
         elif path_without_query == '/app-config.js':
             try:
-                payload = "window.__DDR_APP_CONFIG__ = " + json.dumps(APP_CONFIG, ensure_ascii=False) + ";"
+                payload = "window.__DDR_APP_CONFIG__ = " + json.dumps(get_client_app_config(), ensure_ascii=False) + ";"
                 self.send_response(200)
                 self.send_header('Content-type', 'application/javascript; charset=utf-8')
                 self.send_header('Access-Control-Allow-Origin', '*')
@@ -389,25 +1517,52 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 print(f"{format_timestamp()} ERROR: Failed to serve app config script: {e}", file=sys.stderr)
                 self.send_response(500)
                 self.end_headers()
+        elif path_without_query == '/rescan-images' and (parse_qs(parsed_path.query).get('stream') or [''])[0] == '1':
+            # NDJSON: compact listing fragments as the walk progresses, then a summary line.
+            count = 0
+            try:
+                self.begin_chunked_response('application/x-ndjson; charset=utf-8', {'Access-Control-Allow-Origin': '*'})
+                writer = ChunkedResponseWriter(self.wfile)
+                try:
+                    for fragment in iter_library_scan_fragments(get_library_roots()):
+                        count += len(fragment['files']['name'])
+                        writer.write((json.dumps(fragment, separators=(',', ':')) + '\n').encode('utf-8'))
+                        writer.flush()
+                    summary = {
+                        'type': 'done',
+                        'format': 'compact',
+                        'count': count,
+                        'baseFolder': get_active_base_dir(),
+                        'roots': describe_library_roots(),
+                        'version': LIBRARY_VERSION,
+                    }
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                    raise
+                except Exception as e:
+                    print(f"{format_timestamp()} ERROR: Streaming rescan failed: {type(e).__name__} - {str(e)}", file=sys.stderr)
+                    summary = {'type': 'error', 'error': f'Failed to rescan images: {str(e)}'}
+                writer.write((json.dumps(summary) + '\n').encode('utf-8'))
+                writer.close()
+                print(f"{format_timestamp()}DARKROOM: Images Folders Re-Scanned and Streamed: {count} images", file=sys.stderr)
+            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                print(f"{format_timestamp()}DARKROOM: Streaming rescan cancelled by client after {count} images", file=sys.stderr)
         elif path_without_query == '/rescan-images':
             try:
-                # Rescan images
-                image_files = scan_images()
-                
+                # Rescan images (only the scope folder when one is given)
+                status, response = run_listing_request(
+                    rescan_library,
+                    compact=is_compact_listing_request(parsed_path),
+                    scope=(parse_qs(parsed_path.query).get('scope') or [''])[0],
+                )
+
                 # Send response with cache-busting headers
-                self.send_response(200)
+                self.send_response(status)
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
                 self.send_header('Pragma', 'no-cache')
                 self.send_header('Expires', '0')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    'images': image_files,
-                    'count': len(image_files),
-                    'baseFolder': get_active_base_dir()
-                }).encode())
-                print(f"{format_timestamp()}DARKROOM: Images Folders Re-Scanned and Loaded: {len(image_files)} images", file=sys.stderr)
+                self.end_json_response(response)
             except Exception as e:
                 error_msg = f'Failed to rescan images: {str(e)}'
                 print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
@@ -421,32 +1576,301 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                     self.wfile.write(json.dumps({'error': error_msg}).encode())
                 except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
                     pass  # Client disconnected
-        elif path_without_query == '/current-base-folder':
+        elif path_without_query == '/library-roots':
             try:
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
                 self.end_headers()
-                base_dir = get_active_base_dir()
-                self.wfile.write(json.dumps({
-                    'baseFolder': base_dir,
-                    'isSelected': bool(base_dir)
-                }).encode())
+                self.wfile.write(json.dumps({'roots': describe_library_roots()}).encode())
             except Exception as e:
-                print(f"{format_timestamp()} ERROR: Failed to get base folder: {e}", file=sys.stderr)
+                print(f"{format_timestamp()} ERROR: Failed to list library roots: {e}", file=sys.stderr)
                 self.send_response(500)
                 self.end_headers()
-        else:
-            # Default behavior for other GET requests (serve files)
+        elif path_without_query == '/session':
             try:
-                # Handle HTML files with cache-busting headers
-                if path_without_query.endswith('.html') or path_without_query in ('/darkroom.html', '/ddr.html', '/'):
-                    file_path = WEB_TEMPLATE_PATH
-                    
-                    # Check if file exists before sending response
-                    if not os.path.exists(file_path):
-                        self.send_error(404, "File not found")
-                        return
+                # The editor token only comes in a POST body, never in a URL
+                self.send_client_session()
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to open client session: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/image-state':
+            try:
+                query = parse_qs(parsed_path.query)
+                response = get_image_state_response(
+                    min_rating=(query.get('minRating') or [''])[0],
+                    favorite=(query.get('favorite') or [''])[0],
+                )
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_json_response(response)
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to read image state: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/library-listing':
+            try:
+                status, response = run_listing_request(
+                    get_library_listing_response,
+                    compact=is_compact_listing_request(parsed_path),
+                    scope=(parse_qs(parsed_path.query).get('scope') or [''])[0],
+                )
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_json_response(response)
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to list library: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/tiles-info':
+            library_path = (parse_qs(parsed_path.query).get('path') or [''])[0]
+            tile_source = get_tile_source(library_path)
+            info = {'tiled': False}
+            # Start building now so the first tiles are ready by the time the lightbox asks
+            if tile_source and start_tile_pyramid(tile_source):
+                info = {
+                    'tiled': True,
+                    'width': tile_source['width'],
+                    'height': tile_source['height'],
+                    'tileSize': tile_source['tileSize'],
+                    'overlap': 0,
+                    'maxLevel': tile_source['maxLevel'],
+                    'format': 'jpg',
+                    'version': tile_source['version'],
+                }
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+            self.end_headers()
+            self.wfile.write(json.dumps(info).encode())
+        elif path_without_query == '/tile':
+            try:
+                query = parse_qs(parsed_path.query)
+                tile_source = get_tile_source((query.get('path') or [''])[0])
+                try:
+                    level, x, y = (int((query.get(key) or [''])[0]) for key in ('level', 'x', 'y'))
+                except ValueError:
+                    level = x = y = -1
+                tile_path = get_tile_file(tile_source, level, x, y) if tile_source and min(x, y) >= 0 else None
+                if tile_path == TILE_PENDING:
+                    self.send_response(503)
+                    self.send_header('Retry-After', str(TILE_RETRY_AFTER))
+                    self.send_header('Cache-Control', 'no-store')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if not tile_path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                with open(tile_path, 'rb') as f:
+                    payload = f.read()
+                self.send_response(200)
+                self.send_header('Content-type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(payload)))
+                # Tile URLs carry the file version (v=size-mtime), so they never go stale
+                self.send_header('Cache-Control', 'max-age=31536000, immutable' if query.get('v') else 'max-age=3600')
+                self.end_headers()
+                self.wfile.write(payload)
+            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                pass  # Client disconnected
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to serve tile: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/thumbnail':
+            try:
+                library_path = (parse_qs(parsed_path.query).get('path') or [''])[0]
+                _, root_dir, relative_path = split_library_path(library_path)
+                _, source_path = resolve_library_path(library_path)
+                payload = None
+                try:
+                    source_stat = os.stat(source_path) if source_path else None
+                    thumb_path = get_indexed_thumbnail_path(
+                        root_dir, relative_path, source_path, source_stat
+                    ) if source_stat else None
+                    if thumb_path:
+                        with open(thumb_path, 'rb') as f:
+                            payload = f.read()
+                except OSError:
+                    pass
+                record_cache_lookup('thumbnail', payload is not None)
+                if payload is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('Cache-Control', 'max-age=3600')
+                self.end_headers()
+                self.wfile.write(payload)
+            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                pass  # Client disconnected
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to serve thumbnail: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/debug/profile':
+            if not get_app_config().get('web', {}).get('debugMode'):
+                self.send_error(404, 'File not found')
+                return
+            if self.get_request_role() != 'editor':
+                self.send_response(403)
+                self.send_header('Content-type', 'application/json')
+                self.end_json_response({'error': 'Profiling is limited to editors'})
+                return
+            query = parse_qs(parsed_path.query)
+            try:
+                seconds = float((query.get('seconds') or ['5'])[0])
+            except ValueError:
+                seconds = 5.0
+            report_format = (query.get('format') or ['collapsed'])[0]
+            # Sampling just sleeps between rounds; do not hold a handler slot meanwhile
+            self.leave_request_gate()
+            report = run_profile(seconds, report_format, include_idle=(query.get('idle') or [''])[0] == '1')
+            if report is None:
+                self.send_response(409)
+                self.send_header('Content-type', 'application/json')
+                self.end_json_response({'error': 'A profile is already running'})
+                return
+            payload = report.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+            self.end_headers()
+            self.wfile.write(payload)
+        elif path_without_query == '/folders':
+            try:
+                status, response = get_folders_response((parse_qs(parsed_path.query).get('path') or [''])[0])
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_json_response(response)
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to list folders: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/corrupt-files':
+            try:
+                status, response = get_corrupt_files_response((parse_qs(parsed_path.query).get('scope') or [''])[0])
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_json_response(response)
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to list corrupt files: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/query':
+            try:
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_json_response({
+                    'fields': get_query_field_ranges(),
+                    'engine': 'numpy' if get_numpy() is not None else 'array',
+                })
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to read query fields: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/download.zip':
+            query = parse_qs(parsed_path.query)
+            favorite = (query.get('favorite') or [''])[0]
+            min_rating = (query.get('minRating') or [''])[0]
+            try:
+                paths = get_filtered_library_paths(
+                    favorite=favorite in ('1', 'true') if favorite else None,
+                    min_rating=int(min_rating) if min_rating else None,
+                    folder=(query.get('folder') or [''])[0],
+                )
+            except ValueError:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': 'minRating must be an integer'}).encode())
+                return
+            self.send_download_zip(paths, (query.get('name') or [''])[0])
+        elif path_without_query == '/export':
+            query = parse_qs(parsed_path.query)
+            export_format = (query.get('format') or ['jsonl'])[0].lower()
+            if export_format not in EXPORT_FORMATS:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': f'Unsupported export format: {export_format}'}).encode())
+                return
+            parse_cold = (query.get('cold') or ['parse'])[0] != 'skip'
+            roots = get_library_roots()
+            filename = f"ddr-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+            content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+
+            # A cold export can parse the whole library; do not hold a handler slot meanwhile
+            self.leave_request_gate()
+            started = time.perf_counter()
+            count = 0
+            try:
+                self.begin_chunked_response(content_type, {'Content-Disposition': f'attachment; filename="{filename}"'})
+                writer = ChunkedResponseWriter(self.wfile)
+                for line in iter_export_lines(export_format, roots, parse_cold=parse_cold):
+                    writer.write(line.encode('utf-8'))
+                    count += 1
+                writer.close()
+                print(
+                    f"{format_timestamp()}DARKROOM: Exported {count - (1 if export_format == 'csv' else 0)} records "
+                    f"as {export_format.upper()} in {time.perf_counter() - started:.1f}s",
+                    file=sys.stderr,
+                )
+            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                print(f"{format_timestamp()}DARKROOM: Export cancelled by client after {count} records", file=sys.stderr)
+            except Exception as e:
+                # Headers are already sent; the truncated chunk stream tells the client it failed.
+                print(f"{format_timestamp()} ERROR: Export failed: {type(e).__name__} - {str(e)}", file=sys.stderr)
+        elif path_without_query == '/metrics':
+            try:
+                payload = render_metrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_headers()
+                self.wfile.write(payload)
+            except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+                pass  # Client disconnected
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to render metrics: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        elif path_without_query == '/current-base-folder':
+            try:
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps(get_current_base_folder_response()).encode())
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to get base folder: {e}", file=sys.stderr)
+                self.send_response(500)
+                self.end_headers()
+        else:
+            # Default behavior for other GET requests (serve files)
+            try:
+                # Handle HTML files with cache-busting headers
+                if path_without_query.endswith('.html') or path_without_query in ('/darkroom.html', '/ddr.html', '/'):
+                    file_path = get_web_template_path()
+                    
+                    # Check if file exists before sending response
+                    if not os.path.exists(file_path):
+                        self.send_error(404, "File not found")
+                        return
                     
                     # Send response with cache-busting headers
                     self.send_response(200)
@@ -485,7 +1909,98 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         parsed_path = urlparse(self.path)
         path_without_query = parsed_path.path
 
-        if path_without_query == '/log-action':
+        if path_without_query in EDITOR_ONLY_ROUTES and self.get_request_role() != 'editor':
+            self.send_response(403)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': 'This client is read-only'}).encode())
+            return
+
+        if path_without_query == '/session':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                if content_length > CLIENT_VIEW_MAX_BYTES:
+                    self.send_response(413)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': 'View state too large'}).encode())
+                    return
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                if isinstance(data, dict) and 'token' in data:
+                    # Opening the session with an editor token (from /ddr.html?token=...)
+                    self.send_client_session(str(data.get('token') or ''))
+                    return
+                view = data.get('view') if isinstance(data, dict) else None
+                session = get_client_session(self.get_request_client_id())
+                if session is None or not isinstance(view, dict):
+                    self.send_response(400)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': 'Unknown session or missing view'}).encode())
+                    return
+                session['view'] = view
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'success': True}).encode())
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to update client session: {e}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': str(e)}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/query':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                status, result = run_query_request(data)
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.end_json_response(result)
+            except Exception as e:
+                error_msg = f'Query failed: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/download.zip':
+            # Selection as JSON {paths, name}, or as a form post (paths = JSON array) so the
+            # browser streams the response straight into a download
+            content_length = int(self.headers.get('Content-Length', '0') or 0)
+            if content_length > DOWNLOAD_ZIP_MAX_BODY:
+                self.send_response(413)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': 'Selection too large'}).encode())
+                return
+            post_data = self.rfile.read(content_length).decode('utf-8') if content_length > 0 else ''
+            try:
+                if (self.headers.get('Content-Type') or '').startswith('application/x-www-form-urlencoded'):
+                    form = parse_qs(post_data)
+                    data = {'paths': json.loads((form.get('paths') or ['[]'])[0]), 'name': (form.get('name') or [''])[0]}
+                else:
+                    data = json.loads(post_data or '{}')
+                paths = data.get('paths') if isinstance(data, dict) else None
+                if not isinstance(paths, list):
+                    raise ValueError('paths must be a list')
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': f'Invalid selection: {e}'}).encode())
+                return
+            self.send_download_zip(paths, data.get('name'))
+        elif path_without_query == '/log-action':
             try:
                 content_length = int(self.headers['Content-Length'])
                 post_data = self.rfile.read(content_length)
@@ -494,9 +2009,8 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 action = data.get('action', 'unknown')
                 details = data.get('details', {})
                 
-                # Format and print the log message
-                log_message = format_log_message(action, details)
-                print(log_message, file=sys.stderr)
+                # Formatting and printing happen on the background log writer
+                enqueue_action_log(action, details)
                 
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
@@ -512,6 +2026,34 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                     self.wfile.write(json.dumps({'error': str(e)}).encode())
                 except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
                     pass  # Client disconnected
+        elif path_without_query == '/log-actions':
+            try:
+                content_length = int(self.headers.get('Content-Length') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b''
+                data = json.loads(post_data.decode('utf-8')) if post_data else {}
+                actions = data.get('actions', []) if isinstance(data, dict) else data
+                if not isinstance(actions, list):
+                    actions = []
+
+                accepted = 0
+                for entry in actions[:MAX_ACTION_LOG_BATCH]:
+                    if isinstance(entry, dict) and enqueue_action_log(entry.get('action', 'unknown'), entry.get('details', {})):
+                        accepted += 1
+
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({'success': True, 'accepted': accepted}).encode())
+            except Exception as e:
+                print(f"{format_timestamp()} ERROR: Failed to process log actions: {type(e).__name__} - {str(e)}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': str(e)}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass  # Client disconnected
         elif path_without_query == '/move-file':
             try:
                 # Read the request body
@@ -522,123 +2064,14 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 old_path = data.get('oldPath', '')
                 new_path = data.get('newPath', '')
                 
-                if not old_path or not new_path:
-                    self.send_response(400)
+                status, result = move_library_file(old_path, new_path)
+                try:
+                    self.send_response(status)
                     self.send_header('Content-type', 'application/json')
                     self.end_headers()
-                    self.wfile.write(json.dumps({'error': 'Missing oldPath or newPath'}).encode())
-                    return
-                
-                # Resolve against selected image root folder.
-                script_dir = get_active_base_dir() or APP_DIR
-                
-                # Normalize paths - handle both forward and backslashes
-                old_path = old_path.replace('\\', '/')
-                new_path = new_path.replace('\\', '/')
-                
-                # Build absolute paths
-                old_abs = os.path.abspath(os.path.join(script_dir, old_path))
-                new_abs = os.path.abspath(os.path.join(script_dir, new_path))
-                
-                # Normalize the paths to handle any .. or . components
-                old_abs = os.path.normpath(old_abs)
-                new_abs = os.path.normpath(new_abs)
-                
-                # Ensure paths are within the script directory (security check)
-                script_dir_abs = os.path.abspath(script_dir)
-                if not old_abs.startswith(script_dir_abs) or not new_abs.startswith(script_dir_abs):
-                    error_msg = f'Path outside allowed directory. Script dir: {script_dir_abs}, Old: {old_abs}, New: {new_abs}'
-                    print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                    try:
-                        self.send_response(403)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'error': error_msg}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
-                    return
-                
-                # Check if source file exists
-                if not os.path.exists(old_abs):
-                    error_msg = f'Source file not found: {old_abs}'
-                    print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                    try:
-                        self.send_response(404)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'error': error_msg}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
-                    return
-                
-                # Create destination directory if it doesn't exist
-                new_dir = os.path.dirname(new_abs)
-                if not os.path.exists(new_dir):
-                    try:
-                        os.makedirs(new_dir)
-                        print(f"{format_timestamp()} Created directory: {new_dir}", file=sys.stderr)
-                    except Exception as e:
-                        error_msg = f'Failed to create directory {new_dir}: {str(e)}'
-                        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                        try:
-                            self.send_response(500)
-                            self.send_header('Content-type', 'application/json')
-                            self.end_headers()
-                            self.wfile.write(json.dumps({'error': error_msg}).encode())
-                        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                            pass
-                        return
-                
-                # Move the file
-                try:
-                    shutil.move(old_abs, new_abs)
-                    
-                    # Determine the type of operation for better log messages
-                    old_basename = os.path.basename(old_abs)
-                    new_basename = os.path.basename(new_abs)
-                    new_path_str = new_abs.replace('\\', '/')
-                    old_path_str = old_abs.replace('\\', '/')
-                    
-                    # Check if it's a favorite operation (moving TO Favorites folder)
-                    is_favoriting = 'Favorites' in new_path_str and 'Favorites' not in old_path_str
-                    
-                    # Check if it's a rating operation (filename changes to include _0[1-5] pattern)
-                    old_rating_match = re.search(r'_0([1-5])(\.[^.]+)$', old_basename)
-                    new_rating_match = re.search(r'_0([1-5])(\.[^.]+)$', new_basename)
-                    is_rating = (old_rating_match is not None) != (new_rating_match is not None) or (old_rating_match and new_rating_match and old_rating_match.group(1) != new_rating_match.group(1))
-                    
-                    if is_favoriting:
-                        # Favorite operation - show simplified message (only when moving TO favorites)
-                        print(f"{format_timestamp()}FILE: Image file favorited and moved to Favorites folder: {new_basename}", file=sys.stderr)
-                    elif is_rating:
-                        # Rating operation - extract rating and show message
-                        if new_rating_match:
-                            rating = int(new_rating_match.group(1))
-                            print(f"{format_timestamp()}FILE: Image file set '{rating} Star{'s' if rating > 1 else ''}' and renamed to: {new_basename}", file=sys.stderr)
-                        else:
-                            # Rating removed
-                            print(f"{format_timestamp()}FILE: Image file rating removed and renamed to: {new_basename}", file=sys.stderr)
-                    else:
-                        # Generic move operation (fallback)
-                        print(f"{format_timestamp()} Successfully moved file: {old_basename} -> {new_basename}", file=sys.stderr)
-                    try:
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'success': True, 'message': 'File moved successfully'}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
-                except Exception as e:
-                    error_msg = f'Failed to move file: {str(e)}'
-                    print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                    try:
-                        self.send_response(500)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'error': error_msg}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
-                    
+                    self.wfile.write(json.dumps(result).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
             except Exception as e:
                 error_msg = f'Server error: {str(e)}'
                 print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
@@ -660,42 +2093,248 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 
                 file_path = data.get('filePath', '')
                 
-                if not file_path:
+                status, result = delete_library_file(file_path)
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps(result).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+            except Exception as e:
+                error_msg = f'Server error: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                import traceback
+                traceback.print_exc(file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/select-base-folder':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                requested_folder = (data.get('folder') or '').strip()
+
+                if not requested_folder and not self.can_open_server_dialog():
                     self.send_response(400)
                     self.send_header('Content-type', 'application/json')
                     self.end_headers()
-                    self.wfile.write(json.dumps({'error': 'Missing filePath'}).encode())
+                    self.wfile.write(json.dumps({'error': 'Remote clients must provide a folder path'}).encode())
                     return
-                
-                # Resolve against selected image root folder.
-                script_dir = get_active_base_dir() or APP_DIR
-                
-                # Normalize paths - handle both forward and backslashes
-                file_path = file_path.replace('\\', '/')
-                
-                # Build absolute path
-                file_abs = os.path.abspath(os.path.join(script_dir, file_path))
-                
-                # Normalize the path to handle any .. or . components
-                file_abs = os.path.normpath(file_abs)
-                
-                # Ensure path is within the script directory (security check)
-                script_dir_abs = os.path.abspath(script_dir)
-                if not file_abs.startswith(script_dir_abs):
-                    error_msg = f'Path outside allowed directory. Script dir: {script_dir_abs}, File: {file_abs}'
-                    print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                    try:
-                        self.send_response(403)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'error': error_msg}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
+
+                selected_folder = None
+                if requested_folder:
+                    selected_folder = requested_folder
+                else:
+                    selected_folder = pick_base_dir_dialog(get_active_base_dir())
+
+                if not selected_folder:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                    self.send_header('Access-Control-Allow-Origin', '*')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'selected': False, 'baseFolder': get_active_base_dir()}).encode())
+                    return
+
+                selected_folder = set_active_base_dir(selected_folder, persist=True)
+                image_files = scan_images()
+                print(f"{format_timestamp()}DARKROOM: Base folder selected: {selected_folder}", file=sys.stderr)
+
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    'selected': True,
+                    'baseFolder': selected_folder,
+                    'images': image_files,
+                    'count': len(image_files)
+                }).encode())
+            except Exception as e:
+                error_msg = f'Failed to select base folder: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({'error': error_msg}).encode())
+        elif path_without_query == '/image-state':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                status, result = update_image_state(data)
+                self.send_response(status)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps(result).encode())
+            except Exception as e:
+                error_msg = f'Failed to update image state: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/image-state/sync':
+            try:
+                result = sync_image_state_to_files()
+                if result['moved']:
+                    start_background_scan()
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps(result).encode())
+            except Exception as e:
+                error_msg = f'Failed to sync image state: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/metadata-lookup':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                paths = data.get('paths', [])
+                if not isinstance(paths, list):
+                    paths = []
+                entries = lookup_indexed_metadata(paths[:5000])
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({'entries': entries, 'missing': len(paths) - len(entries)}).encode())
+            except Exception as e:
+                error_msg = f'Failed to look up metadata index: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/add-library-root':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                requested_folder = (data.get('folder') or '').strip()
+                if not requested_folder and not self.can_open_server_dialog():
+                    self.send_response(400)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': 'Remote clients must provide a folder path'}).encode())
+                    return
+                selected_folder = requested_folder or pick_base_dir_dialog(get_active_base_dir())
+
+                if not selected_folder:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                    self.send_header('Access-Control-Allow-Origin', '*')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'added': False, 'roots': describe_library_roots()}).encode())
+                    return
+
+                alias = add_library_root(selected_folder, alias=(data.get('alias') or '').strip() or None)
+                image_files = get_library_images()
+                print(f"{format_timestamp()}DARKROOM: Library root added: {LIBRARY_ROOT_PREFIX}{alias} -> {selected_folder}", file=sys.stderr)
+
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    'added': True,
+                    'baseFolder': get_active_base_dir(),
+                    'alias': alias,
+                    'roots': describe_library_roots(),
+                    'images': image_files,
+                    'count': len(image_files)
+                }).encode())
+            except Exception as e:
+                error_msg = f'Failed to add library root: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                try:
+                    self.send_response(400 if isinstance(e, ValueError) else 500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/remove-library-root':
+            try:
+                content_length = int(self.headers.get('Content-Length', '0') or 0)
+                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
+                data = json.loads(post_data.decode('utf-8') or '{}')
+                alias = (data.get('alias') or '').strip()
+
+                removed = remove_library_root(alias) if alias else None
+                if not removed:
+                    self.send_response(404)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': f'Unknown library root: {alias}'}).encode())
+                    return
+
+                image_files = get_library_images()
+                print(f"{format_timestamp()}DARKROOM: Library root removed: {LIBRARY_ROOT_PREFIX}{alias} ({removed})", file=sys.stderr)
+
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({
+                    'removed': True,
+                    'baseFolder': get_active_base_dir(),
+                    'roots': describe_library_roots(),
+                    'images': image_files,
+                    'count': len(image_files)
+                }).encode())
+            except Exception as e:
+                error_msg = f'Failed to remove library root: {str(e)}'
+                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                try:
+                    self.send_response(500)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': error_msg}).encode())
+                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                    pass
+        elif path_without_query == '/update-embedded-list':
+            try:
+                # Read the request body
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = json.loads(post_data.decode('utf-8'))
+                
+                image_list = data.get('images', [])
+                
+                if not isinstance(image_list, list):
+                    self.send_response(400)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps({'error': 'Missing or invalid images array'}).encode())
                     return
                 
-                # Check if file exists
-                if not os.path.exists(file_abs):
-                    error_msg = f'File not found: {file_abs}'
+                # Update the source ddr template file.
+                html_file = get_web_template_path()
+                
+                if not os.path.exists(html_file):
+                    error_msg = f'HTML file not found: {html_file}'
                     print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
                     try:
                         self.send_response(404)
@@ -706,19 +2345,47 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                         pass
                     return
                 
-                # Delete the file
+                # Read the HTML file
                 try:
-                    os.remove(file_abs)
-                    print(f"{format_timestamp()}FILE: Image file deleted: {os.path.basename(file_abs)}", file=sys.stderr)
-                    try:
-                        self.send_response(200)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'success': True, 'message': 'File deleted successfully'}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
+                    with open(html_file, 'r', encoding='utf-8') as f:
+                        html_content = f.read()
+                    
+                    # Generate JavaScript array
+                    js_array = json.dumps(image_list, indent=2)
+                    replacement = f'const embeddedImageList = {js_array};'
+                    
+                    # Find and replace the embedded image list
+                    pattern = r'const embeddedImageList = \[.*?\];'
+                    match = re.search(pattern, html_content, re.DOTALL)
+                    if match:
+                        html_content = html_content[:match.start()] + replacement + html_content[match.end():]
+                        
+                        # Write the updated HTML
+                        with open(html_file, 'w', encoding='utf-8') as f:
+                            f.write(html_content)
+                        
+                        print(f"{format_timestamp()}DARKROOM: Updated embedded image list in {html_file} with {len(image_list)} images", file=sys.stderr)
+                        
+                        try:
+                            self.send_response(200)
+                            self.send_header('Content-type', 'application/json')
+                            self.send_header('Access-Control-Allow-Origin', '*')
+                            self.end_headers()
+                            self.wfile.write(json.dumps({'success': True, 'count': len(image_list)}).encode())
+                        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                            pass
+                    else:
+                        error_msg = 'Could not find embeddedImageList in HTML file'
+                        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+                        try:
+                            self.send_response(500)
+                            self.send_header('Content-type', 'application/json')
+                            self.end_headers()
+                            self.wfile.write(json.dumps({'error': error_msg}).encode())
+                        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
+                            pass
                 except Exception as e:
-                    error_msg = f'Failed to delete file: {str(e)}'
+                    error_msg = f'Failed to update HTML file: {str(e)}'
                     print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
                     try:
                         self.send_response(500)
@@ -740,196 +2407,2240 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                     self.wfile.write(json.dumps({'error': error_msg}).encode())
                 except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
                     pass
-        elif path_without_query == '/select-base-folder':
+        else:
+            self.send_response(404)
+            self.end_headers()
+    
+    def log_message(self, format, *args):
+        # Suppress default HTTP request logging for cleaner output
+        # We handle our own logging with timestamps
+        pass
+    
+    def log_error(self, format, *args):
+        # Override to format errors with timestamp
+        message = format % args
+        print(f"{format_timestamp()} ERROR: {message}", file=sys.stderr)
+
+
+def is_excluded_folder(name):
+    # 'samples' holds the README images; the cache folder is ours
+    return name in ('samples', CACHE_DIR_NAME)
+
+
+# Function to scan one library root (or one folder of it, start_dir) and all subdirectories.
+# Yields (relative dir, file name, size, mtime ms, (st_dev, inode)); os.scandir provides
+# the stat data without an extra system call per file on Windows, where its st_ino is 0
+# and the inode comes from DirEntry.inode() instead.
+def iter_root_entries(root_dir, start_dir=''):
+    image_exts = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+    pending = [start_dir]
+
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(root_dir, rel_dir) if rel_dir else root_dir) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
             try:
-                content_length = int(self.headers.get('Content-Length', '0') or 0)
-                post_data = self.rfile.read(content_length) if content_length > 0 else b'{}'
-                data = json.loads(post_data.decode('utf-8') or '{}')
-                requested_folder = (data.get('folder') or '').strip()
+                if entry.is_dir():
+                    # Like os.walk: do not descend into symlinked folders
+                    if not is_excluded_folder(entry.name) and not entry.is_symlink():
+                        subdirs.append(f"{rel_dir}/{entry.name}" if rel_dir else entry.name)
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in image_exts:
+                    continue
+                # Skip ddr.png in the root directory
+                if not rel_dir and entry.name.lower() == 'ddr.png':
+                    continue
+                stat_result = entry.stat()
+                size, mtime = file_signature(stat_result)
+                # Windows scandir stats carry no inode; DirEntry.inode() fetches and caches it,
+                # so file ids do not cost a separate os.stat() per file
+                ino = stat_result.st_ino or entry.inode()
+            except OSError:
+                continue
+            yield rel_dir, entry.name, size, mtime, (stat_result.st_dev, ino)
+        pending.extend(reversed(subdirs))
+
+
+def iter_root_images(root_dir, start_dir=''):
+    for rel_dir, name, *_ in iter_root_entries(root_dir, start_dir):
+        yield f"{rel_dir}/{name}" if rel_dir else name
+
+
+def scan_root_images(root_dir, start_dir=''):
+    return list(iter_root_images(root_dir, start_dir))
+
+
+# Compact listing: a directory table plus one row per file, stored column-wise in
+# arrays so a million-image library does not repeat its folder prefixes a million times.
+GZIP_MIN_BYTES = 16 * 1024
+# Streaming rescan (/rescan-images?stream=1): rows per NDJSON line, and the longest a
+# partial batch may wait, so the first page shows up quickly even on slow disks
+STREAM_BATCH_SIZE = 500
+STREAM_FLUSH_INTERVAL = 0.25
+COMPACT_LISTING_COLUMNS = (('dir', 'I'), ('size', 'q'), ('mtime', 'q'), ('w', 'I'), ('h', 'I'), ('fid', 'Q'))
+
+
+def new_compact_listing():
+    listing = {'dirs': [], 'dirLookup': {}, 'name': []}
+    for column, typecode in COMPACT_LISTING_COLUMNS:
+        listing[column] = array(typecode)
+    return listing
+
+
+def compact_listing_append(listing, rel_dir, name, size=0, mtime=0, width=0, height=0, file_id=0):
+    dir_id = listing['dirLookup'].get(rel_dir)
+    if dir_id is None:
+        dir_id = len(listing['dirs'])
+        listing['dirs'].append(rel_dir)
+        listing['dirLookup'][rel_dir] = dir_id
+    listing['dir'].append(dir_id)
+    listing['name'].append(name)
+    listing['size'].append(size)
+    listing['mtime'].append(mtime)
+    listing['w'].append(width or 0)
+    listing['h'].append(height or 0)
+    listing['fid'].append(file_id)
+
+
+def fill_compact_listing(root_dir, listing, start_dir=''):
+    """Walk a root (or its start_dir subtree) into listing, yielding as each file is added.
+
+    Dimensions come from a fresh metadata index entry, found by path or, for a file that
+    was renamed or moved since it was indexed, by its file id.
+    """
+    index_entries = get_metadata_index(root_dir)
+    index_by_id = get_metadata_index_by_file_id(root_dir)
+    content_ids = uses_content_file_ids()
+    for rel_dir, name, size, mtime, (dev, ino) in iter_root_entries(root_dir, start_dir):
+        relative_path = f"{rel_dir}/{name}" if rel_dir else name
+        entry = index_entries.get(relative_path)
+        fresh = bool(entry) and (entry.get('size'), entry.get('mtime')) == (size, mtime)
+        if fresh and 'fid' in entry and (content_ids or not ino):
+            file_id = entry['fid']  # skip the fingerprint read / extra stat
+        else:
+            try:
+                file_id = get_file_id(root_dir, os.path.join(root_dir, relative_path.replace('/', os.sep)), size, dev, ino, content_ids)
+            except OSError:
+                continue
+        if not fresh:
+            entry = index_by_id.get(file_id)
+            fresh = bool(entry) and (entry.get('size'), entry.get('mtime')) == (size, mtime)
+        if fresh:
+            compact_listing_append(listing, rel_dir, name, size, mtime, entry.get('width'), entry.get('height'), file_id)
+        else:
+            compact_listing_append(listing, rel_dir, name, size, mtime, file_id=file_id)
+        yield
+
+
+def build_compact_listing(root_dir, start_dir=''):
+    """Scan a root (or one folder of it) into a compact listing."""
+    listing = new_compact_listing()
+    for _ in fill_compact_listing(root_dir, listing, start_dir):
+        pass
+    return listing
+
+
+def copy_compact_listing_rows(target, listing, keep_dir=None):
+    """Append listing's rows to target, only those in folders where keep_dir(rel_dir) is true."""
+    dirs = listing['dirs']
+    kept = [keep_dir is None or keep_dir(rel_dir) for rel_dir in dirs]
+    columns = [listing[column] for column, _ in COMPACT_LISTING_COLUMNS[1:]]
+    for row, dir_id in enumerate(listing['dir']):
+        if kept[dir_id]:
+            compact_listing_append(target, dirs[dir_id], listing['name'][row], *(column[row] for column in columns))
+    return target
+
+
+def iter_compact_listing_paths(listing, prefix=''):
+    dirs = listing['dirs']
+    for dir_id, name in zip(listing['dir'], listing['name']):
+        rel_dir = dirs[dir_id]
+        yield prefix + (f"{rel_dir}/{name}" if rel_dir else name)
+
+
+def compact_listing_to_json(listing):
+    return {
+        'dirs': listing['dirs'],
+        'files': {'name': listing['name'], **{column: listing[column].tolist() for column, _ in COMPACT_LISTING_COLUMNS}},
+    }
+
+
+def compact_listing_from_json(data):
+    """Rebuild an array-backed listing from compact_listing_to_json() output (raises on bad data)."""
+    files = data['files']
+    listing = {'dirs': list(data['dirs']), 'name': list(files['name'])}
+    listing['dirLookup'] = {rel_dir: dir_id for dir_id, rel_dir in enumerate(listing['dirs'])}
+    for column, typecode in COMPACT_LISTING_COLUMNS:
+        listing[column] = array(typecode, files[column])
+        if len(listing[column]) != len(listing['name']):
+            raise ValueError(f"Column '{column}' length mismatch")
+    return listing
+
+
+def get_listing_cache_path(root_dir):
+    return os.path.join(root_dir, CACHE_DIR_NAME, LISTING_CACHE_FILENAME)
+
+
+def save_cached_listing(root_dir, listing):
+    """Persist a root's last scan so the next startup can serve it before scanning."""
+    cache_path = get_listing_cache_path(root_dir)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'root': root_dir, 'scannedAt': time.time(), **compact_listing_to_json(listing)}, f, separators=(',', ':'))
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"{format_timestamp()} WARNING: Could not save listing cache for {root_dir}: {e}", file=sys.stderr)
+
+
+def load_cached_listings():
+    """Seed shards from each root's cached listing; they are replaced by the next scan."""
+    global LIBRARY_VERSION
+    loaded = 0
+    for alias, root_dir in get_library_roots():
+        with LIBRARY_LOCK:
+            if alias in LIBRARY_SHARDS:
+                continue
+        try:
+            with open(get_listing_cache_path(root_dir), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            listing = compact_listing_from_json(data)
+        except (OSError, ValueError, TypeError, KeyError, OverflowError):
+            continue
+        with LIBRARY_LOCK:
+            LIBRARY_SHARDS[alias] = {
+                'root': root_dir,
+                'listing': listing,
+                'scannedAt': data.get('scannedAt'),
+                'duration': 0.0,
+                'cached': True,
+            }
+            LIBRARY_VERSION += 1
+        loaded += len(listing['name'])
+    return loaded
+
+
+def scan_library_shard(alias, root_dir, scope=''):
+    """Rescan a single library root (or only its scope folder) and store it as that root's shard."""
+    started = time.perf_counter()
+    listing = build_compact_listing(root_dir, scope)
+    return store_library_shard(alias, root_dir, listing, time.perf_counter() - started, scope)
+
+
+scan_library_shard = time_hot_function('scan', scan_library_shard)
+
+
+def store_library_shard(alias, root_dir, listing, duration, scope=''):
+    """Store a root's listing. A scoped walk of a folder the shard already covers replaces
+    just that subtree's rows; otherwise the shard becomes a partial one holding the subtree."""
+    global LIBRARY_VERSION
+    with LIBRARY_LOCK:
+        current = LIBRARY_SHARDS.get(alias)
+    if scope and current and current['root'] == root_dir and is_in_scope(scope, current.get('scope', '')):
+        spliced = copy_compact_listing_rows(new_compact_listing(), current['listing'], lambda rel_dir: not is_in_scope(rel_dir, scope))
+        listing = copy_compact_listing_rows(spliced, listing)
+        scope = current.get('scope', '')
+    with LIBRARY_LOCK:
+        LIBRARY_SHARDS[alias] = {
+            'root': root_dir,
+            'listing': listing,
+            'scannedAt': time.time(),
+            'duration': duration,
+            'scope': scope,
+        }
+        LIBRARY_VERSION += 1
+    if not scope:
+        save_cached_listing(root_dir, listing)
+    return listing
+
+
+def get_library_root_prefix(alias):
+    return f"{LIBRARY_ROOT_PREFIX}{alias}/" if alias else ''
+
+
+def get_library_dir_label(prefix, rel_dir):
+    """Directory table entry as the client sees it (e.g. '@nas/2026-01-02' or '@nas' for a root)."""
+    return prefix + rel_dir if rel_dir else prefix.rstrip('/')
+
+
+def merge_library_shards(roots):
+    image_files = []
+    with LIBRARY_LOCK:
+        for alias, _ in roots:
+            shard = LIBRARY_SHARDS.get(alias)
+            if shard:
+                image_files.extend(iter_compact_listing_paths(shard['listing'], get_library_root_prefix(alias)))
+    return image_files
+
+
+def merge_compact_listings(roots):
+    """Compact JSON listing across roots: one directory table (with @alias prefixes) and file columns."""
+    with LIBRARY_LOCK:
+        shards = [(alias, LIBRARY_SHARDS.get(alias)) for alias, _ in roots]
+    return merge_root_listings([(alias, shard['listing']) for alias, shard in shards if shard])
+
+
+def merge_root_listings(listings):
+    """Compact JSON listing of [(alias, listing)]."""
+    dirs = []
+    files = {'name': [], **{column: [] for column, _ in COMPACT_LISTING_COLUMNS}}
+    for alias, listing in listings:
+        offset = len(dirs)
+        prefix = get_library_root_prefix(alias)
+        dirs.extend(get_library_dir_label(prefix, rel_dir) for rel_dir in listing['dirs'])
+        files['dir'].extend(dir_id + offset for dir_id in listing['dir'])
+        files['name'].extend(listing['name'])
+        for column, _ in COMPACT_LISTING_COLUMNS[1:-1]:
+            files[column].extend(listing[column])
+        files['fid'].extend(format_file_ids(listing['fid'], prefix))
+    return {'format': 'compact', 'dirs': dirs, 'files': files, 'count': len(files['name'])}
+
+
+def get_library_images():
+    """Merged listing from cached shards, scanning only roots that have no shard yet."""
+    roots = get_library_roots()
+    with LIBRARY_LOCK:
+        missing = [(alias, root) for alias, root in roots
+                   if alias not in LIBRARY_SHARDS or LIBRARY_SHARDS[alias]['root'] != root
+                   or LIBRARY_SHARDS[alias].get('scope')]
+    for alias, root in missing:
+        scan_library_shard(alias, root)
+    return merge_library_shards(roots)
+
+
+def is_compact_listing_request(parsed_path):
+    return (parse_qs(parsed_path.query).get('format') or [''])[0] == 'compact'
+
+
+def get_library_listing(compact=False, scope=''):
+    """Current merged listing without scanning (may come from the startup listing cache).
+
+    With a scope only that folder's subtree is listed, walking just the subtree when its
+    root has not been scanned that far.
+    """
+    if scope:
+        return get_scoped_library_listing(scope, compact)
+    roots = get_library_roots()
+    with LIBRARY_LOCK:
+        shards = [LIBRARY_SHARDS.get(alias) for alias, _ in roots]
+        version = LIBRARY_VERSION
+    if compact:
+        listing = merge_compact_listings(roots)
+    else:
+        image_files = merge_library_shards(roots)
+        listing = {'images': image_files, 'count': len(image_files)}
+    listing.update({
+        'cached': any(shard and shard.get('cached') for shard in shards),
+        'scanning': LIBRARY_SCAN_STATE['scanning'],
+        'version': version,
+    })
+    return listing
+
+
+# Folder tree and scopes. A scope is a library folder path ("2026-01-02", "@nas/project");
+# the listing, rescan, /query and the index command can be limited to its subtree.
+# /folders returns one directory level per request (a single scandir) with recursive image
+# counts and sizes summed from the root's scan listing once per shard.
+def is_in_scope(rel_dir, scope):
+    return not scope or rel_dir == scope or rel_dir.startswith(scope + '/')
+
+
+def split_library_scope(scope):
+    """(alias, root_dir, rel_dir) of a library folder path; ValueError when it is not a folder in a root."""
+    alias, root_dir, rel_dir = split_library_path(scope)
+    if not root_dir or (not alias and not get_active_base_dir()):
+        raise ValueError(f'Unknown library folder: {scope}')
+    folder = os.path.normpath(os.path.join(root_dir, rel_dir.replace('/', os.sep)))
+    if not is_path_within(root_dir, folder) or not os.path.isdir(folder):
+        raise ValueError(f'Not a library folder: {scope}')
+    rel_dir = os.path.relpath(folder, root_dir).replace(os.sep, '/')
+    rel_dir = '' if rel_dir == '.' else rel_dir
+    if any(is_excluded_folder(part) for part in rel_dir.split('/')):
+        raise ValueError(f'Not a library folder: {scope}')
+    return alias, root_dir, rel_dir
+
+
+def get_scope_shard_listing(alias, root_dir, rel_dir):
+    """The root's listing if its shard covers rel_dir, else a fresh walk of just that subtree."""
+    with LIBRARY_LOCK:
+        shard = LIBRARY_SHARDS.get(alias)
+    if shard and shard['root'] == root_dir and is_in_scope(rel_dir, shard.get('scope', '')):
+        return shard['listing'], bool(shard.get('cached'))
+    return scan_library_shard(alias, root_dir, rel_dir), False
+
+
+def build_scoped_listing_response(alias, rel_dir, listing, compact):
+    prefix = get_library_root_prefix(alias)
+    if rel_dir:
+        listing = copy_compact_listing_rows(new_compact_listing(), listing, lambda dir_name: is_in_scope(dir_name, rel_dir))
+    if compact:
+        response = merge_root_listings([(alias, listing)])
+    else:
+        image_files = list(iter_compact_listing_paths(listing, prefix))
+        response = {'images': image_files, 'count': len(image_files)}
+    response['scope'] = get_library_dir_label(prefix, rel_dir)
+    return response
+
+
+def get_scoped_library_listing(scope, compact=False):
+    alias, root_dir, rel_dir = split_library_scope(scope)
+    listing, cached = get_scope_shard_listing(alias, root_dir, rel_dir)
+    response = build_scoped_listing_response(alias, rel_dir, listing, compact)
+    response.update({
+        'cached': cached,
+        'scanning': LIBRARY_SCAN_STATE['scanning'],
+        'version': LIBRARY_VERSION,
+    })
+    return response
+
+
+def get_folder_totals(shard):
+    """({rel_dir: [images, bytes]} counting subfolders, set of folders with subfolders) for a shard."""
+    with LIBRARY_LOCK:
+        totals = shard.get('folderTotals')
+    if totals is not None:
+        return totals
+    listing = shard['listing']
+    direct = [[0, 0] for _ in listing['dirs']]
+    for dir_id, size in zip(listing['dir'], listing['size']):
+        direct[dir_id][0] += 1
+        direct[dir_id][1] += size
+    counts = {}
+    for rel_dir, (images, size) in zip(listing['dirs'], direct):
+        if not images:
+            continue
+        parts = rel_dir.split('/') if rel_dir else []
+        for depth in range(len(parts) + 1):
+            total = counts.setdefault('/'.join(parts[:depth]), [0, 0])
+            total[0] += images
+            total[1] += size
+    parents = {rel_dir.rpartition('/')[0] for rel_dir in counts if rel_dir}
+    totals = (counts, parents)
+    with LIBRARY_LOCK:
+        shard['folderTotals'] = totals
+    return totals
+
+
+def describe_library_folder(alias, root_dir, rel_dir, name):
+    """Folder entry with totals from the root's shard (None when the shard does not cover it)."""
+    with LIBRARY_LOCK:
+        shard = LIBRARY_SHARDS.get(alias)
+    folder = {'name': name, 'path': get_library_dir_label(get_library_root_prefix(alias), rel_dir),
+              'images': None, 'bytes': None, 'hasChildren': None}
+    if shard and shard['root'] == root_dir and is_in_scope(rel_dir, shard.get('scope', '')):
+        counts, parents = get_folder_totals(shard)
+        folder['images'], folder['bytes'] = counts.get(rel_dir, (0, 0))
+        folder['hasChildren'] = rel_dir in parents
+    return folder
+
+
+def list_library_folders(path=''):
+    """One level of the folder tree: the subfolders of a library folder (the top level also lists extra roots)."""
+    folders = []
+    if path or get_active_base_dir():
+        alias, root_dir, rel_dir = split_library_scope(path)
+        current = describe_library_folder(alias, root_dir, rel_dir, os.path.basename(rel_dir) or get_library_root_prefix(alias).rstrip('/') or os.path.basename(root_dir))
+        folder_path = os.path.join(root_dir, rel_dir.replace('/', os.sep)) if rel_dir else root_dir
+        try:
+            with os.scandir(folder_path) as it:
+                names = sorted(entry.name for entry in it
+                               if entry.is_dir() and not entry.is_symlink() and not is_excluded_folder(entry.name))
+        except OSError as e:
+            raise ValueError(f'Cannot read folder {path}: {e}')
+        for name in names:
+            child = f"{rel_dir}/{name}" if rel_dir else name
+            folders.append(describe_library_folder(alias, root_dir, child, name))
+    else:
+        current = {'name': '', 'path': '', 'images': None, 'bytes': None, 'hasChildren': None}
+    if not path:
+        for alias, root_dir in get_library_roots():
+            if alias:
+                root = describe_library_folder(alias, root_dir, '', get_library_root_prefix(alias).rstrip('/'))
+                root['root'] = True
+                folders.append(root)
+    current['folders'] = folders
+    return current
+
+
+def run_background_scan():
+    try:
+        image_files = scan_images()
+        mark_startup('background scan')
+        print(f"{format_timestamp()}DARKROOM: Background scan complete: {len(image_files)} images", file=sys.stderr)
+        report_startup_profile()
+    except Exception as e:
+        print(f"{format_timestamp()} ERROR: Background scan failed: {type(e).__name__} - {str(e)}", file=sys.stderr)
+    finally:
+        LIBRARY_SCAN_STATE['scanning'] = False
+
+
+def start_background_scan():
+    if not get_library_roots():
+        return None
+    with LIBRARY_LOCK:
+        if LIBRARY_SCAN_STATE['scanning']:
+            return None
+        LIBRARY_SCAN_STATE['scanning'] = True
+    thread = threading.Thread(target=run_background_scan, name='ddr-background-scan', daemon=True)
+    thread.start()
+    return thread
+
+
+def describe_library_roots():
+    roots = []
+    for alias, path in get_library_roots():
+        with LIBRARY_LOCK:
+            shard = LIBRARY_SHARDS.get(alias)
+        roots.append({
+            'alias': alias,
+            'path': path,
+            'prefix': get_library_root_prefix(alias),
+            'primary': not alias,
+            'count': len(shard['listing']['name']) if shard else None,
+            'scope': shard.get('scope') or None if shard else None,
+        })
+    return roots
+
+
+# Function to scan every library root; each root is its own shard, scanned in parallel
+def rescan_library_shards():
+    roots = get_library_roots()
+    if not roots:
+        return roots
+
+    scan_started = time.perf_counter()
+    if len(roots) == 1:
+        listings = [scan_library_shard(*roots[0])]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(len(roots), 8), thread_name_prefix='ddr-scan') as pool:
+            listings = list(pool.map(lambda root: scan_library_shard(*root), roots))
+
+    record_scan_metrics(time.perf_counter() - scan_started, sum(len(listing['name']) for listing in listings))
+    return roots
+
+
+def scan_images():
+    return merge_library_shards(rescan_library_shards())
+
+
+def compact_listing_fragment(listing, prefix, dir_offset, dir_start, row_start):
+    """Rows added to listing since (dir_start, row_start), with directory ids shifted into the merged table."""
+    return {
+        'type': 'files',
+        'dirStart': dir_offset + dir_start,
+        'dirs': [get_library_dir_label(prefix, rel_dir) for rel_dir in listing['dirs'][dir_start:]],
+        'files': {
+            'name': listing['name'][row_start:],
+            'dir': [dir_id + dir_offset for dir_id in listing['dir'][row_start:]],
+            **{column: listing[column][row_start:].tolist() for column, _ in COMPACT_LISTING_COLUMNS[1:-1]},
+            'fid': format_file_ids(listing['fid'][row_start:], prefix),
+        },
+    }
+
+
+def iter_library_scan_fragments(roots, batch_size=STREAM_BATCH_SIZE, flush_interval=STREAM_FLUSH_INTERVAL):
+    """Rescan roots one after another, yielding compact listing fragments while the walk is still running.
+
+    Concatenating the fragments gives the same data as merge_compact_listings(); each
+    root's shard is stored as soon as its walk finishes.
+    """
+    scan_started = time.perf_counter()
+    dir_offset = 0
+    total = 0
+    for alias, root_dir in roots:
+        started = time.perf_counter()
+        listing = new_compact_listing()
+        prefix = get_library_root_prefix(alias)
+        sent_dirs = sent_rows = 0
+        last_sent = started
+        for _ in fill_compact_listing(root_dir, listing):
+            pending = len(listing['name']) - sent_rows
+            if pending >= batch_size or time.perf_counter() - last_sent >= flush_interval:
+                yield compact_listing_fragment(listing, prefix, dir_offset, sent_dirs, sent_rows)
+                sent_dirs, sent_rows = len(listing['dirs']), len(listing['name'])
+                last_sent = time.perf_counter()
+        if len(listing['name']) > sent_rows or len(listing['dirs']) > sent_dirs:
+            yield compact_listing_fragment(listing, prefix, dir_offset, sent_dirs, sent_rows)
+        store_library_shard(alias, root_dir, listing, time.perf_counter() - started)
+        dir_offset += len(listing['dirs'])
+        total += len(listing['name'])
+    record_scan_metrics(time.perf_counter() - scan_started, total)
+
+# Persistent per-root caches (listing, metadata index, thumbnails) live in this folder
+CACHE_DIR_NAME = '.ddr-cache'
+LISTING_CACHE_FILENAME = 'listing.json'
+METADATA_INDEX_FILENAME = 'metadata-index.json'
+METADATA_INDEX_VERSION = 2
+METADATA_INDEXES = {}
+METADATA_INDEX_LOCK = threading.Lock()
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+MAX_PNG_TEXT_CHUNK = 8 * 1024 * 1024
+# Integrity checks: bump the version when checks change so indexed files are re-verified once
+INTEGRITY_CHECK_VERSION = 1
+INTEGRITY_READ_BLOCK = 1024 * 1024
+INTEGRITY_JPEG_TAIL = 1024
+INTEGRITY_REPORT_LIMIT = 20
+INTEGRITY_READ_SLOTS = None  # Semaphore shared by index worker processes to bound concurrent reads
+
+# Same fields and display names as parseAIParameters()/formatMetadataForDisplay() in ddr.html
+AI_PARAMETER_NAMES = [
+    'Hires Distilled CFG Scale',
+    'Distilled CFG Scale',
+    'Hires CFG Scale',
+    'Schedule type',
+    'Negative prompt',
+    'Hires upscaler',
+    'Hires upscale',
+    'Hires steps',
+    'Hires prompt',
+    'Model hash',
+    'Denoising strength',
+    'CFG scale',
+    'Clip skip',
+    'Sampler',
+    'Steps',
+    'Seed',
+    'Size',
+    'Model',
+    'Version',
+    'RNG',
+    'Lora hashes',
+]
+AI_PARAMETER_DISPLAY_NAMES = {
+    'Negative prompt': 'Negative Prompt',
+    'CFG scale': 'CFG Scale',
+    'Schedule type': 'Schedule Type',
+    'Hires upscaler': 'Hires Upscaler',
+    'Denoising strength': 'Denoising Strength',
+    'Clip skip': 'Clip Skip',
+}
+METADATA_DISPLAY_FIELDS = [
+    'Prompt', 'Negative Prompt', 'Model', 'Sampler', 'Schedule Type',
+    'Size', 'Steps', 'Hires steps', 'CFG Scale', 'Distilled CFG Scale', 'Denoising Strength',
+    'Hires CFG Scale', 'Hires Upscaler', 'Seed', 'Clip Skip', 'Loras',
+]
+NEGATIVE_PROMPT_END_NAMES = 'Steps|Sampler|CFG|Seed|Size|Model|Schedule|Denoising|Hires|Version|Clip|RNG|Lora|ADetailer'
+
+
+def read_png_text_chunks(file_path):
+    """Read tEXt/zTXt/iTXt chunks from a PNG without loading image data."""
+    metadata = {}
+    with open(file_path, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return metadata
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IEND':
+                break
+            if chunk_type not in (b'tEXt', b'zTXt', b'iTXt') or length > MAX_PNG_TEXT_CHUNK:
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+            data = f.read(length)
+            if len(data) < length:
+                break
+            f.seek(4, os.SEEK_CUR)  # CRC
+
+            keyword, sep, rest = data.partition(b'\x00')
+            if not sep:
+                continue
+            try:
+                if chunk_type == b'tEXt':
+                    raw_value = rest
+                elif chunk_type == b'zTXt':
+                    raw_value = zlib.decompress(rest[1:])
+                else:
+                    compressed, rest = rest[:1] == b'\x01', rest[2:]
+                    _, _, rest = rest.partition(b'\x00')  # language tag
+                    _, _, raw_value = rest.partition(b'\x00')  # translated keyword
+                    if compressed:
+                        raw_value = zlib.decompress(raw_value)
+            except zlib.error:
+                continue
+            try:
+                value = raw_value.decode('utf-8')
+            except UnicodeDecodeError:
+                value = raw_value.decode('latin-1')
+            key = keyword.decode('latin-1')
+            if key and value:
+                metadata[key] = value
+    return metadata
+
+
+read_png_text_chunks = time_hot_function('png_chunks', read_png_text_chunks)
+
+
+def read_image_dimensions(file_path):
+    """Return (width, height) from the file header, or (None, None) if unknown."""
+    with open(file_path, 'rb') as f:
+        head = f.read(32)
+        if head[:8] == PNG_SIGNATURE and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+            chunk = head[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', head[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L':
+                b0, b1, b2, b3 = head[21:25]
+                return 1 + (((b1 & 0x3F) << 8) | b0), 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+            if chunk == b'VP8X':
+                return 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+        if head[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                byte = f.read(1)
+                while byte and byte != b'\xff':
+                    byte = f.read(1)
+                while byte == b'\xff':
+                    byte = f.read(1)
+                if not byte:
+                    break
+                marker = byte[0]
+                if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                    continue
+                segment = f.read(2)
+                if len(segment) < 2:
+                    break
+                segment_length = struct.unpack('>H', segment)[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    frame = f.read(5)
+                    if len(frame) < 5:
+                        break
+                    height, width = struct.unpack('>xHH', frame)
+                    return width, height
+                f.seek(segment_length - 2, os.SEEK_CUR)
+    return None, None
+
+
+def verify_png_file(f, file_size):
+    """Walk every chunk, checking it fits in the file and matches its CRC, up to IEND."""
+    if f.read(8) != PNG_SIGNATURE:
+        return 'Not a PNG signature'
+    offset = 8
+    while True:
+        header = f.read(8)
+        if not header:
+            return 'Missing IEND chunk'
+        if len(header) < 8:
+            return f'Truncated chunk header at byte {offset}'
+        length, chunk_type = struct.unpack('>I4s', header)
+        name = chunk_type.decode('latin-1')
+        if offset == 8 and chunk_type != b'IHDR':
+            return 'First chunk is not IHDR'
+        if offset + 12 + length > file_size:
+            return f'Truncated {name} chunk at byte {offset}'
+        crc = zlib.crc32(chunk_type)
+        remaining = length
+        while remaining:
+            block = f.read(min(remaining, INTEGRITY_READ_BLOCK))
+            if not block:
+                return f'Truncated {name} chunk at byte {offset}'
+            crc = zlib.crc32(block, crc)
+            remaining -= len(block)
+        stored = f.read(4)
+        if len(stored) < 4:
+            return f'Truncated {name} chunk at byte {offset}'
+        if struct.unpack('>I', stored)[0] != crc:
+            return f'CRC mismatch in {name} chunk at byte {offset}'
+        if chunk_type == b'IEND':
+            return None
+        offset += 12 + length
+
+
+def verify_jpeg_file(f, file_size):
+    """Marker segments up to the first scan must fit in the file, and the scan must end with EOI."""
+    if f.read(2) != b'\xff\xd8':
+        return 'Missing JPEG SOI marker'
+    offset = 2
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2:
+            return f'Truncated marker at byte {offset}'
+        if marker[0] != 0xFF:
+            return f'Invalid marker at byte {offset}'
+        if marker[1] == 0xFF:  # Fill byte
+            f.seek(-1, os.SEEK_CUR)
+            offset += 1
+            continue
+        if marker[1] == 0xD9:
+            return 'No scan data before EOI'
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            offset += 2
+            continue
+        segment = f.read(2)
+        length = struct.unpack('>H', segment)[0] if len(segment) == 2 else 0
+        if length < 2 or offset + 2 + length > file_size:
+            return f'Truncated segment 0x{marker[1]:02X} at byte {offset}'
+        if marker[1] == 0xDA:
+            break
+        f.seek(length - 2, os.SEEK_CUR)
+        offset += 2 + length
+    # Entropy-coded data is not parsed; a complete file ends with EOI (some encoders pad after it)
+    f.seek(max(0, file_size - INTEGRITY_JPEG_TAIL))
+    if b'\xff\xd9' not in f.read():
+        return 'Missing JPEG EOI marker'
+    return None
+
+
+def verify_webp_file(f, file_size):
+    """The RIFF size must fit in the file and every chunk must fit in the RIFF, with image data present."""
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WEBP':
+        return 'Not a WebP RIFF header'
+    end = struct.unpack('<I', header[4:8])[0] + 8
+    if end > file_size:
+        return f'Truncated: RIFF declares {end} bytes, file has {file_size}'
+    offset = 12
+    has_image = False
+    while offset + 8 <= end:
+        f.seek(offset)
+        chunk_type, length = struct.unpack('<4sI', f.read(8))
+        if offset + 8 + length > end:
+            return f'Truncated {chunk_type.decode("latin-1")} chunk at byte {offset}'
+        if chunk_type in (b'VP8 ', b'VP8L', b'ANMF'):
+            has_image = True
+        offset += 8 + length + (length & 1)
+    if not has_image:
+        return 'No image data chunk'
+    return None
+
+
+INTEGRITY_VERIFIERS = {
+    '.png': verify_png_file,
+    '.jpg': verify_jpeg_file,
+    '.jpeg': verify_jpeg_file,
+    '.webp': verify_webp_file,
+}
+
+
+def verify_image_integrity(file_path):
+    """None when the file is structurally complete, else what is wrong (PNG, JPEG and WebP only)."""
+    verifier = INTEGRITY_VERIFIERS.get(os.path.splitext(file_path)[1].lower())
+    if verifier is None:
+        return None
+    if INTEGRITY_READ_SLOTS is not None:
+        INTEGRITY_READ_SLOTS.acquire()
+    try:
+        with open(file_path, 'rb') as f:
+            return verifier(f, os.fstat(f.fileno()).st_size)
+    finally:
+        if INTEGRITY_READ_SLOTS is not None:
+            INTEGRITY_READ_SLOTS.release()
+
+
+def init_index_worker(read_slots):
+    global INTEGRITY_READ_SLOTS
+    INTEGRITY_READ_SLOTS = read_slots
+
+
+def _truncate_after_last_lora(prompt_text):
+    if re.search(r'<lora:[^>]+>', prompt_text, re.IGNORECASE):
+        last_lora_index = prompt_text.rfind('>')
+        if last_lora_index >= 0:
+            return prompt_text[:last_lora_index + 1].strip()
+    return prompt_text
+
+
+def parse_ai_parameters(parameters_text):
+    """Port of parseAIParameters() in ddr.html; keep the two in sync."""
+    if not parameters_text:
+        return {}
+    result = {}
+    text = re.sub(r'^parameters\s*', '', parameters_text, flags=re.IGNORECASE).strip()
+
+    negative_match = re.search(r'\n\s*Negative prompt\s*:?\s*', text, re.IGNORECASE)
+    if not negative_match:
+        negative_match = re.search(r'(?:^|,\s*)Negative prompt\s*:?\s*', text, re.IGNORECASE)
+    if negative_match:
+        check_start = max(0, negative_match.start() - 30)
+        if 'adetailer' in text[check_start:negative_match.start()].lower():
+            negative_match = None
+    negative_index = negative_match.start() if negative_match else -1
+
+    if negative_index > 0:
+        positive_prompt = _truncate_after_last_lora(text[:negative_index].strip())
+        if positive_prompt:
+            result['Prompt'] = positive_prompt
+
+        negative_start = negative_match.end()
+        negative_end = len(text)
+        remainder = text[negative_start:]
+        next_param = re.search(r'\n\s*(' + NEGATIVE_PROMPT_END_NAMES + r')\s*:', remainder, re.IGNORECASE)
+        if not next_param:
+            next_param = re.search(r',\s*(' + NEGATIVE_PROMPT_END_NAMES + r')\s*:', remainder, re.IGNORECASE)
+        if next_param:
+            negative_end = negative_start + next_param.start()
+        negative_value = text[negative_start:negative_end].strip()
+        negative_value = re.sub(r'\n\s*$', '', re.sub(r',\s*$', '', negative_value)).strip()
+        if negative_value:
+            result['Negative Prompt'] = negative_value
+    else:
+        starts_with_param = any(
+            re.match(re.escape(name) + r'\s*:', text, re.IGNORECASE) for name in AI_PARAMETER_NAMES
+        )
+        if not starts_with_param and text:
+            first_param_index = len(text)
+            for name in AI_PARAMETER_NAMES:
+                match = re.search(r'\b' + re.escape(name) + r'\s*:', text, re.IGNORECASE)
+                if match and match.start() < first_param_index:
+                    first_param_index = match.start()
+            prompt_text = text[:first_param_index].strip() if first_param_index < len(text) else text
+            prompt_text = _truncate_after_last_lora(prompt_text)
+            if prompt_text:
+                result['Prompt'] = prompt_text
+
+    loras = re.findall(r'<lora:[^>]+>', text, re.IGNORECASE)
+    if loras:
+        result['Loras'] = ' '.join(dict.fromkeys(loras))
+
+    all_params = []
+    for match in re.finditer(r'(?:^|,\s*|\n\s*|>\s*)([A-Za-z][^:\n,]*?)\s*:', text):
+        full_match = match.group(0)
+        index_offset = 0
+        if full_match.startswith(','):
+            index_offset = 1
+        elif full_match.startswith('\n') or full_match.startswith('>'):
+            non_space = re.search(r'\S', full_match)
+            index_offset = non_space.start() if non_space else 0
+        all_params.append({
+            'name': match.group(1).strip(),
+            'index': match.start() + index_offset,
+            'colon': match.end() - 1,
+        })
+
+    for param_name in AI_PARAMETER_NAMES:
+        for i, param in enumerate(all_params):
+            if param['name'].lower() != param_name.lower():
+                continue
+            value_start = param['colon'] + 1
+            while value_start < len(text) and text[value_start].isspace():
+                value_start += 1
+            value_end = len(text)
+            for next_param in all_params[i + 1:]:
+                next_index = next_param['index']
+                comma_before = text.rfind(',', 0, next_index + 1)
+                newline_before = text.rfind('\n', 0, next_index + 1)
+                if 'adetailer' in next_param['name'].lower():
+                    if value_start < comma_before < next_index:
+                        value_end = comma_before
+                        break
+                    if value_start < newline_before < next_index:
+                        value_end = newline_before
+                        break
+                    if next_index > value_start:
+                        value_end = next_index
+                        break
+                    continue
+                if value_start < comma_before < next_index:
+                    value_end = comma_before
+                    break
+                if value_start < newline_before < next_index:
+                    text_between = text[newline_before + 1:next_index].strip()
+                    if len(text_between) < 50 and (comma_before <= value_start or newline_before < comma_before):
+                        value_end = newline_before
+                        break
+                if next_index > value_start:
+                    value_end = next_index
+                    break
+
+            value = text[value_start:value_end].strip()
+            value = re.sub(r'\n\s*$', '', re.sub(r',\s*$', '', value)).strip()
+            if value:
+                display_key = AI_PARAMETER_DISPLAY_NAMES.get(param_name, param_name)
+                if 'adetailer' not in display_key.lower() and display_key not in result:
+                    result[display_key] = value
+    return result
+
+
+parse_ai_parameters = time_hot_function('parse_parameters', parse_ai_parameters)
+
+
+def format_metadata_fields(raw_metadata):
+    parsed = parse_ai_parameters(raw_metadata.get('parameters', '')) if raw_metadata else {}
+    return {key: parsed[key] for key in METADATA_DISPLAY_FIELDS if key in parsed}
+
+
+def get_cache_dir(root_dir):
+    return os.path.join(root_dir, CACHE_DIR_NAME)
+
+
+def get_thumbnail_path(root_dir, file_id):
+    name = f"{file_id:016x}"
+    return os.path.join(get_cache_dir(root_dir), 'thumbs', name[-2:], name + '.jpg')
+
+
+def file_signature(stat_result):
+    return stat_result.st_size, stat_result.st_mtime_ns // 1_000_000
+
+
+# Stable file ids: the inode number (st_ino; the file index on NTFS) survives renames and
+# moves within a volume, so the listing, metadata index, thumbnails and tiles key off it and
+# a moved file keeps its derived data. Files on another device below the root hash
+# (device, inode). Without inode numbers, or with index.fileIds set to "content" (e.g. for
+# folders a sync tool rewrites), the id fingerprints the size plus the first and last blocks.
+FILE_ID_SAMPLE_BYTES = 64 * 1024
+ROOT_DEVICES = {}
+
+
+def uses_content_file_ids():
+    return (get_app_config().get('index', {}) or {}).get('fileIds') == 'content'
+
+
+def get_root_device(root_dir):
+    device = ROOT_DEVICES.get(root_dir)
+    if device is None:
+        try:
+            device = os.stat(root_dir).st_dev
+        except OSError:
+            device = 0
+        ROOT_DEVICES[root_dir] = device
+    return device
+
+
+def get_content_file_id(file_path, size):
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=8)
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(FILE_ID_SAMPLE_BYTES))
+        if size > FILE_ID_SAMPLE_BYTES:
+            f.seek(max(FILE_ID_SAMPLE_BYTES, size - FILE_ID_SAMPLE_BYTES))
+            digest.update(f.read(FILE_ID_SAMPLE_BYTES))
+    return int.from_bytes(digest.digest(), 'big')
+
+
+def get_file_id(root_dir, file_path, size, dev=0, ino=0, content=None):
+    """64-bit id of a file below root_dir; dev/ino may come from a scandir stat (0 = unknown)."""
+    if content is None:
+        content = uses_content_file_ids()
+    if not content:
+        if not ino:
+            stat_result = os.stat(file_path)
+            dev, ino = stat_result.st_dev, stat_result.st_ino
+        if ino:
+            if not dev or dev == get_root_device(root_dir):
+                return ino & 0xFFFFFFFFFFFFFFFF
+            return int.from_bytes(hashlib.blake2b(f"{dev}:{ino}".encode('ascii'), digest_size=8).digest(), 'big')
+    return get_content_file_id(file_path, size)
+
+
+def get_indexed_file_id(root_dir, relative_path, file_path, stat_result):
+    """File id from a fresh metadata index entry when there is one, else computed."""
+    entry = get_metadata_index(root_dir).get(relative_path)
+    if is_index_entry_fresh(entry, stat_result) and 'fid' in entry:
+        return entry['fid']
+    return get_file_id(root_dir, file_path, stat_result.st_size, stat_result.st_dev, stat_result.st_ino)
+
+
+def format_file_ids(file_ids, prefix=''):
+    """Ids as the client sees them: hex strings (JS numbers lose 64-bit precision), root-prefixed."""
+    return [f"{prefix}{file_id:x}" for file_id in file_ids]
+
+
+def is_index_entry_fresh(entry, stat_result):
+    return bool(entry) and (entry.get('size'), entry.get('mtime')) == file_signature(stat_result)
+
+
+def write_thumbnail(source_path, target_path, size):
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    with get_pil_image().open(source_path) as im:
+        im.draft('RGB', (size, size))
+        im.thumbnail((size, size))
+        if im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        temp_path = target_path + '.tmp'
+        im.save(temp_path, 'JPEG', quality=82)
+    os.replace(temp_path, target_path)
+
+
+def add_integrity_result(entry, file_path):
+    """Record a verification of the file in its index entry ('corrupt' holds the problem, if any)."""
+    problem = verify_image_integrity(file_path)
+    entry.pop('corrupt', None)
+    entry['verified'] = INTEGRITY_CHECK_VERSION
+    if problem:
+        entry['corrupt'] = problem
+    return entry
+
+
+def extract_index_entry(root_dir, relative_path, thumbnail_size=0, content_ids=None, verify=False):
+    """Build one metadata index entry (file id, dimensions, parsed parameters, integrity, optional thumbnail)."""
+    file_path = os.path.join(root_dir, relative_path.replace('/', os.sep))
+    stat_result = os.stat(file_path)
+    size, mtime = file_signature(stat_result)
+    file_id = get_file_id(root_dir, file_path, stat_result.st_size, stat_result.st_dev, stat_result.st_ino, content_ids)
+    entry = {'size': size, 'mtime': mtime, 'fid': file_id}
+    if verify:
+        add_integrity_result(entry, file_path)
+    try:
+        width, height = read_image_dimensions(file_path)
+        if width and height:
+            entry['width'] = width
+            entry['height'] = height
+        if relative_path.lower().endswith('.png'):
+            fields = format_metadata_fields(read_png_text_chunks(file_path))
+            if fields:
+                entry['fields'] = fields
+    except Exception as e:
+        entry['error'] = f"{type(e).__name__}: {e}"
+        return entry
+    if thumbnail_size and get_pil_image() is not None:
+        try:
+            write_thumbnail(file_path, get_thumbnail_path(root_dir, file_id), thumbnail_size)
+            entry['thumb'] = thumbnail_size
+        except Exception as e:
+            entry['thumbError'] = f"{type(e).__name__}: {e}"
+    return entry
+
+
+def index_image_worker(task):
+    root_dir, relative_path, thumbnail_size, content_ids, verify, fresh_entry = task
+    try:
+        if fresh_entry is not None:
+            # Up to date except for verification: check the file, keep everything else
+            file_path = os.path.join(root_dir, relative_path.replace('/', os.sep))
+            return relative_path, add_integrity_result(fresh_entry, file_path)
+        return relative_path, extract_index_entry(root_dir, relative_path, thumbnail_size, content_ids, verify)
+    except OSError:
+        return relative_path, None
+
+
+def get_metadata_index_path(root_dir):
+    return os.path.join(get_cache_dir(root_dir), METADATA_INDEX_FILENAME)
+
+
+def read_metadata_index_file(root_dir):
+    index_path = get_metadata_index_path(root_dir)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data.get('version') == METADATA_INDEX_VERSION:
+            return data.get('entries', {})
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"{format_timestamp()} WARNING: Ignoring unreadable metadata index {index_path}: {e}", file=sys.stderr)
+    return {}
+
+
+def save_metadata_index(root_dir, entries):
+    index_path = get_metadata_index_path(root_dir)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': METADATA_INDEX_VERSION, 'root': root_dir, 'entries': entries}, f, separators=(',', ':'))
+    os.replace(temp_path, index_path)
+
+
+def get_metadata_index(root_dir):
+    """Entries of a root's metadata index, reloaded whenever the indexer rewrites the file."""
+    try:
+        index_mtime = os.stat(get_metadata_index_path(root_dir)).st_mtime_ns
+    except OSError:
+        index_mtime = None
+    with METADATA_INDEX_LOCK:
+        cached = METADATA_INDEXES.get(root_dir)
+        if cached and cached['mtime'] == index_mtime:
+            return cached['entries']
+    entries = read_metadata_index_file(root_dir) if index_mtime else {}
+    with METADATA_INDEX_LOCK:
+        METADATA_INDEXES[root_dir] = {'mtime': index_mtime, 'entries': entries}
+    return entries
+
+
+def get_metadata_index_by_file_id(root_dir):
+    """{file id: entry} for a root's metadata index, built on first use per index version."""
+    entries = get_metadata_index(root_dir)
+    with METADATA_INDEX_LOCK:
+        cached = METADATA_INDEXES.get(root_dir)
+        if cached is None or cached['entries'] is not entries:
+            return {entry['fid']: entry for entry in entries.values() if 'fid' in entry}
+        if 'byFileId' not in cached:
+            cached['byFileId'] = {entry['fid']: entry for entry in entries.values() if 'fid' in entry}
+        return cached['byFileId']
+
+
+def get_indexed_thumbnail_path(root_dir, relative_path, source_path, source_stat):
+    """Thumbnail of a file whose index entry (by path, else by file id after a move) still matches it.
+
+    An entry for a recycled inode has another size/mtime, so it never serves the old file's thumbnail.
+    """
+    entry = get_metadata_index(root_dir).get(relative_path)
+    if not is_index_entry_fresh(entry, source_stat):
+        file_id = get_file_id(root_dir, source_path, source_stat.st_size, source_stat.st_dev, source_stat.st_ino)
+        entry = get_metadata_index_by_file_id(root_dir).get(file_id)
+    if is_index_entry_fresh(entry, source_stat) and entry.get('thumb') and 'fid' in entry:
+        return get_thumbnail_path(root_dir, entry['fid'])
+    return None
+
+
+def lookup_indexed_metadata(library_paths):
+    """Return {path: entry} for paths whose index entry still matches the file on disk."""
+    found = {}
+    for library_path in library_paths:
+        if not isinstance(library_path, str):
+            continue
+        _, root_dir, relative_path = split_library_path(library_path)
+        entry = get_metadata_index(root_dir).get(relative_path) if root_dir else None
+        fresh = False
+        if root_dir:
+            try:
+                file_path = os.path.join(root_dir, relative_path.replace('/', os.sep))
+                stat_result = os.stat(file_path)
+                if not is_index_entry_fresh(entry, stat_result):
+                    # Renamed or moved since indexing: same file id, new path
+                    file_id = get_indexed_file_id(root_dir, relative_path, file_path, stat_result)
+                    entry = get_metadata_index_by_file_id(root_dir).get(file_id)
+                fresh = is_index_entry_fresh(entry, stat_result) and 'error' not in entry
+            except OSError:
+                fresh = False
+        record_cache_lookup('metadata-index', fresh)
+        if fresh:
+            found[library_path] = {
+                'width': entry.get('width'),
+                'height': entry.get('height'),
+                'fields': entry.get('fields', {}),
+                'thumb': bool(entry.get('thumb')),
+            }
+    return found
+
+
+# Numeric query columns: the generation parameters of every indexed image, one array per
+# field per root (built once per metadata index version), so range/set filters and sorts
+# are vectorized masks and argsort over contiguous memory. Missing values are NaN (seed:
+# QUERY_SEED_MISSING) and never match a filter. Without numpy the same columns are
+# array('d'/'Q') and the filters run as a Python loop.
+QUERY_NUMERIC_FIELDS = {
+    'steps': 'Steps',
+    'cfg': 'CFG Scale',
+    'distilledCfg': 'Distilled CFG Scale',
+    'denoise': 'Denoising Strength',
+    'seed': 'Seed',
+    'width': None,
+    'height': None,
+}
+QUERY_SEED_MISSING = 0xFFFFFFFFFFFFFFFF
+QUERY_MAX_SET_VALUES = 10000
+
+
+def parse_query_number(value):
+    try:
+        number = float(str(value).strip())
+    except (TypeError, ValueError):
+        return math.nan
+    return number if math.isfinite(number) else math.nan
+
+
+def parse_query_seed(value):
+    try:
+        seed = int(str(value).strip())
+    except (TypeError, ValueError):
+        return QUERY_SEED_MISSING
+    return seed if 0 <= seed < QUERY_SEED_MISSING else QUERY_SEED_MISSING
+
+
+def build_query_columns(entries, prefix):
+    paths = []
+    values = {field: [] for field in QUERY_NUMERIC_FIELDS}
+    for relative_path, entry in entries.items():
+        if 'error' in entry:
+            continue
+        fields = entry.get('fields') or {}
+        paths.append(prefix + relative_path)
+        for field, display_name in QUERY_NUMERIC_FIELDS.items():
+            raw = entry.get(field) if display_name is None else fields.get(display_name)
+            values[field].append(parse_query_seed(raw) if field == 'seed' else parse_query_number(raw))
+    np = get_numpy()
+    columns = {'paths': paths, 'prefix': prefix}
+    for field, column in values.items():
+        if np is not None:
+            columns[field] = np.array(column, dtype=np.uint64 if field == 'seed' else np.float64)
+        else:
+            columns[field] = array('Q' if field == 'seed' else 'd', column)
+    return columns
+
+
+def get_query_columns(root_dir, prefix):
+    entries = get_metadata_index(root_dir)
+    with METADATA_INDEX_LOCK:
+        cached = METADATA_INDEXES.get(root_dir)
+        columns = cached.get('queryColumns') if cached and cached['entries'] is entries else None
+    if columns is not None and columns['prefix'] == prefix:
+        return columns
+    columns = build_query_columns(entries, prefix)
+    with METADATA_INDEX_LOCK:
+        cached = METADATA_INDEXES.get(root_dir)
+        if cached and cached['entries'] is entries:
+            cached['queryColumns'] = columns
+    return columns
+
+
+def normalize_query_filters(filters):
+    """Validate {field: {min, max, in}} into {field: (min or None, max or None, values or None)}."""
+    if not isinstance(filters, dict):
+        raise ValueError('filters must be an object')
+    normalized = {}
+    for field, spec in filters.items():
+        if field not in QUERY_NUMERIC_FIELDS:
+            raise ValueError(f'Unknown filter field: {field}')
+        if not isinstance(spec, dict):
+            raise ValueError(f'Filter for {field} must be an object')
+        low = spec.get('min')
+        high = spec.get('max')
+        members = spec.get('in')
+        low = None if low is None or low == '' else float(low)
+        high = None if high is None or high == '' else float(high)
+        if members is not None:
+            if not isinstance(members, list) or len(members) > QUERY_MAX_SET_VALUES:
+                raise ValueError(f'{field}.in must be a list of at most {QUERY_MAX_SET_VALUES} values')
+            parse = parse_query_seed if field == 'seed' else parse_query_number
+            members = [value for value in (parse(member) for member in members)
+                       if value != QUERY_SEED_MISSING and value == value]
+        if low is not None or high is not None or members is not None:
+            normalized[field] = (low, high, members)
+    return normalized
+
+
+def select_query_rows(columns, filters):
+    """Row numbers of a root's columns that pass every filter (numpy index array, or a list)."""
+    np = get_numpy()
+    count = len(columns['paths'])
+    if np is not None:
+        mask = np.ones(count, dtype=bool)
+        for field, (low, high, members) in filters.items():
+            column = columns[field]
+            if field == 'seed':
+                mask &= column != QUERY_SEED_MISSING
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+            if members is not None:
+                mask &= np.isin(column, np.array(members, dtype=column.dtype))
+        return np.flatnonzero(mask)
+
+    checks = []
+    for field, (low, high, members) in filters.items():
+        checks.append((columns[field], field == 'seed', low, high, set(members) if members is not None else None))
+    rows = []
+    for row in range(count):
+        for column, is_seed, low, high, members in checks:
+            value = column[row]
+            if (value == QUERY_SEED_MISSING if is_seed else value != value):
+                break
+            if (low is not None and value < low) or (high is not None and value > high):
+                break
+            if members is not None and value not in members:
+                break
+        else:
+            rows.append(row)
+    return rows
+
+
+def get_scope_roots(scope=''):
+    """(roots, path prefix) for a library scope; the prefix is None for the whole library."""
+    roots = get_library_roots()
+    if not scope:
+        return roots, None
+    scope_alias, _, scope_dir = split_library_scope(scope)
+    roots = [(alias, root_dir) for alias, root_dir in roots if alias == scope_alias]
+    return roots, get_library_root_prefix(scope_alias) + (scope_dir + '/' if scope_dir else '')
+
+
+def query_library(filters=None, sort=None, descending=False, limit=None, scope=''):
+    """Paths of indexed images matching numeric filters, optionally sorted by a numeric field."""
+    started = time.perf_counter()
+    filters = normalize_query_filters(filters or {})
+    if sort is not None and sort not in QUERY_NUMERIC_FIELDS:
+        raise ValueError(f'Unknown sort field: {sort}')
+    roots, scope_prefix = get_scope_roots(scope)
+    np = get_numpy()
+    paths = []
+    keys = []
+    indexed = 0
+    for alias, root_dir in roots:
+        columns = get_query_columns(root_dir, get_library_root_prefix(alias))
+        indexed += len(columns['paths'])
+        rows = select_query_rows(columns, filters)
+        root_paths = columns['paths']
+        if scope_prefix:
+            rows = [row for row in (rows.tolist() if np is not None else rows) if root_paths[row].startswith(scope_prefix)]
+        paths.extend(root_paths[row] for row in rows)
+        if sort is not None:
+            keys.append(columns[sort][rows] if np is not None else [columns[sort][row] for row in rows])
+
+    if sort is not None and paths:
+        missing_value = QUERY_SEED_MISSING if sort == 'seed' else None
+        if np is not None:
+            key = np.concatenate(keys)
+            missing = key == missing_value if missing_value is not None else np.isnan(key)
+            # Descending sorts on an order-reversing key (~ for the uint64 seed column) rather
+            # than reversing the result, so ties keep library order both ways, as sorted() does
+            if descending:
+                key = ~key if sort == 'seed' else -key
+            order = np.argsort(key, kind='stable')
+            # Images without the field go last in either direction
+            order = np.concatenate((order[~missing[order]], order[missing[order]]))
+            paths = [paths[row] for row in order.tolist()]
+        else:
+            key = [value for part in keys for value in part]
+            def is_missing(value):
+                return value == missing_value if missing_value is not None else value != value
+            present = sorted((row for row in range(len(key)) if not is_missing(key[row])),
+                             key=key.__getitem__, reverse=descending)
+            paths = [paths[row] for row in present] + [paths[row] for row in range(len(key)) if is_missing(key[row])]
+
+    count = len(paths)
+    if limit:
+        paths = paths[:max(0, int(limit))]
+    return {
+        'paths': paths,
+        'count': count,
+        'indexed': indexed,
+        'engine': 'numpy' if np is not None else 'array',
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def get_query_field_ranges():
+    """{field: {min, max, count}} over all indexed images, for filter placeholders."""
+    np = get_numpy()
+    ranges = {}
+    all_columns = [get_query_columns(root_dir, get_library_root_prefix(alias)) for alias, root_dir in get_library_roots()]
+    for field in QUERY_NUMERIC_FIELDS:
+        low = high = None
+        count = 0
+        for columns in all_columns:
+            column = columns[field]
+            if np is not None:
+                present = column[column != QUERY_SEED_MISSING] if field == 'seed' else column[~np.isnan(column)]
+                if present.size:
+                    low = present.min().item() if low is None else min(low, present.min().item())
+                    high = present.max().item() if high is None else max(high, present.max().item())
+                    count += int(present.size)
+            else:
+                present = [value for value in column if (value != QUERY_SEED_MISSING if field == 'seed' else value == value)]
+                if present:
+                    low = min(present) if low is None else min(low, min(present))
+                    high = max(present) if high is None else max(high, max(present))
+                    count += len(present)
+        ranges[field] = {'min': low, 'max': high, 'count': count}
+    return ranges
+
+
+def list_corrupt_files(scope=''):
+    """Indexed images whose last integrity check failed and that have not changed since."""
+    roots, scope_prefix = get_scope_roots(scope)
+    files = []
+    indexed = verified = 0
+    for alias, root_dir in roots:
+        prefix = get_library_root_prefix(alias)
+        for relative_path, entry in get_metadata_index(root_dir).items():
+            library_path = prefix + relative_path
+            if scope_prefix and not library_path.startswith(scope_prefix):
+                continue
+            indexed += 1
+            if entry.get('verified') != INTEGRITY_CHECK_VERSION:
+                continue
+            verified += 1
+            if 'corrupt' not in entry:
+                continue
+            try:
+                stat_result = os.stat(os.path.join(root_dir, relative_path.replace('/', os.sep)))
+            except OSError:
+                continue
+            if is_index_entry_fresh(entry, stat_result):
+                files.append({'path': library_path, 'error': entry['corrupt'], 'size': entry['size']})
+    files.sort(key=lambda item: item['path'])
+    return {'files': files, 'count': len(files), 'verified': verified, 'indexed': indexed}
+
+
+def report_corrupt_entries(root_dir, entries, scope=''):
+    corrupt = sorted(
+        (path, entry['corrupt']) for path, entry in entries.items()
+        if 'corrupt' in entry and is_in_scope(path.rpartition('/')[0], scope)
+    )
+    if not corrupt:
+        return
+    print(f"{format_timestamp()}DARKROOM WARNING: {len(corrupt)} corrupt files in {root_dir}:", file=sys.stderr)
+    for path, problem in corrupt[:INTEGRITY_REPORT_LIMIT]:
+        print(f"  {path}: {problem}", file=sys.stderr)
+    if len(corrupt) > INTEGRITY_REPORT_LIMIT:
+        print(f"  ... and {len(corrupt) - INTEGRITY_REPORT_LIMIT} more (GET /corrupt-files lists all)", file=sys.stderr)
+
+
+def index_library_root(root_dir, jobs=None, thumbnail_size=0, force=False, checkpoint_every=500, scope='',
+                       verify=True, read_jobs=2):
+    """Index one library root (or only its scope folder) into <root>/.ddr-cache. Safe to interrupt; the next run resumes."""
+    root_dir = os.path.abspath(root_dir)
+    entries = {} if force and not scope else read_metadata_index_file(root_dir)
+    files = scan_root_images(root_dir, scope)
+    present = set(files)
+    pruned = [path for path in entries if path not in present and is_in_scope(path.rpartition('/')[0], scope)]
+    moved_entries = {entries[path]['fid']: entries[path] for path in pruned if 'fid' in entries[path]}
+    for path in pruned:
+        del entries[path]
+
+    content_ids = uses_content_file_ids()
+    tasks = []
+    moved = 0
+    for relative_path in files:
+        file_path = os.path.join(root_dir, relative_path.replace('/', os.sep))
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            continue
+        entry = entries.get(relative_path)
+        if entry is None and moved_entries:
+            # A renamed/moved file keeps its entry (and thumbnail) under its new path
+            try:
+                file_id = get_file_id(root_dir, file_path, stat_result.st_size, stat_result.st_dev, stat_result.st_ino, content_ids)
+            except OSError:
+                continue
+            entry = moved_entries.pop(file_id, None)
+            if entry is not None:
+                entries[relative_path] = entry
+                moved += 1
+        wants_thumb = (thumbnail_size and get_pil_image() is not None and entry
+                       and entry.get('thumb') != thumbnail_size and 'thumbError' not in entry)
+        if not force and is_index_entry_fresh(entry, stat_result) and 'error' not in entry and not wants_thumb:
+            if verify and entry.get('verified') != INTEGRITY_CHECK_VERSION:
+                tasks.append((root_dir, relative_path, thumbnail_size, content_ids, verify, entry))
+            continue
+        tasks.append((root_dir, relative_path, thumbnail_size, content_ids, verify, None))
+
+    print(
+        f"{format_timestamp()}DARKROOM: Indexing {root_dir}: {len(files)} images, "
+        f"{len(files) - len(tasks)} up to date ({moved} moved), {len(tasks)} to process, "
+        f"{len(pruned) - moved} removed",
+        file=sys.stderr,
+    )
+    if not tasks:
+        if pruned:
+            save_metadata_index(root_dir, entries)
+        if verify:
+            report_corrupt_entries(root_dir, entries, scope)
+        return entries
+
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    started = time.perf_counter()
+    last_report = last_save = started
+    done = errors = corrupt = 0
+    pool = None
+    try:
+        if jobs == 1:
+            results = map(index_image_worker, tasks)
+        else:
+            import multiprocessing
+            # Verification reads whole files; the shared semaphore caps how many workers do so at once
+            read_slots = multiprocessing.Semaphore(max(1, min(jobs, read_jobs)))
+            pool = multiprocessing.Pool(processes=jobs, initializer=init_index_worker, initargs=(read_slots,))
+            results = pool.imap_unordered(index_image_worker, tasks, chunksize=16)
+        for relative_path, entry in results:
+            done += 1
+            if entry is None:
+                continue
+            if 'error' in entry:
+                errors += 1
+            if 'corrupt' in entry:
+                corrupt += 1
+            entries[relative_path] = entry
+            now = time.perf_counter()
+            if done % checkpoint_every == 0 or now - last_save >= 30:
+                save_metadata_index(root_dir, entries)
+                last_save = now
+            if now - last_report >= 2 or done == len(tasks):
+                rate = done / max(now - started, 1e-6)
+                print(
+                    f"{format_timestamp()}DARKROOM: Indexed {done}/{len(tasks)} "
+                    f"({done * 100 // len(tasks)}%) · {rate:.0f} files/s · {errors} errors · {corrupt} corrupt",
+                    file=sys.stderr,
+                )
+                last_report = now
+        if pool:
+            pool.close()
+            pool.join()
+    except KeyboardInterrupt:
+        if pool:
+            pool.terminate()
+        save_metadata_index(root_dir, entries)
+        print(f"\n{format_timestamp()}DARKROOM: Indexing interrupted after {done} files; progress saved, rerun to resume.", file=sys.stderr)
+        raise
+    save_metadata_index(root_dir, entries)
+    if verify:
+        report_corrupt_entries(root_dir, entries, scope)
+    return entries
+
+
+def run_index_command(base_dir=None, jobs=None, thumbnails=None, force=False, scope='', verify=None):
+    index_config = get_app_config().get('index', {})
+    if verify is None:
+        verify = bool(index_config.get('verifyIntegrity', True))
+    if thumbnails is None:
+        thumbnails = bool(index_config.get('thumbnails', True))
+    thumbnail_size = int(index_config.get('thumbnailSize', 512)) if thumbnails else 0
+    if thumbnail_size and get_pil_image() is None:
+        print(f"{format_timestamp()} WARNING: Pillow is not installed; skipping thumbnails.", file=sys.stderr)
+        thumbnail_size = 0
+
+    if base_dir:
+        roots = [os.path.abspath(base_dir)]
+    else:
+        runtime = load_runtime_config()
+        roots = [runtime['base_dir']] if runtime.get('base_dir') else []
+        roots.extend(entry['path'] for entry in runtime.get('library_roots', []) if isinstance(entry, dict) and entry.get('path'))
+    roots = [root for root in roots if os.path.isdir(root)]
+    if not roots:
+        print(f"{format_timestamp()} ERROR: No library folder to index. Pass --base-dir.", file=sys.stderr)
+        return 1
+
+    scope = (scope or '').replace('\\', '/').strip('/')
+    for root_dir in roots:
+        if scope and not os.path.isdir(os.path.join(root_dir, scope.replace('/', os.sep))):
+            print(f"{format_timestamp()}DARKROOM: Skipping {root_dir}: no folder {scope}", file=sys.stderr)
+            continue
+        index_library_root(
+            root_dir,
+            jobs=jobs,
+            thumbnail_size=thumbnail_size,
+            force=force,
+            checkpoint_every=max(1, int(index_config.get('checkpointEvery', 500))),
+            scope=scope,
+            verify=verify,
+            read_jobs=max(1, int(index_config.get('verifyReadJobs', 2))),
+        )
+    print(f"{format_timestamp()}DARKROOM: Indexing complete.", file=sys.stderr)
+    return 0
+
+
+# Deep-zoom tiles: images whose long side reaches tiles.minSize get a DZI-style pyramid
+# (level L is the image scaled by 2^(L - maxLevel), cut into tileSize squares, no overlap).
+# The pyramid is built once per file version under .ddr-cache/tiles, smallest levels first,
+# so the lightbox can show a placeholder right away and fetch only the tiles in view.
+TILE_JOBS = {}
+TILE_JOBS_LOCK = threading.Lock()
+TILE_FAILURES = {}  # cacheDir -> error of a failed build, so it is not retried on every request
+TILE_BUILD_LOCK = threading.Lock()  # One pyramid at a time: a 16K source decodes to ~1 GB
+TILE_PENDING = 'pending'
+TILE_RETRY_AFTER = 1
+
+
+def get_tile_settings():
+    return (get_app_config().get('tiles', {}) or {})
+
+
+def get_tile_source(library_path):
+    """Tiling info for a library image, or None when it is small, unreadable or Pillow is missing."""
+    settings = get_tile_settings()
+    if not settings.get('enabled', True) or get_pil_image() is None:
+        return None
+    _, root_dir, relative_path = split_library_path(library_path)
+    _, source_path = resolve_library_path(library_path)
+    if not source_path or not os.path.isfile(source_path):
+        return None
+    try:
+        width, height = read_image_dimensions(source_path)
+        stat_result = os.stat(source_path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not width or not height or max(width, height) < int(settings.get('minSize', 4096)):
+        return None
+    if width * height > int(settings.get('maxPixels', 1073741824)):
+        return None
+    tile_size = int(settings.get('tileSize', 512))
+    size, mtime = file_signature(stat_result)
+    try:
+        file_id = get_indexed_file_id(root_dir, relative_path, source_path, stat_result)
+    except OSError:
+        return None
+    digest = hashlib.sha1(f"{file_id:x}|{size}|{mtime}|{tile_size}".encode('utf-8')).hexdigest()
+    return {
+        'source': source_path,
+        'cacheDir': os.path.join(get_cache_dir(root_dir), 'tiles', digest[:2], digest),
+        'width': width,
+        'height': height,
+        'tileSize': tile_size,
+        'maxLevel': max(0, math.ceil(math.log2(max(width, height)))),
+        'version': f"{size}-{mtime}",
+    }
+
+
+def get_tile_path(cache_dir, level, x, y):
+    return os.path.join(cache_dir, str(level), f"{x}_{y}.jpg")
+
+
+def get_tile_level_size(tile_source, level):
+    """Pixel size of a pyramid level (each level halves the one above it, rounding up)."""
+    factor = 2 ** (tile_source['maxLevel'] - level)
+    return max(1, -(-tile_source['width'] // factor)), max(1, -(-tile_source['height'] // factor))
+
+
+def get_placeholder_tile_level(tile_source):
+    """Highest level that fits in one tile (what the lightbox shows first), as getPlaceholderTileLevel() in ddr.html."""
+    long_side = max(tile_source['width'], tile_source['height'])
+    return max(0, tile_source['maxLevel'] - math.ceil(math.log2(max(1, long_side / tile_source['tileSize']))))
+
+
+def write_tile_level(tile_source, level, level_image, quality):
+    cache_dir = tile_source['cacheDir']
+    tile_size = tile_source['tileSize']
+    width, height = level_image.size
+    os.makedirs(os.path.join(cache_dir, str(level)), exist_ok=True)
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            tile_path = get_tile_path(cache_dir, level, x // tile_size, y // tile_size)
+            level_image.crop((x, y, min(x + tile_size, width), min(y + tile_size, height))).save(
+                tile_path + '.tmp', 'JPEG', quality=quality)
+            os.replace(tile_path + '.tmp', tile_path)
+
+
+def open_tile_source_image(tile_source):
+    """Decode the full source as RGB. Pillow's decompression-bomb limit is raised to this
+    image's own size (already capped by tiles.maxPixels) for the open only."""
+    pil_image = get_pil_image()
+    previous_limit = pil_image.MAX_IMAGE_PIXELS
+    pil_image.MAX_IMAGE_PIXELS = max(previous_limit or 0, tile_source['width'] * tile_source['height'])
+    try:
+        im = pil_image.open(tile_source['source'])
+    finally:
+        pil_image.MAX_IMAGE_PIXELS = previous_limit
+    # load() reads the pixels and closes the file; the decoded image is used as is when
+    # already RGB rather than copied (a 16K copy is another ~800 MB)
+    im.load()
+    if im.mode == 'RGB':
+        return im
+    try:
+        return im.convert('RGB')
+    finally:
+        im.close()
+
+
+def build_tile_pyramid(tile_source):
+    """Decode the source once and write the pyramid, holding at most two levels in memory.
+
+    The placeholder level and the ones below it (all single tiles) go first, straight from a
+    downscale of the source, so the lightbox has something to show early; then the levels
+    are written top down, each halved from the previous one, which is freed once written.
+    """
+    pil_image = get_pil_image()
+    cache_dir = tile_source['cacheDir']
+    quality = int(get_tile_settings().get('quality', 85))
+    started = time.perf_counter()
+    try:
+        with TILE_BUILD_LOCK:
+            resample = getattr(pil_image, 'Resampling', pil_image).BOX
+            level_image = open_tile_source_image(tile_source)
+            placeholder_level = get_placeholder_tile_level(tile_source)
+            small = level_image.resize(get_tile_level_size(tile_source, placeholder_level), resample)
+            for level in range(placeholder_level, -1, -1):
+                if level < placeholder_level:
+                    small = small.resize(get_tile_level_size(tile_source, level), resample)
+                write_tile_level(tile_source, level, small, quality)
+            small = None
+            for level in range(tile_source['maxLevel'], placeholder_level, -1):
+                if level < tile_source['maxLevel']:
+                    level_image = level_image.resize(get_tile_level_size(tile_source, level), resample)
+                write_tile_level(tile_source, level, level_image, quality)
+            level_image = None
+        with open(os.path.join(cache_dir, 'complete'), 'w', encoding='utf-8') as f:
+            f.write(str(time.time()))
+        print(
+            f"{format_timestamp()}DARKROOM: Built {tile_source['maxLevel'] + 1}-level tile pyramid for "
+            f"{os.path.basename(tile_source['source'])} ({tile_source['width']}x{tile_source['height']}) "
+            f"in {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        with TILE_JOBS_LOCK:
+            TILE_FAILURES[cache_dir] = error
+        print(f"{format_timestamp()} ERROR: Tile pyramid failed for {tile_source['source']}: {error}", file=sys.stderr)
+    finally:
+        with TILE_JOBS_LOCK:
+            TILE_JOBS.pop(cache_dir, None)
+
+
+def start_tile_pyramid(tile_source):
+    """Start building a pyramid in the background unless it is built, building or failed.
+    Returns False when the build failed before (the image is then shown untiled)."""
+    cache_dir = tile_source['cacheDir']
+    if os.path.exists(os.path.join(cache_dir, 'complete')):
+        return True
+    with TILE_JOBS_LOCK:
+        if cache_dir in TILE_FAILURES:
+            return False
+        if cache_dir not in TILE_JOBS:
+            thread = threading.Thread(target=build_tile_pyramid, args=(tile_source,), name='ddr-tiles', daemon=True)
+            TILE_JOBS[cache_dir] = thread
+            thread.start()
+    return True
+
+
+def get_tile_file(tile_source, level, x, y):
+    """Path of a cached tile, TILE_PENDING while its pyramid is being built, None if out of range or failed.
+
+    Never waits for the build: a tile request holds a priority-gate slot, so the client is
+    told to retry instead (see the /tile route).
+    """
+    if not 0 <= level <= tile_source['maxLevel']:
+        return None
+    width, height = get_tile_level_size(tile_source, level)
+    if x * tile_source['tileSize'] >= width or y * tile_source['tileSize'] >= height:
+        return None
+    cache_dir = tile_source['cacheDir']
+    tile_path = get_tile_path(cache_dir, level, x, y)
+    # Tiles are written with os.replace(), so one that exists is complete
+    if os.path.exists(tile_path):
+        record_cache_lookup('tiles', True)
+        return tile_path
+    if os.path.exists(os.path.join(cache_dir, 'complete')):
+        return None
+    record_cache_lookup('tiles', False)
+    return TILE_PENDING if start_tile_pyramid(tile_source) else None
+
+
+# Metadata export: a generator pipeline (files -> records -> encoded lines) so
+# memory use does not grow with library size.
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_COLUMNS = ['path', 'root', 'file_size', 'modified', 'width', 'height'] + [
+    field.lower().replace(' ', '_') for field in METADATA_DISPLAY_FIELDS
+]
+
+
+def iter_export_records(roots, parse_cold=True):
+    """Yield one flat record per image, from the metadata index when warm, else parsed lazily."""
+    for alias, root_dir in roots:
+        entries = get_metadata_index(root_dir)
+        prefix = get_library_root_prefix(alias)
+        for relative_path in iter_root_images(root_dir):
+            file_path = os.path.join(root_dir, relative_path.replace('/', os.sep))
+            try:
+                stat_result = os.stat(file_path)
+            except OSError:
+                continue
+            entry = entries.get(relative_path)
+            fresh = is_index_entry_fresh(entry, stat_result) and 'error' not in entry
+            record_cache_lookup('metadata-index', fresh)
+            if not fresh:
+                if parse_cold:
+                    try:
+                        entry = extract_index_entry(root_dir, relative_path)
+                    except OSError:
+                        continue
+                else:
+                    entry = {}
+            record = {
+                'path': prefix + relative_path,
+                'root': root_dir,
+                'file_size': stat_result.st_size,
+                'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat(timespec='seconds'),
+                'width': entry.get('width'),
+                'height': entry.get('height'),
+            }
+            fields = entry.get('fields', {})
+            for field in METADATA_DISPLAY_FIELDS:
+                record[field.lower().replace(' ', '_')] = fields.get(field)
+            yield record
+
+
+def iter_jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_export_lines(export_format, roots, parse_cold=True):
+    records = iter_export_records(roots, parse_cold=parse_cold)
+    return iter_csv_lines(records) if export_format == 'csv' else iter_jsonl_lines(records)
+
+
+class ChunkedResponseWriter:
+    """Buffers writes and emits them as HTTP/1.1 chunked transfer-encoding frames."""
+
+    def __init__(self, wfile, chunk_size=64 * 1024):
+        self.wfile = wfile
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        if not self.buffer and len(data) >= self.chunk_size:
+            # Large writes (file copy blocks) go out as their own chunk without buffering
+            self.wfile.write(b'%X\r\n' % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+            return len(data)
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.wfile.write(b'%X\r\n' % len(self.buffer) + bytes(self.buffer) + b'\r\n')
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+# Streaming ZIP downloads: entries are STORED (the images are already compressed) and each
+# file is copied block by block into the chunked response, so memory stays at one copy
+# buffer and nothing is staged on disk. On the unseekable response stream zipfile writes
+# data descriptors after each entry, and ZIP64 records once entries or the archive get large.
+DOWNLOAD_ZIP_COPY_BYTES = 1024 * 1024
+DOWNLOAD_ZIP_MAX_BODY = 32 * 1024 * 1024
+ZIP_MIN_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def get_download_zip_name(name):
+    name = re.sub(r'[^A-Za-z0-9._ -]+', '-', os.path.splitext(name or '')[0]).strip(' .-')[:80]
+    return f"{name or 'darkroom-' + datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+
+
+def get_download_zip_entry_name(library_path):
+    """Archive name for a listing path: "@alias/x.png" becomes "alias/x.png"."""
+    alias, _, relative_path = split_library_path(library_path)
+    return f"{alias}/{relative_path}" if alias else relative_path
+
+
+def get_filtered_library_paths(favorite=None, min_rating=None, folder=''):
+    """Listing paths matching a server-side filter (favorite flag, minimum rating, folder prefix)."""
+    states = get_image_states() if get_state_settings()['store'] else {}
+    folder = (folder or '').replace('\\', '/').strip('/')
+    paths = []
+    for library_path in get_library_images():
+        if folder and library_path != folder and not library_path.startswith(folder + '/'):
+            continue
+        state = states.get(library_path)
+        if state is None and (favorite is not None or min_rating):
+            relative_path = split_library_path(library_path)[2]
+            state = {'rating': get_filename_rating(relative_path), 'favorite': is_favorites_path(relative_path)}
+        if favorite is not None and bool(state['favorite']) != favorite:
+            continue
+        if min_rating and state['rating'] < min_rating:
+            continue
+        paths.append(library_path)
+    return paths
+
+
+def write_download_zip(fileobj, files):
+    """Write [(library path, absolute path)] as a STORED ZIP to fileobj; returns (entries, bytes)."""
+    entries = total_bytes = 0
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for library_path, file_abs in files:
+            try:
+                source = open(file_abs, 'rb')
+            except OSError as e:
+                print(f"{format_timestamp()} WARNING: Skipping {library_path} in ZIP download: {e}", file=sys.stderr)
+                continue
+            with source:
+                stat = os.fstat(source.fileno())
+                info = zipfile.ZipInfo(
+                    get_download_zip_entry_name(library_path),
+                    date_time=max(time.localtime(stat.st_mtime)[:6], ZIP_MIN_DATE_TIME),
+                )
+                info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, 'w', force_zip64=stat.st_size >= zipfile.ZIP64_LIMIT) as target:
+                    shutil.copyfileobj(source, target, DOWNLOAD_ZIP_COPY_BYTES)
+            entries += 1
+            total_bytes += stat.st_size
+    return entries, total_bytes
+
+
+def run_export_command(export_format='jsonl', output=None, base_dir=None, parse_cold=True):
+    if base_dir:
+        roots = [('', os.path.abspath(base_dir))]
+    else:
+        runtime = load_runtime_config()
+        roots = [('', runtime['base_dir'])] if runtime.get('base_dir') else []
+        roots.extend(
+            (entry.get('alias') or make_library_root_alias(entry['path'], {}), entry['path'])
+            for entry in runtime.get('library_roots', [])
+            if isinstance(entry, dict) and entry.get('path')
+        )
+    roots = [(alias, root) for alias, root in roots if os.path.isdir(root)]
+    if not roots:
+        print(f"{format_timestamp()} ERROR: No library folder to export. Pass --base-dir.", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    count = 0
+    out = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        for line in iter_export_lines(export_format, roots, parse_cold=parse_cold):
+            out.write(line)
+            count += 1
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
+    if export_format == 'csv':
+        count = max(0, count - 1)
+    print(
+        f"{format_timestamp()}DARKROOM: Exported {count} records as {export_format.upper()} "
+        f"in {time.perf_counter() - started:.1f}s{f' to {output}' if output else ''}",
+        file=sys.stderr,
+    )
+    return 0
+
+
+# Image state store: ratings and favorites live in a per-root SQLite table
+# (.ddr-cache/state.sqlite) keyed by path relative to the root, so starring or rating an
+# image is one indexed row write and the file keeps its path. Files without a row fall back
+# to the legacy encoding (a "_0N" filename suffix and the root "Favorites" folder).
+# sync_image_state_to_files() applies pending rows to filenames/folders in one batch.
+STATE_DB_NAME = 'state.sqlite'
+STATE_DB_LOCK = threading.RLock()
+STATE_DB_CONNECTIONS = {}
+STATE_RATING_PATTERN = re.compile(r'_0([1-5])(\.[^.]+)$')
+STATE_FAVORITES_DIR = 'Favorites'
+
+
+def get_state_settings():
+    state_config = get_app_config().get('state', {}) or {}
+    return {
+        'store': bool(state_config.get('store', True)),
+        'syncToFiles': bool(state_config.get('syncToFiles', False)),
+    }
 
-                selected_folder = None
-                if requested_folder:
-                    selected_folder = requested_folder
-                else:
-                    selected_folder = pick_base_dir_dialog(get_active_base_dir())
 
-                if not selected_folder:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'selected': False, 'baseFolder': get_active_base_dir()}).encode())
-                    return
+def get_state_db(root_dir, create=True):
+    """Open (once per root) the state database; None when it does not exist and create is False."""
+    root_dir = os.path.abspath(root_dir)
+    with STATE_DB_LOCK:
+        conn = STATE_DB_CONNECTIONS.get(root_dir)
+        if conn is not None:
+            return conn
+        db_path = os.path.join(get_cache_dir(root_dir), STATE_DB_NAME)
+        if not create and not os.path.exists(db_path):
+            return None
+        import sqlite3
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS image_state (
+                path TEXT PRIMARY KEY,
+                rating INTEGER NOT NULL DEFAULT 0,
+                favorite INTEGER NOT NULL DEFAULT 0,
+                original_path TEXT,
+                synced INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS image_state_rating ON image_state(rating);
+            CREATE INDEX IF NOT EXISTS image_state_favorite ON image_state(favorite);
+            CREATE INDEX IF NOT EXISTS image_state_synced ON image_state(synced);
+        ''')
+        STATE_DB_CONNECTIONS[root_dir] = conn
+        return conn
 
-                selected_folder = set_active_base_dir(selected_folder, persist=True)
-                image_files = scan_images()
-                print(f"{format_timestamp()}DARKROOM: Base folder selected: {selected_folder}", file=sys.stderr)
 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps({
-                    'selected': True,
-                    'baseFolder': selected_folder,
-                    'images': image_files,
-                    'count': len(image_files)
-                }).encode())
-            except Exception as e:
-                error_msg = f'Failed to select base folder: {str(e)}'
-                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': error_msg}).encode())
-        elif path_without_query == '/update-embedded-list':
+def close_state_dbs():
+    with STATE_DB_LOCK:
+        for conn in STATE_DB_CONNECTIONS.values():
             try:
-                # Read the request body
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
-                
-                image_list = data.get('images', [])
-                
-                if not isinstance(image_list, list):
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'error': 'Missing or invalid images array'}).encode())
-                    return
-                
-                # Update the source ddr template file.
-                html_file = WEB_TEMPLATE_PATH
-                
-                if not os.path.exists(html_file):
-                    error_msg = f'HTML file not found: {html_file}'
-                    print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                    try:
-                        self.send_response(404)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'error': error_msg}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
-                    return
-                
-                # Read the HTML file
-                try:
-                    with open(html_file, 'r', encoding='utf-8') as f:
-                        html_content = f.read()
-                    
-                    # Generate JavaScript array
-                    js_array = json.dumps(image_list, indent=2)
-                    replacement = f'const embeddedImageList = {js_array};'
-                    
-                    # Find and replace the embedded image list
-                    pattern = r'const embeddedImageList = \[.*?\];'
-                    match = re.search(pattern, html_content, re.DOTALL)
-                    if match:
-                        html_content = html_content[:match.start()] + replacement + html_content[match.end():]
-                        
-                        # Write the updated HTML
-                        with open(html_file, 'w', encoding='utf-8') as f:
-                            f.write(html_content)
-                        
-                        print(f"{format_timestamp()}DARKROOM: Updated embedded image list in {html_file} with {len(image_list)} images", file=sys.stderr)
-                        
-                        try:
-                            self.send_response(200)
-                            self.send_header('Content-type', 'application/json')
-                            self.send_header('Access-Control-Allow-Origin', '*')
-                            self.end_headers()
-                            self.wfile.write(json.dumps({'success': True, 'count': len(image_list)}).encode())
-                        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                            pass
-                    else:
-                        error_msg = 'Could not find embeddedImageList in HTML file'
-                        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                        try:
-                            self.send_response(500)
-                            self.send_header('Content-type', 'application/json')
-                            self.end_headers()
-                            self.wfile.write(json.dumps({'error': error_msg}).encode())
-                        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                            pass
-                except Exception as e:
-                    error_msg = f'Failed to update HTML file: {str(e)}'
-                    print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                    try:
-                        self.send_response(500)
-                        self.send_header('Content-type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(json.dumps({'error': error_msg}).encode())
-                    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                        pass
-                    
-            except Exception as e:
-                error_msg = f'Server error: {str(e)}'
-                print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
-                import traceback
-                traceback.print_exc(file=sys.stderr)
-                try:
-                    self.send_response(500)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'error': error_msg}).encode())
-                except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError, OSError):
-                    pass
-        else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def log_message(self, format, *args):
-        # Suppress default HTTP request logging for cleaner output
-        # We handle our own logging with timestamps
-        pass
-    
-    def log_error(self, format, *args):
-        # Override to format errors with timestamp
-        message = format % args
-        print(f"{format_timestamp()} ERROR: {message}", file=sys.stderr)
+                conn.close()
+            except Exception:
+                pass
+        STATE_DB_CONNECTIONS.clear()
 
-# Find available port starting from 8000
-def find_available_port(start_port=8000, max_attempts=100):
-    for port in range(start_port, start_port + max_attempts):
-        try:
-            with socketserver.TCPServer(("", port), None):
-                return port
-        except OSError:
+
+def get_filename_rating(relative_path):
+    match = STATE_RATING_PATTERN.search(relative_path.rsplit('/', 1)[-1])
+    return int(match.group(1)) if match else 0
+
+
+def is_favorites_path(relative_path):
+    return relative_path.split('/', 1)[0] == STATE_FAVORITES_DIR
+
+
+def set_image_state(library_path, rating=None, favorite=None, original_path=None):
+    """Update one image's rating and/or favorite flag in a single transaction.
+
+    Images without a row start from what their path encodes. original_path (relative
+    to the same root) records where a favorite came from, for the later file sync.
+    """
+    alias, root_dir, relative_path = split_library_path(library_path)
+    prefix = get_library_root_prefix(alias)
+    if original_path and original_path.startswith(prefix):
+        original_path = original_path[len(prefix):]
+    conn = get_state_db(root_dir)
+    with STATE_DB_LOCK, conn:
+        row = conn.execute(
+            'SELECT rating, favorite, original_path FROM image_state WHERE path = ?', (relative_path,)
+        ).fetchone()
+        if row is None:
+            row = (get_filename_rating(relative_path), int(is_favorites_path(relative_path)), None)
+        new_rating = row[0] if rating is None else int(rating)
+        new_favorite = row[1] if favorite is None else int(bool(favorite))
+        new_original = row[2] or original_path
+        if new_favorite and not is_favorites_path(relative_path):
+            new_original = relative_path
+        conn.execute(
+            'INSERT OR REPLACE INTO image_state (path, rating, favorite, original_path, synced, updated) '
+            'VALUES (?, ?, ?, ?, 0, ?)',
+            (relative_path, new_rating, new_favorite, new_original, time.time()),
+        )
+    return {'path': library_path, 'rating': new_rating, 'favorite': bool(new_favorite)}
+
+
+def get_image_states(min_rating=None, favorite=None, roots=None):
+    """Return {library path: {rating, favorite}} for every stored row, optionally filtered."""
+    clauses, params = [], []
+    if min_rating is not None:
+        clauses.append('rating >= ?')
+        params.append(int(min_rating))
+    if favorite is not None:
+        clauses.append('favorite = ?')
+        params.append(int(bool(favorite)))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+    states = {}
+    for alias, root_dir in (roots if roots is not None else get_library_roots()):
+        conn = get_state_db(root_dir, create=False)
+        if conn is None:
             continue
-    raise Exception("Could not find an available port")
+        prefix = get_library_root_prefix(alias)
+        with STATE_DB_LOCK:
+            rows = conn.execute(f'SELECT path, rating, favorite FROM image_state{where}', params).fetchall()
+        for path, rating, is_favorite in rows:
+            states[prefix + path] = {'rating': rating, 'favorite': bool(is_favorite)}
+    return states
 
-# Function to scan for images in current directory and all subdirectories
-def scan_images():
-    base_dir = get_active_base_dir()
-    if not base_dir:
-        return []
 
-    image_exts = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-    image_files = []
-    
-    # Exclude 'samples' folder (contains README images)
-    excluded_folders = {'samples'}
-    
-    # Recursively walk through all directories
-    for root, dirs, files in os.walk(base_dir):
-        # Remove excluded folders from dirs to prevent walking into them
-        dirs[:] = [d for d in dirs if d not in excluded_folders]
-        
-        for f in files:
-            ext = os.path.splitext(f)[1].lower()
-            if ext in image_exts:
-                # Skip ddr.png in the root directory
-                if os.path.abspath(root) == os.path.abspath(base_dir) and f.lower() == 'ddr.png':
-                    continue
-                
-                rel_path = os.path.relpath(os.path.join(root, f), base_dir)
-                image_files.append(rel_path.replace('\\', '/'))
-    
-    return image_files
+def rename_image_state(old_library_path, new_library_path):
+    """Carry a row along when a file is moved through /move-file."""
+    _, old_root, old_relative = split_library_path(old_library_path)
+    _, new_root, new_relative = split_library_path(new_library_path)
+    conn = get_state_db(old_root, create=False) if old_root and old_root == new_root else None
+    if conn is None:
+        return
+    with STATE_DB_LOCK, conn:
+        conn.execute('DELETE FROM image_state WHERE path = ?', (new_relative,))
+        conn.execute('UPDATE image_state SET path = ? WHERE path = ?', (new_relative, old_relative))
+
+
+def delete_image_state(library_path):
+    _, root_dir, relative_path = split_library_path(library_path)
+    conn = get_state_db(root_dir, create=False) if root_dir else None
+    if conn is None:
+        return
+    with STATE_DB_LOCK, conn:
+        conn.execute('DELETE FROM image_state WHERE path = ?', (relative_path,))
+
+
+def get_synced_relative_path(relative_path, rating, favorite, original_path):
+    """Where the legacy filename/folder encoding puts an image with this state."""
+    if favorite:
+        directory = STATE_FAVORITES_DIR
+    elif is_favorites_path(relative_path):
+        directory = posixpath.dirname(original_path) if original_path else datetime.now().strftime('%Y-%m-%d')
+    else:
+        directory = posixpath.dirname(relative_path)
+    filename = STATE_RATING_PATTERN.sub(r'\2', relative_path.rsplit('/', 1)[-1])
+    if rating:
+        stem, ext = os.path.splitext(filename)
+        filename = f"{stem}_0{int(rating)}{ext}"
+    return posixpath.join(directory, filename) if directory else filename
+
+
+def sync_image_state_to_files(roots=None):
+    """Apply every unsynced row to the filesystem (rename/move), one root at a time."""
+    moved = skipped = 0
+    for alias, root_dir in (roots if roots is not None else get_library_roots()):
+        conn = get_state_db(root_dir, create=False)
+        if conn is None:
+            continue
+        with STATE_DB_LOCK:
+            rows = conn.execute(
+                'SELECT path, rating, favorite, original_path FROM image_state WHERE synced = 0'
+            ).fetchall()
+        updates = []
+        for relative_path, rating, favorite, original_path in rows:
+            target_path = get_synced_relative_path(relative_path, rating, favorite, original_path)
+            source_abs = os.path.join(root_dir, relative_path.replace('/', os.sep))
+            target_abs = os.path.normpath(os.path.join(root_dir, target_path.replace('/', os.sep)))
+            if target_path == relative_path:
+                updates.append((relative_path, relative_path))
+                continue
+            if not os.path.isfile(source_abs) or os.path.exists(target_abs) or not is_path_within(root_dir, target_abs):
+                print(
+                    f"{format_timestamp()} WARNING: State sync skipped {get_library_root_prefix(alias)}{relative_path} "
+                    f"-> {target_path} (source missing or target exists)",
+                    file=sys.stderr,
+                )
+                skipped += 1
+                continue
+            try:
+                os.makedirs(os.path.dirname(target_abs), exist_ok=True)
+                shutil.move(source_abs, target_abs)
+            except OSError as e:
+                print(f"{format_timestamp()} WARNING: State sync could not move {relative_path}: {e}", file=sys.stderr)
+                skipped += 1
+                continue
+            updates.append((relative_path, target_path))
+            moved += 1
+        with STATE_DB_LOCK, conn:
+            for relative_path, target_path in updates:
+                if target_path != relative_path:
+                    conn.execute('DELETE FROM image_state WHERE path = ?', (target_path,))
+                conn.execute(
+                    'UPDATE image_state SET path = ?, synced = 1, '
+                    'original_path = CASE WHEN favorite THEN original_path ELSE NULL END WHERE path = ?',
+                    (target_path, relative_path),
+                )
+    if moved or skipped:
+        print(f"{format_timestamp()}DARKROOM: State sync moved {moved} files ({skipped} skipped)", file=sys.stderr)
+    return {'moved': moved, 'skipped': skipped}
+
+
+def run_sync_state_command(base_dir=None):
+    if base_dir:
+        roots = [('', os.path.abspath(base_dir))]
+    else:
+        runtime = load_runtime_config()
+        roots = [('', runtime['base_dir'])] if runtime.get('base_dir') else []
+        roots.extend(
+            (entry.get('alias') or make_library_root_alias(entry['path'], {}), entry['path'])
+            for entry in runtime.get('library_roots', [])
+            if isinstance(entry, dict) and entry.get('path')
+        )
+    roots = [(alias, root) for alias, root in roots if os.path.isdir(root)]
+    if not roots:
+        print(f"{format_timestamp()} ERROR: No library folder to sync. Pass --base-dir.", file=sys.stderr)
+        return 1
+    result = sync_image_state_to_files(roots)
+    close_state_dbs()
+    return 0 if not result['skipped'] else 2
+
 
 def inject_embedded_image_list(html_file=None):
-    html_file = html_file or WEB_TEMPLATE_PATH
+    html_file = html_file or get_web_template_path()
     image_files = scan_images()
     if not os.path.exists(html_file):
         print(f"Error: {html_file} not found", file=sys.stderr)
@@ -963,8 +4674,308 @@ def inject_embedded_image_list(html_file=None):
     return image_files
 
 
-def create_server(port):
-    return socketserver.TCPServer(("", port), CustomHTTPRequestHandler)
+# Library file operations and JSON responses shared by the HTTP routes and the desktop
+# bridge. Each operation returns (status, body) with the body the route sends.
+def move_library_file(old_path, new_path):
+    """Move/rename one library file inside its root, carrying its stored state along."""
+    if not old_path or not new_path:
+        return 400, {'error': 'Missing oldPath or newPath'}
+
+    # Resolve against the library root the path belongs to
+    # (primary base folder, or "@alias/..." for extra roots).
+    old_root, old_abs = resolve_library_path(old_path)
+    new_root, new_abs = resolve_library_path(new_path)
+    
+    # Ensure both paths stay inside the same root (security check)
+    if not old_abs or not new_abs or old_root != new_root:
+        error_msg = f'Path outside allowed directory. Root: {old_root}, Old: {old_path}, New: {new_path}'
+        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+        return 403, {'error': error_msg}
+    
+    # Check if source file exists
+    if not os.path.exists(old_abs):
+        error_msg = f'Source file not found: {old_abs}'
+        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+        return 404, {'error': error_msg}
+    
+    # Create destination directory if it doesn't exist
+    new_dir = os.path.dirname(new_abs)
+    if not os.path.exists(new_dir):
+        try:
+            os.makedirs(new_dir)
+            print(f"{format_timestamp()} Created directory: {new_dir}", file=sys.stderr)
+        except Exception as e:
+            error_msg = f'Failed to create directory {new_dir}: {str(e)}'
+            print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+            return 500, {'error': error_msg}
+    
+    # Move the file
+    try:
+        shutil.move(old_abs, new_abs)
+        rename_image_state(old_path, new_path)
+        
+        # Determine the type of operation for better log messages
+        old_basename = os.path.basename(old_abs)
+        new_basename = os.path.basename(new_abs)
+        new_path_str = new_abs.replace('\\', '/')
+        old_path_str = old_abs.replace('\\', '/')
+        
+        # Check if it's a favorite operation (moving TO Favorites folder)
+        is_favoriting = 'Favorites' in new_path_str and 'Favorites' not in old_path_str
+        
+        # Check if it's a rating operation (filename changes to include _0[1-5] pattern)
+        old_rating_match = re.search(r'_0([1-5])(\.[^.]+)$', old_basename)
+        new_rating_match = re.search(r'_0([1-5])(\.[^.]+)$', new_basename)
+        is_rating = (old_rating_match is not None) != (new_rating_match is not None) or (old_rating_match and new_rating_match and old_rating_match.group(1) != new_rating_match.group(1))
+        
+        if is_favoriting:
+            # Favorite operation - show simplified message (only when moving TO favorites)
+            print(f"{format_timestamp()}FILE: Image file favorited and moved to Favorites folder: {new_basename}", file=sys.stderr)
+        elif is_rating:
+            # Rating operation - extract rating and show message
+            if new_rating_match:
+                rating = int(new_rating_match.group(1))
+                print(f"{format_timestamp()}FILE: Image file set '{rating} Star{'s' if rating > 1 else ''}' and renamed to: {new_basename}", file=sys.stderr)
+            else:
+                # Rating removed
+                print(f"{format_timestamp()}FILE: Image file rating removed and renamed to: {new_basename}", file=sys.stderr)
+        else:
+            # Generic move operation (fallback)
+            print(f"{format_timestamp()} Successfully moved file: {old_basename} -> {new_basename}", file=sys.stderr)
+        return 200, {'success': True, 'message': 'File moved successfully'}
+    except Exception as e:
+        error_msg = f'Failed to move file: {str(e)}'
+        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+        return 500, {'error': error_msg}
+
+
+def delete_library_file(file_path):
+    if not file_path:
+        return 400, {'error': 'Missing filePath'}
+
+    # Resolve against the library root the path belongs to.
+    file_root, file_abs = resolve_library_path(file_path)
+
+    # Ensure path is within its root (security check)
+    if not file_abs:
+        error_msg = f'Path outside allowed directory. Root: {file_root}, File: {file_path}'
+        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+        return 403, {'error': error_msg}
+
+    # Check if file exists
+    if not os.path.exists(file_abs):
+        error_msg = f'File not found: {file_abs}'
+        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+        return 404, {'error': error_msg}
+
+    try:
+        os.remove(file_abs)
+        delete_image_state(file_path)
+        print(f"{format_timestamp()}FILE: Image file deleted: {os.path.basename(file_abs)}", file=sys.stderr)
+        return 200, {'success': True, 'message': 'File deleted successfully'}
+    except Exception as e:
+        error_msg = f'Failed to delete file: {str(e)}'
+        print(f"{format_timestamp()} ERROR: {error_msg}", file=sys.stderr)
+        return 500, {'error': error_msg}
+
+
+def update_image_state(data):
+    library_path = (data.get('path') or '').replace('\\', '/')
+    rating = data.get('rating')
+    favorite = data.get('favorite')
+    _, file_abs = resolve_library_path(library_path)
+    if not get_state_settings()['store']:
+        return 409, {'error': 'State store is disabled'}
+    if not library_path or not file_abs or not os.path.isfile(file_abs):
+        return 404, {'error': f'File not found: {library_path}'}
+    if rating is not None and (not isinstance(rating, int) or not 0 <= rating <= 5):
+        return 400, {'error': 'rating must be an integer from 0 to 5'}
+    return 200, set_image_state(
+        library_path,
+        rating=rating,
+        favorite=None if favorite is None else bool(favorite),
+        original_path=data.get('originalPath') or None,
+    )
+
+
+def get_image_state_response(min_rating=None, favorite=None):
+    state_settings = get_state_settings()
+    entries = get_image_states(
+        min_rating=int(min_rating) if min_rating else None,
+        favorite=str(favorite).lower() in ('1', 'true') if favorite else None,
+    ) if state_settings['store'] else {}
+    return {
+        'enabled': state_settings['store'],
+        'syncToFiles': state_settings['syncToFiles'],
+        'entries': entries,
+    }
+
+
+def get_library_listing_response(compact=False, scope=''):
+    response = get_library_listing(compact=compact, scope=scope)
+    response['baseFolder'] = get_active_base_dir()
+    response['roots'] = describe_library_roots()
+    return response
+
+
+def rescan_library(compact=False, scope=''):
+    if scope:
+        alias, root_dir, rel_dir = split_library_scope(scope)
+        started = time.perf_counter()
+        listing = scan_library_shard(alias, root_dir, rel_dir)
+        response = build_scoped_listing_response(alias, rel_dir, listing, compact)
+        record_scan_metrics(time.perf_counter() - started, response['count'])
+        response['baseFolder'] = get_active_base_dir()
+        response['roots'] = describe_library_roots()
+        print(f"{format_timestamp()}DARKROOM: Folder {response['scope']} Re-Scanned: {response['count']} images", file=sys.stderr)
+        return response
+    roots = rescan_library_shards()
+    if compact:
+        response = merge_compact_listings(roots)
+    else:
+        image_files = merge_library_shards(roots)
+        response = {'images': image_files, 'count': len(image_files)}
+    response['baseFolder'] = get_active_base_dir()
+    response['roots'] = describe_library_roots()
+    print(f"{format_timestamp()}DARKROOM: Images Folders Re-Scanned and Loaded: {response['count']} images", file=sys.stderr)
+    return response
+
+
+def run_listing_request(build_response, compact=False, scope=''):
+    """(status, body) of a listing builder; a scope that is not a library folder is a 400."""
+    try:
+        return 200, build_response(compact=compact, scope=scope)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+
+def get_folders_response(path=''):
+    try:
+        return 200, list_library_folders(path)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+
+def get_corrupt_files_response(scope=''):
+    try:
+        return 200, list_corrupt_files(scope)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+
+def run_query_request(data):
+    """POST /query body: {filters: {field: {min, max, in}}, sort: {field, direction}, limit}."""
+    if not isinstance(data, dict):
+        return 400, {'error': 'Query must be an object'}
+    sort = data.get('sort') if isinstance(data.get('sort'), dict) else {}
+    try:
+        return 200, query_library(
+            filters=data.get('filters') or {},
+            sort=sort.get('field') or None,
+            descending=sort.get('direction') == 'desc',
+            limit=data.get('limit'),
+            scope=data.get('scope') or '',
+        )
+    except (TypeError, ValueError) as e:
+        return 400, {'error': str(e)}
+
+
+def get_current_base_folder_response():
+    base_dir = get_active_base_dir()
+    return {
+        'baseFolder': base_dir,
+        'isSelected': bool(base_dir),
+        'roots': describe_library_roots(),
+    }
+
+
+class DesktopBridgeApi:
+    """Engine calls for the pywebview js_api, so the desktop page skips loopback HTTP.
+
+    Every method returns {"status": ..., "body": ...} where body is what the matching HTTP
+    route would send; ddr.html maps routes onto these methods when the bridge is present.
+    Image bytes (files, thumbnails, tiles) still go over HTTP.
+    """
+
+    def _call(self, route, operation):
+        started_at = time.perf_counter()
+        try:
+            status, body = operation()
+        except Exception as e:
+            print(f"{format_timestamp()} ERROR: Bridge call {route} failed: {type(e).__name__} - {str(e)}", file=sys.stderr)
+            status, body = 500, {'error': str(e)}
+        record_request_metrics('BRIDGE', route, status, time.perf_counter() - started_at, 0)
+        return {'status': status, 'body': body}
+
+    def library_listing(self, compact=True, scope=''):
+        return self._call('/library-listing', lambda: run_listing_request(get_library_listing_response, bool(compact), scope or ''))
+
+    def rescan(self, compact=True, scope=''):
+        return self._call('/rescan-images', lambda: run_listing_request(rescan_library, bool(compact), scope or ''))
+
+    def folders(self, path=''):
+        return self._call('/folders', lambda: get_folders_response(path or ''))
+
+    def current_base_folder(self):
+        return self._call('/current-base-folder', lambda: (200, get_current_base_folder_response()))
+
+    def metadata_lookup(self, paths):
+        def lookup():
+            requested = paths if isinstance(paths, list) else []
+            entries = lookup_indexed_metadata(requested[:5000])
+            return 200, {'entries': entries, 'missing': len(requested) - len(entries)}
+        return self._call('/metadata-lookup', lookup)
+
+    def query(self, data):
+        return self._call('/query', lambda: run_query_request(data))
+
+    def corrupt_files(self, scope=''):
+        return self._call('/corrupt-files', lambda: get_corrupt_files_response(scope or ''))
+
+    def image_states(self, min_rating=None, favorite=None):
+        return self._call('/image-state', lambda: (200, get_image_state_response(min_rating=min_rating, favorite=favorite)))
+
+    def set_image_state(self, data):
+        return self._call('/image-state', lambda: update_image_state(data if isinstance(data, dict) else {}))
+
+    def move_files(self, moves):
+        """Batch move: [{oldPath, newPath}, ...] -> per-file {status, body} results."""
+        def move_all():
+            results = []
+            for move in moves if isinstance(moves, list) else []:
+                move = move if isinstance(move, dict) else {}
+                status, body = move_library_file(move.get('oldPath', ''), move.get('newPath', ''))
+                results.append({'status': status, 'body': body})
+            return 200, {'results': results}
+        return self._call('/move-file', move_all)
+
+    def delete_files(self, paths):
+        """Batch delete: [path, ...] -> per-file {status, body} results."""
+        def delete_all():
+            results = []
+            for file_path in paths if isinstance(paths, list) else []:
+                status, body = delete_library_file(file_path if isinstance(file_path, str) else '')
+                results.append({'status': status, 'body': body})
+            return 200, {'results': results}
+        return self._call('/delete-file', delete_all)
+
+
+class DarkroomHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Thread per connection; the request priority gate bounds how many handlers run at once."""
+    daemon_threads = True
+    # Several LAN browsers open connections in bursts; the socketserver default backlog of 5
+    # drops SYNs and costs those clients a one-second retransmit.
+    request_queue_size = 128
+
+
+def create_server(port=None, preferred_port=8000, bind=''):
+    """Bind the listening socket in one attempt; if the preferred port is taken, let the OS pick one."""
+    if port:
+        return DarkroomHTTPServer((bind, int(port)), CustomHTTPRequestHandler)
+    try:
+        return DarkroomHTTPServer((bind, preferred_port), CustomHTTPRequestHandler)
+    except OSError:
+        return DarkroomHTTPServer((bind, 0), CustomHTTPRequestHandler)
 
 
 def start_server_thread(httpd):
@@ -974,6 +4985,13 @@ def start_server_thread(httpd):
 
 
 def stop_server(httpd):
+    flush_action_logs()
+    if get_state_settings()['syncToFiles']:
+        try:
+            sync_image_state_to_files()
+        except Exception as e:
+            print(f"{format_timestamp()} ERROR: State sync failed: {e}", file=sys.stderr)
+    close_state_dbs()
     try:
         shutdown_thread = threading.Thread(target=httpd.shutdown, daemon=True)
         shutdown_thread.start()
@@ -991,9 +5009,11 @@ def build_ddr_url(port):
     return f"http://localhost:{port}/ddr.html?v={timestamp}"
 
 
-def bootstrap(mode='web', host='localhost', port=None, base_dir=None):
+def bootstrap(mode='web', host='localhost', port=None, base_dir=None, bind=None):
+    global HOT_TIMING_ENABLED
     print(f"{format_timestamp()}DARKROOM: Starting...", file=sys.stderr)
     os.chdir(APP_DIR)
+    HOT_TIMING_ENABLED = bool(get_app_config().get('web', {}).get('debugMode'))
 
     configured_base_dir = load_runtime_config().get('base_dir')
     initial_base_dir = base_dir or configured_base_dir
@@ -1005,29 +5025,54 @@ def bootstrap(mode='web', host='localhost', port=None, base_dir=None):
             set_active_base_dir(None, persist=False)
     else:
         set_active_base_dir(None, persist=False)
+    restore_library_roots()
+    cached_count = load_cached_listings()
+    mark_startup('library roots')
     if get_active_base_dir():
         print(f"{format_timestamp()}DARKROOM: Active image root folder: {get_active_base_dir()}", file=sys.stderr)
     else:
         print(f"{format_timestamp()}DARKROOM: No image root folder selected yet", file=sys.stderr)
+    for alias, path in get_library_roots():
+        if alias:
+            print(f"{format_timestamp()}DARKROOM: Extra library root: {LIBRARY_ROOT_PREFIX}{alias} -> {path}", file=sys.stderr)
 
-    selected_port = int(port) if port else find_available_port()
-    print(f"{format_timestamp()}DARKROOM: Starting Web Server on Port {selected_port}", file=sys.stderr)
+    if cached_count:
+        print(f"{format_timestamp()}DARKROOM: Serving {cached_count} cached listing entries until the scan completes", file=sys.stderr)
 
-    httpd = create_server(selected_port)
+    server_settings = get_server_settings()
+    bind = server_settings['bind'] if bind is None else bind
+    httpd = create_server(port, bind=bind)
+    selected_port = httpd.server_address[1]
+    mark_startup('server bound')
+    print(f"{format_timestamp()}DARKROOM: Starting Web Server on Port {selected_port}", file=sys.stderr)
+    if server_settings['multiClient']:
+        lan_host = bind if bind not in ('', '0.0.0.0', '::') else get_lan_address()
+        if lan_host and not is_loopback_address(lan_host):
+            print(f"{format_timestamp()}DARKROOM: Multi-client mode: LAN clients can open http://{lan_host}:{selected_port}/ddr.html", file=sys.stderr)
+        else:
+            print(f"{format_timestamp()} WARNING: Multi-client mode is on but the server is bound to {bind}", file=sys.stderr)
     url = build_ddr_url(selected_port).replace('localhost', host, 1)
 
+    # The gallery shell is served right away; the library scan fills in behind it. With
+    # server.startupScan off, roots are only walked on demand (a scoped view or a rescan).
+    if server_settings['startupScan']:
+        start_background_scan()
+
     if mode == 'web':
+        import webbrowser
         print(f"{format_timestamp()}DARKROOM: Opening {url}", file=sys.stderr)
         webbrowser.open(url)
 
+    mark_startup('ready')
     print(f"{format_timestamp()}DARKROOM: Server Ready: Listening on port {selected_port}", file=sys.stderr)
+    report_startup_profile()
     return httpd, selected_port, url
 
 
-def run_web_mode(port=None, base_dir=None):
+def run_web_mode(port=None, base_dir=None, bind=None):
     httpd = None
     try:
-        httpd, selected_port, _ = bootstrap(mode='web', port=port, base_dir=base_dir)
+        httpd, selected_port, _ = bootstrap(mode='web', port=port, base_dir=base_dir, bind=bind)
         print(f"{format_timestamp()}DARKROOM: Server is running. Press Ctrl+C to stop.", file=sys.stderr)
         httpd.serve_forever()
     except KeyboardInterrupt:
@@ -1044,6 +5089,15 @@ def run_web_mode(port=None, base_dir=None):
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Diffusion Darkroom server launcher")
+    parser.add_argument(
+        'command',
+        nargs='?',
+        choices=['serve', 'index', 'export', 'sync-state'],
+        default='serve',
+        help='serve: run the gallery server (default), index: prebuild metadata/thumbnail caches and exit, '
+             'export: write library metadata as JSONL/CSV and exit, '
+             'sync-state: apply stored ratings/favorites to filenames and folders and exit',
+    )
     parser.add_argument(
         '--mode',
         choices=['web', 'desktop'],
@@ -1051,17 +5105,52 @@ def parse_args():
         help='web: open browser automatically, desktop: server only (for PyWebView shell)',
     )
     parser.add_argument('--port', type=int, default=None, help='Optional fixed port')
+    parser.add_argument('--bind', default=None, help='Address to listen on (default: server.bind, all interfaces when empty)')
     parser.add_argument('--base-dir', default=None, help='Optional runtime folder for scanning/serving')
+    parser.add_argument('--jobs', type=int, default=None, help='index: worker processes (default: CPU count)')
+    parser.add_argument('--no-thumbnails', action='store_true', help='index: skip thumbnail generation')
+    parser.add_argument('--force', action='store_true', help='index: ignore the existing index and rebuild')
+    parser.add_argument('--scope', default='', help='index: only this folder of each root (relative path)')
+    parser.add_argument('--no-verify', action='store_true', help='index: skip PNG/JPEG/WebP integrity checks')
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='jsonl', help='export: output format')
+    parser.add_argument('--output', default=None, help='export: output file (default: stdout)')
+    parser.add_argument('--index-only', action='store_true', help='export: do not parse files missing from the index')
     return parser.parse_args()
 
 
 if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
     args = parse_args()
-    if args.mode == 'desktop':
+    if args.command == 'index':
+        try:
+            sys.exit(run_index_command(
+                base_dir=args.base_dir,
+                jobs=args.jobs,
+                thumbnails=False if args.no_thumbnails else None,
+                force=args.force,
+                scope=args.scope,
+                verify=False if args.no_verify else None,
+            ))
+        except KeyboardInterrupt:
+            sys.exit(130)
+    elif args.command == 'export':
+        try:
+            sys.exit(run_export_command(
+                export_format=args.format,
+                output=args.output,
+                base_dir=args.base_dir,
+                parse_cold=not args.index_only,
+            ))
+        except (KeyboardInterrupt, BrokenPipeError):
+            sys.exit(130)
+    elif args.command == 'sync-state':
+        sys.exit(run_sync_state_command(base_dir=args.base_dir))
+    elif args.mode == 'desktop':
         # Desktop mode keeps this process as server-only; the desktop shell owns the window.
         httpd = None
         try:
-            httpd, _, _ = bootstrap(mode='desktop', port=args.port, base_dir=args.base_dir)
+            httpd, _, _ = bootstrap(mode='desktop', port=args.port, base_dir=args.base_dir, bind=args.bind)
             print(f"{format_timestamp()}DARKROOM: Desktop server running. Press Ctrl+C to stop.", file=sys.stderr)
             httpd.serve_forever()
         except KeyboardInterrupt:
@@ -1070,4 +5159,4 @@ if __name__ == '__main__':
             if httpd:
                 stop_server(httpd)
     else:
-        run_web_mode(port=args.port, base_dir=args.base_dir)
+        run_web_mode(port=args.port, base_dir=args.base_dir, bind=args.bind)
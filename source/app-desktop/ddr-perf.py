@@ -0,0 +1,292 @@
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+# Performance tools for Diffusion Darkroom (stdlib only).
+#   loadtest:     N simulated browsers browse a running server's shared library at once,
+#                 paging, filtering and sorting (/query); reports latency percentiles per
+#                 route, throughput and errors.
+#   bench-routes: in-process cost of mapping request URLs to files (time and filesystem
+#                 calls per request) for library images, app assets and misses.
+
+LOADTEST_PAGE_SIZE = 50
+LOADTEST_THUMBNAILS_PER_PAGE = 8
+# Parameter fields a simulated client filters on, and the sorts it cycles through (None: gallery order)
+LOADTEST_QUERY_FIELDS = ('steps', 'cfg', 'width', 'height')
+LOADTEST_QUERY_SORTS = (None, ('steps', 'asc'), ('cfg', 'desc'), ('seed', 'asc'), ('width', 'desc'))
+BENCH_ROUTES_SAMPLE = 2000
+ENGINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ddr-engine.py')
+
+
+def load_engine():
+    spec = importlib.util.spec_from_file_location('ddr_engine_module', ENGINE_PATH)
+    engine = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(engine)
+    return engine
+
+
+# Importing the engine is cheap (config and caches load lazily); its timestamps keep perf
+# output in the same format as the server log it runs next to.
+ENGINE_MODULE = load_engine()
+format_timestamp = ENGINE_MODULE.format_timestamp
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadTestClient(threading.Thread):
+    """One simulated browser: its own session cookie, paging through the library."""
+
+    def __init__(self, base_url, client_index, paths, deadline, results, results_lock):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.client_index = client_index
+        self.paths = paths
+        self.deadline = deadline
+        self.results = results
+        self.results_lock = results_lock
+        self.cookie = None
+        self.random = random.Random(client_index)
+        self.field_ranges = {}
+
+    def request(self, route, path, data=None, method=None, priority=None, allowed_statuses=()):
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if priority:
+            headers['X-DDR-Priority'] = priority
+        if data is not None:
+            data = json.dumps(data).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        status = 0
+        size = 0
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                status = response.status
+                body = response.read()
+                size = len(body)
+                cookie = response.headers.get('Set-Cookie')
+                if cookie:
+                    self.cookie = cookie.split(';', 1)[0]
+        except urllib.error.HTTPError as e:
+            status = e.code
+            body = b''
+        except (urllib.error.URLError, OSError):
+            body = b''
+        elapsed = time.perf_counter() - started
+        ok = 200 <= status < 400 or status in allowed_statuses
+        with self.results_lock:
+            self.results.append((route, ok, elapsed, size))
+        return status, body
+
+    def build_query(self, iteration):
+        """A /query body like the Parameters popover sends: a random sub-range of one or two
+        indexed fields, plus the next sort in LOADTEST_QUERY_SORTS."""
+        filters = {}
+        fields = [field for field in LOADTEST_QUERY_FIELDS if (self.field_ranges.get(field) or {}).get('count')]
+        for field in self.random.sample(fields, min(len(fields), self.random.randint(1, 2))):
+            low, high = self.field_ranges[field]['min'], self.field_ranges[field]['max']
+            bounds = sorted(self.random.uniform(low, high) for _ in range(2))
+            filters[field] = {'min': bounds[0], 'max': bounds[1]}
+        query = {'filters': filters}
+        sort = LOADTEST_QUERY_SORTS[iteration % len(LOADTEST_QUERY_SORTS)]
+        if sort:
+            query['sort'] = {'field': sort[0], 'direction': sort[1]}
+        return query
+
+    def run(self):
+        self.request('/session', '/session')
+        status, body = self.request('GET /query', '/query', priority='page')
+        if status == 200:
+            try:
+                self.field_ranges = json.loads(body.decode('utf-8')).get('fields') or {}
+            except ValueError:
+                pass
+        page = self.client_index
+        iteration = 0
+        while time.perf_counter() < self.deadline:
+            self.request('/library-listing', '/library-listing?format=compact', priority='page')
+            view_paths = self.paths
+            if iteration % 2:
+                # Every other round browses a filtered, sorted view instead of the whole library
+                status, body = self.request('POST /query', '/query', data=self.build_query(iteration), priority='page')
+                if status == 200:
+                    try:
+                        view_paths = json.loads(body.decode('utf-8')).get('paths') or []
+                    except ValueError:
+                        pass
+            iteration += 1
+            pages = max(1, math.ceil(len(view_paths) / LOADTEST_PAGE_SIZE))
+            start = (page % pages) * LOADTEST_PAGE_SIZE
+            page_paths = view_paths[start:start + LOADTEST_PAGE_SIZE]
+            self.request('/metadata-lookup', '/metadata-lookup', data={'paths': page_paths}, priority='page')
+            for path in page_paths[:LOADTEST_THUMBNAILS_PER_PAGE]:
+                # Without a prebuilt thumbnail the gallery loads the image itself
+                status, _ = self.request('/thumbnail', f'/thumbnail?path={quote(path)}', priority='visible', allowed_statuses=(404,))
+                if status == 404:
+                    self.request('image', '/' + quote(path), priority='visible')
+            self.request('/image-state', '/image-state?favorite=1', priority='background')
+            self.request('/session', '/session', data={'view': {'currentPage': page % pages + 1}})
+            page += 1
+
+
+def run_loadtest(base_url, clients=20, duration=30.0):
+    base_url = base_url.rstrip('/')
+    try:
+        with urllib.request.urlopen(f'{base_url}/library-listing', timeout=30) as response:
+            paths = json.loads(response.read().decode('utf-8')).get('images') or []
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        print(f"{format_timestamp()}DARKROOM PERF ERROR: Cannot reach {base_url}: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"{format_timestamp()}DARKROOM PERF: {clients} clients for {duration:g}s against {base_url} "
+        f"({len(paths)} images)",
+        file=sys.stderr,
+    )
+
+    results = []
+    results_lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration
+    workers = [LoadTestClient(base_url, i, paths, deadline, results, results_lock) for i in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    by_route = {}
+    for route, ok, latency, size in results:
+        by_route.setdefault(route, []).append((ok, latency, size))
+    rows = [('route', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'KB/req')]
+    for route, samples in sorted(by_route.items()) + [('all', [(s, l, b) for _, s, l, b in results])]:
+        latencies = sorted(latency for _, latency, _ in samples)
+        errors = sum(1 for ok, _, _ in samples if not ok)
+        rows.append((
+            route,
+            str(len(samples)),
+            str(errors),
+            f'{percentile(latencies, 0.50) * 1000:.1f}',
+            f'{percentile(latencies, 0.95) * 1000:.1f}',
+            f'{percentile(latencies, 0.99) * 1000:.1f}',
+            f'{sum(size for _, _, size in samples) / max(1, len(samples)) / 1024:.1f}',
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+    total_errors = sum(1 for _, ok, _, _ in results if not ok)
+    print(f"\n{len(results)} requests in {elapsed:.1f}s: {len(results) / max(elapsed, 1e-9):.1f} req/s, {total_errors} errors")
+    return 1 if total_errors else 0
+
+
+class FilesystemCallCounter:
+    """Counts os.stat/lstat/scandir calls (exists/isdir/isfile go through os.stat) while active."""
+
+    PATCHED = ('stat', 'lstat', 'scandir')
+
+    def __init__(self):
+        self.calls = 0
+        self.originals = {}
+
+    def __enter__(self):
+        for name in self.PATCHED:
+            original = getattr(os, name)
+            self.originals[name] = original
+
+            def counted(*args, _original=original, **kwargs):
+                self.calls += 1
+                return _original(*args, **kwargs)
+            setattr(os, name, counted)
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self.originals.items():
+            setattr(os, name, original)
+        return False
+
+
+def run_bench_routes(base_dir=None, repeat=5):
+    engine = ENGINE_MODULE
+    base_dir = base_dir or engine.load_runtime_config().get('base_dir')
+    if not base_dir or not os.path.isdir(base_dir):
+        print(f"{format_timestamp()}DARKROOM PERF ERROR: No image folder (pass --base-dir)", file=sys.stderr)
+        return 1
+    engine.set_active_base_dir(base_dir, persist=False)
+    engine.restore_library_roots()
+    image_paths = engine.get_library_images()
+
+    # The first asset and image requests build the route table and the listing's per-folder
+    # row index; report that separately
+    with FilesystemCallCounter() as counter:
+        started = time.perf_counter()
+        engine.resolve_request_path('/favicon.ico')
+        if image_paths:
+            engine.resolve_request_path('/' + image_paths[0])
+        setup_ms = (time.perf_counter() - started) * 1000
+    print(f"{format_timestamp()}DARKROOM PERF: {len(image_paths)} images; route table and folder index built in "
+          f"{setup_ms:.1f} ms ({counter.calls} filesystem calls)", file=sys.stderr)
+
+    cases = [
+        ('image', ['/' + path for path in image_paths[:BENCH_ROUTES_SAMPLE]]),
+        ('asset', sorted(engine.get_static_routes())[:BENCH_ROUTES_SAMPLE]),
+        ('miss', [f'/missing/{i}.png' for i in range(min(BENCH_ROUTES_SAMPLE, max(1, len(image_paths))))]),
+    ]
+
+    rows = [('case', 'requests', 'us/request', 'fs calls/request')]
+    for case, request_paths in cases:
+        if not request_paths:
+            continue
+        with FilesystemCallCounter() as counter:
+            for request_path in request_paths:
+                engine.resolve_request_path(request_path)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for request_path in request_paths:
+                engine.resolve_request_path(request_path)
+        per_request_us = (time.perf_counter() - started) / (repeat * len(request_paths)) * 1e6
+        rows.append((case, str(len(request_paths)), f'{per_request_us:.2f}', f'{counter.calls / len(request_paths):.2f}'))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Diffusion Darkroom performance tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    loadtest = subparsers.add_parser('loadtest', help='simulate concurrent browsers against a running server')
+    loadtest.add_argument('--url', default='http://127.0.0.1:8000', help='server base URL')
+    loadtest.add_argument('--clients', type=int, default=20, help='simulated clients (default: 20)')
+    loadtest.add_argument('--duration', type=float, default=30.0, help='seconds to run (default: 30)')
+
+    bench_routes = subparsers.add_parser('bench-routes', help='time URL-to-file resolution in-process')
+    bench_routes.add_argument('--base-dir', default=None, help='image folder (default: the saved base folder)')
+    bench_routes.add_argument('--repeat', type=int, default=5, help='timing passes over the sample (default: 5)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'loadtest':
+        try:
+            sys.exit(run_loadtest(args.url, clients=max(1, args.clients), duration=max(1.0, args.duration)))
+        except KeyboardInterrupt:
+            sys.exit(130)
+    elif args.command == 'bench-routes':
+        sys.exit(run_bench_routes(base_dir=args.base_dir, repeat=max(1, args.repeat)))